@@ -1,6 +1,13 @@
 # SPDX-FileCopyrightText: 2023-present Patrick Sadil <psadil@gmail.com>
 #
 # SPDX-License-Identifier: MIT
-from importlib.metadata import version
 
-__version__ = version("snapshot")
+
+def __getattr__(name: str) -> str:
+    # importlib.metadata takes longer to import than the rest of the package
+    if name == "__version__":
+        from importlib.metadata import version
+
+        return version("snapshot")
+    msg = f"module {__name__!r} has no attribute {name!r}"
+    raise AttributeError(msg)
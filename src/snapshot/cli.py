@@ -0,0 +1,366 @@
+import argparse
+import cProfile
+import logging
+import os
+import sys
+import typing
+from pathlib import Path
+
+# the flows and most tasks need polars, so they are imported by the commands that
+# use them rather than here (see tests/test_imports.py)
+from snapshot.models import jobs
+from snapshot.tasks import materialize, shards
+
+
+def split_jobs(
+    jobs_to_copy: typing.Sequence[jobs.STORE_DIR], task_id: int, task_count: int
+) -> list[jobs.STORE_DIR]:
+    """Jobs copied by one of task_count tasks (e.g., of a Slurm job array)
+
+    Jobs are dealt out in turn, so that every task gets some of the jobs that come
+    first. Pass --jobs to put the largest ones (fmriprep, freesurfer, qsiprep-V1,
+    bids) first.
+    """
+    if not 0 <= task_id < task_count:
+        msg = f"Task {task_id} is not one of {task_count} tasks"
+        raise ValueError(msg)
+    return list(jobs_to_copy[task_id::task_count])
+
+
+def steps_for(jobs_to_copy: typing.Collection[str], *, first: bool) -> list[str]:
+    """Post-processing steps run by a task that copies jobs_to_copy
+
+    Steps that need jobs run with the (only) task that copies all of them. Steps
+    that need none run with the first task.
+    """
+    from snapshot.flows import copy_to_dst_wf
+
+    return [
+        step.name
+        for step in copy_to_dst_wf.POST_STEPS
+        if (step.needs and set(step.needs) <= set(jobs_to_copy))
+        or (not step.needs and first)
+    ]
+
+
+def _array_task() -> tuple[int, int]:
+    """Index and size of the Slurm job array, (0, 1) outside of one"""
+    if (task_id := os.environ.get("SLURM_ARRAY_TASK_ID")) is None:
+        return 0, 1
+    first = int(os.environ.get("SLURM_ARRAY_TASK_MIN", "0"))
+    return int(task_id) - first, int(os.environ.get("SLURM_ARRAY_TASK_COUNT", "1"))
+
+
+def _task_file(path: Path, task_id: int, task_count: int) -> Path:
+    """Variant of a file (e.g., a report) that belongs to one task, like Shard.rename"""
+    return path.with_name(f"{path.stem}.task-{task_id}-of-{task_count}{path.suffix}")
+
+
+def _job_strategy(spec: str) -> tuple[str, materialize.Strategy]:
+    job, _, rest = spec.partition("=")
+    if job not in jobs.STORE_DIRS:
+        msg = f"Unknown job {job!r} in {spec!r}"
+        raise argparse.ArgumentTypeError(msg)
+    try:
+        return job, materialize.parse(rest)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from e
+
+
+def _table_format(name: str) -> str:
+    from snapshot.tasks import utils
+
+    if name not in utils.TABLE_FORMATS:
+        msg = f"invalid choice: {name!r} (choose from {utils.TABLE_FORMATS})"
+        raise argparse.ArgumentTypeError(msg)
+    return name
+
+
+def _strategy(spec: str) -> materialize.Strategy:
+    try:
+        return materialize.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from e
+
+
+def _add_jobs(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--jobs",
+        nargs="+",
+        choices=jobs.STORE_DIRS,
+        default=list(jobs.STORE_DIRS),
+        metavar="JOB",
+        help="Jobs to include, in order (default: all)",
+    )
+    parser.add_argument(
+        "--skip-jobs",
+        nargs="+",
+        choices=jobs.STORE_DIRS,
+        default=[],
+        metavar="JOB",
+        help="Jobs to leave out",
+    )
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="snapshot", description="Assemble and check A2CPS data releases"
+    )
+    parser.add_argument(
+        "--log-level",
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        default=None,
+        metavar="FILE",
+        help=(
+            "Write cProfile stats of this process to FILE. Jobs that run in "
+            "processes of their own are only profiled with --max-jobs 1"
+        ),
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Assemble a release (copy_to_dst_wf.main)")
+    run.add_argument("inroot", type=Path)
+    run.add_argument("outroot", type=Path)
+    _add_jobs(run)
+    workers = run.add_mutually_exclusive_group()
+    workers.add_argument(
+        "--max-workers",
+        type=int,
+        default=None,
+        help="Threads for filesystem operations, split across the jobs",
+    )
+    workers.add_argument(
+        "--job-workers",
+        type=int,
+        default=None,
+        help="Threads for filesystem operations, per job",
+    )
+    run.add_argument(
+        "--max-jobs",
+        type=int,
+        default=None,
+        help="Jobs copied at the same time, in processes (default: one per CPU)",
+    )
+    run.add_argument(
+        "--max-steps",
+        type=int,
+        default=None,
+        help="Post-processing steps run at the same time, in threads",
+    )
+    run.add_argument(
+        "--materialize",
+        type=_strategy,
+        default=materialize.SYMLINK,
+        metavar="SPEC",
+        help=(
+            "How files are created in the release, e.g. symlink, or "
+            "'reflink,*.tsv=copy' (see materialize.parse)"
+        ),
+    )
+    run.add_argument(
+        "--materialize-job",
+        type=_job_strategy,
+        action="append",
+        default=[],
+        metavar="JOB=SPEC",
+        help="Like --materialize, for one job. May be repeated",
+    )
+    run.add_argument("--table-formats", nargs="+", type=_table_format)
+    run.add_argument("--incremental", action="store_true")
+    run.add_argument("--resume", action="store_true")
+    run.add_argument("--dry-run", action="store_true")
+    run.add_argument("--plan-file", type=Path, default=None)
+    run.add_argument("--report-file", type=Path, default=None)
+    run.add_argument("--progress", action="store_true")
+    run.add_argument(
+        "--array-task-id",
+        type=int,
+        default=None,
+        help="Copy only this task's share of the jobs (default: from Slurm)",
+    )
+    run.add_argument(
+        "--array-task-count",
+        type=int,
+        default=None,
+        help="Number of tasks that share the jobs (default: from Slurm)",
+    )
+    run.add_argument(
+        "--shards",
+        type=int,
+        default=None,
+        help=(
+            "Split every job into SHARDS shards by subject, and mirror the one given "
+            "by the array task instead of a share of the jobs. Finish with merge"
+        ),
+    )
+
+    merge = commands.add_parser(
+        "merge", help="Run the post-processing steps of a sharded release"
+    )
+    merge.add_argument("inroot", type=Path)
+    merge.add_argument("outroot", type=Path)
+    merge.add_argument("--shards", type=int, required=True)
+    _add_jobs(merge)
+    merge.add_argument("--max-steps", type=int, default=None)
+    merge.add_argument("--table-formats", nargs="+", type=_table_format)
+    merge.add_argument("--incremental", action="store_true")
+    merge.add_argument("--resume", action="store_true")
+    merge.add_argument("--report-file", type=Path, default=None)
+    merge.add_argument("--progress", action="store_true")
+
+    check = commands.add_parser("verify", help="Check a finished release")
+    check.add_argument("inroot", type=Path)
+    check.add_argument("outroot", type=Path)
+    _add_jobs(check)
+    check.add_argument("--max-workers", type=int, default=None)
+    check.add_argument("--hash", action="store_true", help="Also hash written files")
+    check.add_argument("--manifest-file", type=Path, default=None)
+    check.add_argument(
+        "--root",
+        type=Path,
+        action="append",
+        default=[],
+        help="Directory besides INROOT that links may point into. May be repeated",
+    )
+    check.add_argument(
+        "--problems-file",
+        type=Path,
+        default=None,
+        help="Where to write the problems that were found, as parquet",
+    )
+    return parser
+
+
+def _run(args: argparse.Namespace) -> int:
+    from snapshot.flows import copy_to_dst_wf
+    from snapshot.tasks import plan, report
+
+    skip = set(args.skip_jobs)
+    jobs_to_copy = [job for job in args.jobs if job not in skip]
+    task_id, task_count = _array_task()
+    if args.array_task_id is not None:
+        task_id = args.array_task_id
+    if args.array_task_count is not None:
+        task_count = args.array_task_count
+    shard = None
+    plan_file = args.plan_file
+    report_file = args.report_file
+    if args.shards is not None:
+        shard = shards.parse(f"{task_id}/{args.shards}")
+    elif task_count > 1:
+        jobs_to_copy = split_jobs(jobs_to_copy, task_id, task_count)
+        logging.info(f"Task {task_id} of {task_count} copies {jobs_to_copy}")
+        # like shards, tasks write reports (and plans) of their own
+        if plan_file is None and args.dry_run:
+            plan_file = _task_file(
+                plan.get_plan_file(args.outroot), task_id, task_count
+            )
+        if report_file is None:
+            report_file = _task_file(
+                report.get_report_file(args.outroot), task_id, task_count
+            )
+
+    # like merge, only run the steps whose jobs are copied
+    steps_to_run = steps_for(jobs_to_copy, first=task_id == 0)
+
+    max_workers = args.max_workers
+    if args.job_workers is not None:
+        n_jobs = copy_to_dst_wf.get_n_jobs(len(jobs_to_copy), args.max_jobs)
+        max_workers = args.job_workers * n_jobs
+
+    strategy: materialize.Strategy | dict[jobs.STORE_DIR, materialize.Strategy] = (
+        args.materialize
+    )
+    if args.materialize_job:
+        strategy = {
+            **dict.fromkeys(jobs_to_copy, args.materialize),
+            **dict(args.materialize_job),
+        }
+
+    copy_to_dst_wf.main(
+        args.inroot,
+        args.outroot,
+        max_workers=max_workers,
+        jobs_to_copy=jobs_to_copy,
+        max_jobs=args.max_jobs,
+        incremental=args.incremental,
+        dry_run=args.dry_run,
+        plan_file=plan_file,
+        table_formats=args.table_formats or (),
+        report_file=report_file,
+        progress=args.progress,
+        strategy=strategy,
+        resume=args.resume,
+        steps_to_run=steps_to_run,
+        max_steps=args.max_steps,
+        shard=shard,
+    )
+    return 0
+
+
+def _merge(args: argparse.Namespace) -> int:
+    from snapshot.flows import copy_to_dst_wf
+
+    skip = set(args.skip_jobs)
+    copy_to_dst_wf.merge(
+        args.inroot,
+        args.outroot,
+        args.shards,
+        jobs_to_merge=[job for job in args.jobs if job not in skip],
+        incremental=args.incremental,
+        table_formats=args.table_formats or (),
+        report_file=args.report_file,
+        progress=args.progress,
+        resume=args.resume,
+        max_steps=args.max_steps,
+    )
+    return 0
+
+
+def _verify(args: argparse.Namespace) -> int:
+    from snapshot import datasets
+    from snapshot.tasks import verify
+
+    skip = set(args.skip_jobs)
+    problems = verify.verify(
+        args.inroot,
+        args.outroot,
+        datasets.get_records(),
+        jobs_to_check=[job for job in args.jobs if job not in skip],
+        max_workers=args.max_workers,
+        hash_files=args.hash,
+        roots=args.root,
+        manifest_file=args.manifest_file,
+    )
+    if args.problems_file is not None:
+        problems.write_parquet(args.problems_file)
+    return 1 if problems.height else 0
+
+
+def main(argv: typing.Sequence[str] | None = None) -> int:
+    """Entry point of the snapshot command
+
+    Returns:
+        int: Exit status. verify returns 1 when it finds problems.
+    """
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(
+        level=args.log_level, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    command = {"run": _run, "merge": _merge, "verify": _verify}[args.command]
+    if args.profile is None:
+        return command(args)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(command, args)
+    finally:
+        profiler.dump_stats(args.profile)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,23 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import logging
+import os
+import tempfile
+import typing
 from importlib import resources
 from pathlib import Path
 
-import polars as pl
+if typing.TYPE_CHECKING:
+    # imported where needed, so that the paths can be looked up without polars
+    import polars as pl
+
+# values to parse from src files as null (n/a will be used for output)
+NULLS = ["", "na", "n/a", "NA"]
+
+# value of the sub entity in a BIDS name or path
+SUB_ENTITY = r"(?:^|[_/])sub-(\d+)"
 
 
 def get_data(file: str) -> Path:
@@ -18,10 +34,187 @@ def get_description(file: str) -> Path:
     return out
 
 
+def get_cache_dir() -> Path:
+    """Where parsed copies of the bundled tables are kept between runs
+
+    Defaults to $XDG_CACHE_HOME/snapshot (~/.cache/snapshot), and can be moved with
+    SNAPSHOT_CACHE_DIR.
+    """
+    if cache_dir := os.environ.get("SNAPSHOT_CACHE_DIR"):
+        return Path(cache_dir)
+    xdg = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(xdg) / "snapshot"
+
+
+class Table(typing.NamedTuple):
+    """How to parse one of the bundled tables
+
+    Attributes:
+        file: Name of the file in snapshot.data.
+        separator: Field separator.
+        schema_overrides: Types of the columns used as keys elsewhere, as Python
+            types (which polars maps to Int64 and String). Other columns are
+            inferred.
+    """
+
+    file: str
+    separator: str = ","
+    schema_overrides: dict[str, type] = {}  # noqa: RUF012
+
+
+TABLES: dict[str, Table] = {
+    "recordids": Table("DataFreeze_3_022825.csv", schema_overrides={"record_id": int}),
+    "ilog": Table(
+        "imaging-log-20250612T010003Z.csv",
+        schema_overrides={"subject_id": int, "visit": str},
+    ),
+    "qclog": Table(
+        "qc-log-20250612T010003Z.csv",
+        schema_overrides={"sub": int, "ses": str, "scan": str, "rating": str},
+    ),
+    "applied_pressures": Table(
+        "applied_pressure.csv",
+        schema_overrides={"record_id": int, "visit": str, "scan": str},
+    ),
+    "device_serial_numbers": Table(
+        "deviceserialnumber.tsv",
+        separator="\t",
+        schema_overrides={"sub": int, "session_id": str},
+    ),
+}
+
+
+def get_cache_errors() -> tuple[type[Exception], ...]:
+    """Errors that mean a cached table has to be parsed again"""
+    import polars as pl
+
+    return (OSError, pl.exceptions.PolarsError)
+
+
+def _write_cache(d: pl.DataFrame, dst: Path) -> None:
+    try:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=dst.parent, delete=False) as f:
+            tmp = Path(f.name)
+        d.write_ipc(tmp)
+        os.replace(tmp, dst)
+    except OSError as e:
+        # the cache is only an optimization (e.g., home may be read-only on nodes)
+        logging.warning(f"Unable to cache {dst.name}: {e}")
+
+
+@functools.cache
+def load_table(name: str) -> pl.DataFrame:
+    """Parse one of the bundled tables (see TABLES), once per process
+
+    Args:
+        name (str): Key of TABLES.
+
+    Returns:
+        pl.DataFrame: Parsed table.
+
+    Details:
+        Parsed tables are also written to get_cache_dir() as Arrow IPC files, named
+        after a hash of the source, so that later processes can skip parsing the
+        CSV. Changing the source (or how it is parsed) invalidates the cache.
+        Callers must not modify the returned frame in place.
+    """
+    import polars as pl
+
+    table = TABLES[name]
+    src = get_data(table.file)
+    h = hashlib.sha256(src.read_bytes())
+    h.update(repr(table).encode())
+    cached = get_cache_dir() / f"{name}-{h.hexdigest()[:16]}.arrow"
+    if cached.exists():
+        try:
+            return pl.read_ipc(cached)
+        except get_cache_errors():
+            logging.warning(f"Ignoring unreadable cache {cached}")
+    d = pl.read_csv(
+        src,
+        separator=table.separator,
+        null_values=NULLS,
+        schema_overrides=table.schema_overrides,
+    )
+    _write_cache(d, cached)
+    return d
+
+
+def scan_table(name: str) -> pl.LazyFrame:
+    """Lazy view of one of the bundled tables, so that callers can push down filters"""
+    return load_table(name).lazy()
+
+
 def get_recordids() -> list[int]:
-    f = get_data("DataFreeze_3_022825.csv")
-    record_ids = pl.read_csv(f).select(pl.col("record_id")).to_series().to_list()
-    return record_ids
+    return load_table("recordids").get_column("record_id").to_list()
+
+
+FrameT = typing.TypeVar("FrameT", "pl.DataFrame", "pl.LazyFrame")
+
+
+class RecordSet(typing.Collection[int]):
+    """Subjects included in a release
+
+    Holds the ids both as a frozenset, for O(1) membership tests in Python, and as a
+    polars Series, so that tables can be filtered with a single hash join.
+    """
+
+    __slots__ = ("_ids", "_series")
+
+    def __init__(self, ids: typing.Iterable[int] = ()) -> None:
+        import polars as pl
+
+        self._ids = frozenset(int(i) for i in ids)
+        self._series = pl.Series("sub", sorted(self._ids), dtype=pl.Int64)
+
+    def __contains__(self, sub: object) -> bool:
+        return sub in self._ids
+
+    def __iter__(self) -> typing.Iterator[int]:
+        return iter(self._series)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __repr__(self) -> str:
+        return f"RecordSet(n={len(self)})"
+
+    @property
+    def series(self) -> pl.Series:
+        return self._series
+
+    def _semi_join(self, d: FrameT, key: pl.Expr) -> FrameT:
+        import polars as pl
+
+        ids = self._series.to_frame()
+        if isinstance(d, pl.LazyFrame):
+            return d.join(ids.lazy(), left_on=key, right_on="sub", how="semi")
+        return d.join(ids, left_on=key, right_on="sub", how="semi")
+
+    def semi_join(self, d: FrameT, on: str = "sub") -> FrameT:
+        """Rows of d whose subject (column on, cast to int) is in the set"""
+        import polars as pl
+
+        return self._semi_join(d, pl.col(on).cast(pl.Int64, strict=False))
+
+    def semi_join_entity(self, d: FrameT, on: str = "bids_name") -> FrameT:
+        """Rows of d whose sub entity (e.g., sub-10003_ses-V1) is in the set
+
+        Only the value of the sub entity is compared, so a subject number that
+        appears elsewhere in the name does not count as a match.
+        """
+        import polars as pl
+
+        return self._semi_join(d, pl.col(on).str.extract(SUB_ENTITY, 1).cast(pl.Int64))
+
+
+def as_records(records: typing.Iterable[int]) -> RecordSet:
+    return records if isinstance(records, RecordSet) else RecordSet(records)
+
+
+def get_records() -> RecordSet:
+    return RecordSet(get_recordids())
 
 
 def get_applied_pressures() -> Path:
@@ -139,7 +332,7 @@ def get_device_serial_number_file() -> Path:
 
 
 def get_device_serial_number_tbl() -> pl.DataFrame:
-    return pl.read_csv(get_device_serial_number_file(), separator="\t")
+    return load_table("device_serial_numbers")
 
 
 def get_gm_morph_json() -> Path:
@@ -1,26 +1,145 @@
 import asyncio
+import collections
+import errno
+import functools
 import logging
+import multiprocessing
 import os
 import shutil
+import time
 import typing
 from concurrent import futures
 from pathlib import Path
 
+import polars as pl
+
 from snapshot import datasets
 from snapshot.models import jobs
-from snapshot.tasks import utils
+from snapshot.tasks import (
+    journal,
+    manifest,
+    materialize,
+    plan,
+    report,
+    scan,
+    shards,
+    utils,
+)
 
+# links created by one task of copytree
+BATCH_SIZE = 256
 
-def copy_directory(src: str, dst: str) -> None:
-    "Used for making directories in copytree (which has a call to mkdirs)"
-    pass
+# as the kernel, give up on chains of symlinks longer than this
+MAX_SYMLINKS = 40
 
 
-def link(src: Path, dst: Path) -> None:
-    if not src.is_symlink():
-        dst.symlink_to(src)
-    else:
-        dst.symlink_to(src.resolve())
+class Resolver:
+    """Path.resolve for symlinks whose target is already known (see scan.scan)
+
+    Directories are resolved once and cached, so resolving a symlink costs a
+    readlink of the target (to check whether it is a symlink too) rather than a
+    walk of the whole path.
+    """
+
+    def __init__(self) -> None:
+        self._dirs: dict[str, str] = {}
+
+    def realdir(self, path: str) -> str:
+        if (real := self._dirs.get(path)) is None:
+            real = self._dirs[path] = os.path.realpath(path)
+        return real
+
+    def resolve(self, path: str, target: str) -> str:
+        for _ in range(MAX_SYMLINKS):
+            parent, name = os.path.split(os.path.join(os.path.dirname(path), target))
+            if name in {"", ".", ".."}:
+                return os.path.realpath(os.path.join(parent, name))
+            path = os.path.join(self.realdir(parent), name)
+            try:
+                target = os.readlink(path)
+            except OSError:
+                # not a symlink (or missing, which resolve allows)
+                return path
+        raise OSError(errno.ELOOP, os.strerror(errno.ELOOP), path)
+
+
+def link(
+    src: Path,
+    dst: Path,
+    entries: typing.Sequence[tuple[str, str, str | None]],
+    resolver: Resolver,
+    strategy: materialize.Strategy = materialize.SYMLINK,
+    *,
+    exist_ok: bool = False,
+) -> list[Exception]:
+    """Mirror the files of one directory
+
+    Args:
+        src (Path): Source directory.
+        dst (Path): Destination directory, which must exist.
+        entries (typing.Sequence[tuple[str, str, str | None]]): Name, kind and
+            target of each entry of src to link (see scan.SCHEMA).
+        resolver (Resolver): Resolves the targets of symlinks, which are mirrored
+            directly.
+        strategy (materialize.Strategy, optional): Whether each file is symlinked,
+            hardlinked, reflinked or copied. Defaults to symlinks.
+        exist_ok (bool, optional): Keep existing entries that already mirror their
+            source (see materialize.is_current), and replace the others. Defaults
+            to False, in which case existing entries are failures.
+
+    Returns:
+        list[Exception]: Failures, one per entry that could not be mirrored.
+
+    Details:
+        dst is opened once and the entries are created relative to it, so that
+        each symlink costs a single symlink call (plus a readlink for symlinks)
+        instead of several walks of its absolute path.
+    """
+    errors: list[Exception] = []
+    done: collections.Counter[str] = collections.Counter()
+    fd = os.open(dst, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        for name, kind, target in entries:
+            path = os.path.join(src, name)
+            try:
+                if kind == "symlink":
+                    path = resolver.resolve(path, target or os.readlink(path))
+                mode = strategy.mode(name)
+                try:
+                    done[materialize.create(path, name, fd, mode)] += 1
+                except FileExistsError:
+                    if not exist_ok:
+                        raise
+                    if materialize.is_current(path, name, fd):
+                        continue
+                    os.unlink(name, dir_fd=fd)
+                    done[materialize.create(path, name, fd, mode)] += 1
+            except OSError as e:
+                errors.append(e)
+    finally:
+        os.close(fd)
+    # resolving a symlink takes (at least) one readlink
+    n_symlinks = sum(kind == "symlink" for _, kind, _ in entries)
+    report.count(**done, stat=n_symlinks)
+    return errors
+
+
+def _sources(src: Path, index: pl.DataFrame, resolver: Resolver) -> dict[str, Path]:
+    """Directory of src that each directory of an index mirrors
+
+    Symlinks to directories (which scan.scan walks) are resolved, so that their
+    files are linked to where they are rather than through the symlink. Other
+    directories keep the path they have below src, even if src itself is reached
+    through a symlink (such as a mount alias).
+    """
+    sources = {"": src}
+    for path, target in (
+        index.filter(pl.col("kind") == "dir").select("path", "target").iter_rows()
+    ):
+        parent, name = os.path.split(path)
+        here = sources.get(parent, src / parent) / name
+        sources[path] = here if target is None else Path(resolver.realdir(str(here)))
+    return sources
 
 
 async def copytree(
@@ -28,7 +147,14 @@ async def copytree(
     dst: Path,
     ignore: typing.Callable | None = None,
     max_workers: int | None = None,
-) -> None:
+    *,
+    index: pl.DataFrame | None = None,
+    max_in_flight: int | None = None,
+    dirs_exist_ok: bool = False,
+    strategy: materialize.Strategy = materialize.SYMLINK,
+    links_exist_ok: bool = False,
+    on_dir_done: typing.Callable[[str], None] | None = None,
+) -> pl.DataFrame:
     """Copy a directory tree using multiple threads
 
     Args:
@@ -36,179 +162,835 @@ async def copytree(
         dst (Path): See copytree
         ignore (typing.Callable): See copytree
         max_workers (int | None, optional): See ThreadPoolExecutor. Defaults to None.
+        index (pl.DataFrame | None, optional): Index of src (see scan.scan). Scanned
+            when not provided. Defaults to None.
+        max_in_flight (int | None, optional): Maximum number of directories and
+            batches of links submitted to the executor but not yet finished.
+            Defaults to None, which means twice the number of workers.
+        dirs_exist_ok (bool, optional): See copytree. Defaults to False.
+        strategy (materialize.Strategy, optional): See link. Defaults to symlinks.
+        links_exist_ok (bool, optional): See link (exist_ok). Defaults to False.
+        on_dir_done (typing.Callable[[str], None] | None, optional): Called (in the
+            event loop) with the path of each directory, relative to dst, once it
+            and the files in it have been mirrored. "" stands for dst itself.
+            Defaults to None.
+
+    Returns:
+        pl.DataFrame: Index of the entries that were mirrored into dst.
+
+    Raises:
+        ExceptionGroup: Every failed mkdir and link. Entries below a directory that
+            could not be created are skipped rather than reported.
 
     Details:
-        The directories are created in the destination first. This is done synchronously
-        to avoid race conditions. After the directory tree has been created in the
-        destination, the files can all be linked to in a single gather.
+        The tree is mirrored one level at a time. The directories of a level are
+        created concurrently, and the files of that level are linked alongside them
+        (their parents were finished in the previous level), in batches of up to
+        BATCH_SIZE files of the same directory (see link). Work is handed to the
+        executor through a semaphore, so the number of pending futures stays bounded
+        no matter how many files there are. Symlinks to directories (which scan.scan
+        records as directories) become directories of dst, whose files are linked
+        like any other.
     """
-    shutil.copytree(src, dst, ignore=ignore, copy_function=copy_directory)
-    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        for dirpath, _, filenames in os.walk(src):
-            d = Path(dirpath)
-            dirpath_fromtop = d.relative_to(src)
-            dirpath_dst = dst / dirpath_fromtop
-            if not dirpath_dst.exists():
-                continue
-            # need to ensure ignore is applied to files, too
-            if ignore is not None:
-                ignored_names = ignore(os.fspath(src), filenames)
-            else:
-                ignored_names = ()
-            for file in filenames:
-                if file in ignored_names:
+    if index is None:
+        index = scan.scan(src, max_workers=max_workers)
+    if ignore is not None:
+        index = scan.prune(index, src, ignore)
+
+    workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+    limit = asyncio.Semaphore(max_in_flight or 2 * workers)
+    loop = asyncio.get_running_loop()
+    pending: set[asyncio.Future] = set()
+    errors: list[Exception] = []
+    failed: set[str] = set()
+    created = 0
+    resolver = Resolver()
+    # batches of links still running in each directory, and directories where any
+    # of them failed
+    remaining: collections.Counter[str] = collections.Counter()
+    incomplete: set[str] = set()
+
+    def _done(path: str, fut: asyncio.Future) -> None:
+        nonlocal created
+        pending.discard(fut)
+        limit.release()
+        if fut.cancelled():
+            return
+        if (exc := fut.exception()) is not None:
+            errors.append(exc)
+            failed.add(path)
+            return
+        created += 1
+        if on_dir_done is not None and path not in remaining:
+            on_dir_done(path)
+
+    def _linked(parent: str, fut: asyncio.Future) -> None:
+        pending.discard(fut)
+        limit.release()
+        if fut.cancelled():
+            return
+        if (exc := fut.exception()) is not None:
+            errors.append(exc)
+            incomplete.add(parent)
+        elif batch_errors := fut.result():
+            errors.extend(batch_errors)
+            incomplete.add(parent)
+        remaining[parent] -= 1
+        if remaining[parent] == 0 and parent not in incomplete and on_dir_done:
+            on_dir_done(parent)
+
+    dst.mkdir(parents=True, exist_ok=dirs_exist_ok)
+    mkdir = functools.partial(Path.mkdir, exist_ok=dirs_exist_ok)
+    sources = _sources(src, index, resolver)
+    index = index.with_columns(
+        depth=pl.col("path").str.count_matches("/"),
+        parent=pl.col("path").str.replace(r"/?[^/]*$", ""),
+    )
+    # a directory is only done once the files in it are, see _linked
+    for parent, n in (
+        index.filter(pl.col("kind") != "dir")
+        .group_by("parent")
+        .agg(n=pl.len())
+        .iter_rows()
+    ):
+        remaining[parent] = -(-n // BATCH_SIZE)
+    if on_dir_done is not None and "" not in remaining:
+        on_dir_done("")
+    levels = index.partition_by("depth", as_dict=True, include_key=False)
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for (_,), level in sorted(levels.items()):
+            mkdirs: list[asyncio.Future] = []
+            batches: dict[str, list[tuple[str, str, str | None]]] = {}
+            for path, kind, target, parent in level.select(
+                "path", "kind", "target", "parent"
+            ).iter_rows():
+                if parent in failed:
+                    if kind == "dir":
+                        failed.add(path)
+                    continue
+                if kind != "dir":
+                    name = os.path.basename(path)
+                    batches.setdefault(parent, []).append((name, kind, target))
                     continue
-                executor.submit(link, d / file, dirpath_dst / file)
+                await limit.acquire()
+                fut = loop.run_in_executor(executor, mkdir, dst / path)
+                mkdirs.append(fut)
+                pending.add(fut)
+                fut.add_done_callback(functools.partial(_done, path))
+            for parent, entries in batches.items():
+                for i in range(0, len(entries), BATCH_SIZE):
+                    await limit.acquire()
+                    fut = loop.run_in_executor(
+                        executor,
+                        functools.partial(
+                            link,
+                            # directories that are kept are not in the index
+                            sources.get(parent, src / parent),
+                            dst / parent,
+                            entries[i : i + BATCH_SIZE],
+                            resolver,
+                            strategy,
+                            exist_ok=links_exist_ok,
+                        ),
+                    )
+                    pending.add(fut)
+                    fut.add_done_callback(functools.partial(_linked, parent))
+            # the next level needs these directories
+            await asyncio.gather(*mkdirs, return_exceptions=True)
+        await asyncio.gather(*pending, return_exceptions=True)
 
+    report.count(mkdir=created)
+    if errors:
+        msg = f"Failed to mirror {len(errors)} entries of {src} into {dst}"
+        raise ExceptionGroup(msg, errors)
+    return index.drop("depth", "parent")
 
-def main(
-    inroot: Path,
-    outroot: Path,
+
+def execute_job(
+    ops: pl.DataFrame,
     max_workers: int | None = None,
-    jobs_to_copy: typing.Sequence[jobs.STORE_DIR] = jobs.STORE_DIRS,
-) -> None:
-    records = datasets.get_recordids()
-    for job in jobs_to_copy:
-        logging.info(f"Working on {job}")
-        injobdir = inroot / job
-        match job:
-            case "bids":
-                outjobdir = outroot / "rawdata"
-            case _:
-                outjobdir = outroot / "derivatives" / job
-
-        # get list of subjects that are present in the input
-        # directory but which won't be included in release
-        # this pattern covers:
-
-        subs_to_exclude = set()
-        match job:
-            case (
-                "bedpostx"
-                | "bids"
-                | "brainager"
-                | "cat12"
-                | "eddyqc"
-                | "fmriprep"
-                | "freesurfer"
-                | "fslanat"
-                | "mriqc"
-                | "gift"
-                | "qsiprep-V1"
-                | "synthstrip"
-            ):
-                generator = injobdir.glob("sub-*")
-            case "dwi_biomarker1":
-                generator = injobdir.glob("networks/sub-*")
-            case "fcn" | "signatures":
-                generator = injobdir.glob("*cleaned/sub-*")
-            case "postdtifit":
-                generator = injobdir.glob("diffusion_regional/sub-*")
-            case "postgift":
-                generator = injobdir.glob("amplitude/sub=*")
-            case "qsirecon_fsl_dtifit":
-                generator = injobdir.glob("qsirecon-fsl/sub-*")
-        for file in generator:
-            match job:
-                case "postgift":
-                    sub = int(utils._get_entity(f=file, pattern=r"(?<=sub=)\d{5}"))
-                case _:
-                    sub = int(utils._get_sub(file))
-            if sub not in records:
-                subs_to_exclude.add(sub)
-
-            # need to exclude participants that only have ses-V3 outputs available
-            # as subdirectories. This matters for cases like fmriprep, with outputs
-            # fmriprep/sub-10003/{figures,log,ses-V3}; ses-V3 will be excluded,
-            # but we'd still get fmriprep/sub-10003/{figures,log}
-            # Names like sub-25052_ses-V3_T1w.anat will be excluded due to V3 in
-            # the name at the top level
-            if (
-                file.is_dir()
-                and (len(sessions := list(file.glob("ses*"))) == 1)
-                and ("V3" in sessions[0].name)
-            ):
-                subs_to_exclude.add(sub)
-
-        # copy all files from input directory, except those excluded subs
-        # and any V3 data
-        logging.info(f"Copying {injobdir}, excluding {subs_to_exclude}")
+    *,
+    incremental: bool = False,
+    strategy: materialize.Strategy = materialize.SYMLINK,
+    resume: bool = False,
+    shard: shards.Shard | None = None,
+) -> pl.DataFrame:
+    """Carry out the plan of one job (see plan.make_job)
+
+    Args:
+        ops (pl.DataFrame): Operations of a single job.
+        max_workers (int | None, optional): Threads used for this job. Defaults to None.
+        incremental (bool, optional): See main. Defaults to False.
+        strategy (materialize.Strategy, optional): See link. Defaults to symlinks.
+        resume (bool, optional): Skip the directories that the journal records as
+            done, and keep existing entries that are correct. Defaults to False.
+        shard (shards.Shard | None, optional): Only carry out the operations of
+            this shard (see shards.Shard.select). Defaults to None.
+
+    Returns:
+        pl.DataFrame: Index of what was mirrored (see copytree).
+
+    Details:
+        Finished directories, and the index once the job is done, are recorded in
+        the journal (see journal), so that an interrupted run can be resumed.
+        Shards record them in journals of their own, and leave the manifest of
+        incremental runs to merge.
+    """
+    job: jobs.STORE_DIR = ops.get_column("job").first()  # type: ignore[assignment]
+    inroot = Path(ops.get_column("inroot").first())  # type: ignore[arg-type]
+    outroot = Path(ops.get_column("outroot").first())  # type: ignore[arg-type]
+    outjobdir = outroot / jobs.JOBS[job].outdir
+    if shard is not None:
+        ops = shard.select(ops)
+
+    start = time.perf_counter()
+    todo = ops.filter(pl.col("op").is_in(["mkdir", "link"]))
+    if resume and (done := journal.read_dirs(outroot, job, shard)):
+        todo = todo.filter(
+            ~pl.when(pl.col("op") == "mkdir")
+            .then(pl.col("path"))
+            .otherwise(pl.col("path").str.replace(r"/?[^/]*$", ""))
+            .is_in(list(done))
+        )
+        logging.info(f"Resuming {job}, {len(done)} directories are already done")
+    manifest.remove(outjobdir, ops.filter(pl.col("op") == "remove"))
+    with journal.DirLog(outroot, job, shard) as log:
         asyncio.run(
             copytree(
-                injobdir,
+                inroot / job,
                 outjobdir,
-                ignore=shutil.ignore_patterns(
-                    "*ses-V3*", "*ses=V3*", *(f"*{sub}*" for sub in subs_to_exclude)
-                ),
                 max_workers=max_workers,
+                index=todo,
+                # shards share the directories that belong to no subject
+                dirs_exist_ok=incremental or resume or shard is not None,
+                strategy=strategy,
+                links_exist_ok=resume,
+                on_dir_done=log.add,
             )
         )
+    logging.info(f"Copied {job} in {time.perf_counter() - start:0.2f} seconds")
+    new = plan.mirrored(ops)
+    if incremental and shard is None:
+        manifest.write_entries(outroot, job, new)
+    journal.write_job(outroot, job, new, shard)
+    return new
+
+
+def copy_job(
+    job: jobs.STORE_DIR,
+    inroot: Path,
+    outroot: Path,
+    records: typing.Collection[int],
+    max_workers: int | None = None,
+    *,
+    incremental: bool = False,
+    strategy: materialize.Strategy = materialize.SYMLINK,
+    resume: bool = False,
+    shard: shards.Shard | None = None,
+) -> pl.DataFrame:
+    """Mirror one STORE_DIR (or a shard of one) into the release
+
+    Args:
+        job (jobs.STORE_DIR): Job to copy.
+        inroot (Path): See main.
+        outroot (Path): See main.
+        records (typing.Collection[int]): Subjects included in the release.
+        max_workers (int | None, optional): Threads used for this job. Defaults to None.
+        incremental (bool, optional): See main. Defaults to False.
+        strategy (materialize.Strategy, optional): See link. Defaults to symlinks.
+        resume (bool, optional): See execute_job. Defaults to False.
+        shard (shards.Shard | None, optional): See execute_job. Defaults to None.
+
+    Returns:
+        pl.DataFrame: Index of what was mirrored (see copytree).
+    """
+    logging.info(f"Working on {job}")
+    ops = plan.make_job(
+        job,
+        inroot,
+        outroot,
+        records,
+        max_workers,
+        incremental=incremental,
+        shard=shard,
+    )
+    return execute_job(
+        ops,
+        max_workers,
+        incremental=incremental,
+        strategy=strategy,
+        resume=resume,
+        shard=shard,
+    )
 
-    # handle top-level stuff
-    # bids
-    shutil.copy2(datasets.get_dataset_description_json(), outroot / "rawdata")
-    utils.write_participants(records=records, outdir=outroot / "rawdata")
-    utils.write_sessions(outdir=outroot / "rawdata")
-    utils.update_scans(outdir=outroot / "rawdata")
-    utils.write_events(outdir=outroot / "rawdata")
-    utils.write_readme(outdir=outroot / "rawdata")
-    utils.write_changes(outdir=outroot / "rawdata")
-    utils.clean_sidecars(root=outroot / "rawdata")
-
-    # mriqc
+
+class Context(typing.NamedTuple):
+    inroot: Path
+    outroot: Path
+    records: typing.Collection[int]
+    # index of what was mirrored for each job (see copy_job), so that the
+    # post-processing steps can query it instead of walking the output tree again
+    indexes: typing.Mapping[jobs.STORE_DIR, pl.DataFrame]
+    # binary copies written next to the release-level tables (see utils.to_bids_tsv)
+    table_formats: tuple[str, ...] = ()
+
+
+def _post_bids(ctx: Context) -> None:
+    rawdata = ctx.outroot / "rawdata"
+    index = ctx.indexes.get("bids")
+    shutil.copy2(datasets.get_dataset_description_json(), rawdata)
+    utils.write_participants(
+        records=ctx.records, outdir=rawdata, formats=ctx.table_formats
+    )
+    utils.write_sessions(outdir=rawdata)
+    utils.update_scans(outdir=rawdata, index=index)
+    utils.write_events(outdir=rawdata, index=index)
+    utils.write_readme(outdir=rawdata)
+    utils.write_changes(outdir=rawdata)
+    utils.clean_sidecars(root=rawdata, index=index)
+
+
+def _post_mriqc(ctx: Context) -> None:
     utils.overwrite_tables(
-        outjob=outroot / "derivatives" / "mriqc",
-        records=records,
+        outjob=ctx.outroot / "derivatives" / "mriqc",
+        records=ctx.records,
         srcs=["group_bold.tsv", "group_dwi.tsv", "group_T1w.tsv"],
+        formats=ctx.table_formats,
     )
 
-    # fmriprep
+
+def _post_fmriprep(ctx: Context) -> None:
     utils.clean_fmriprep_logs(
-        inroot=inroot / "fmriprep", outroot=outroot / "derivatives" / "fmriprep"
+        inroot=ctx.inroot / "fmriprep",
+        outroot=ctx.outroot / "derivatives" / "fmriprep",
     )
 
-    # cat12
-    utils.write_cat12_tables_and_jsons(outroot=outroot, inroot=inroot, records=records)
 
-    # dwi_biomarker1
-    utils.write_dwi_biomarker1_jsons(outroot=outroot)
+def _post_cat12(ctx: Context) -> None:
+    utils.write_cat12_tables_and_jsons(
+        outroot=ctx.outroot,
+        inroot=ctx.inroot,
+        records=ctx.records,
+        formats=ctx.table_formats,
+    )
+
 
-    # fcn
-    utils.write_fcn_jsons(outroot=outroot)
+def _post_dwi_biomarker1(ctx: Context) -> None:
+    utils.write_dwi_biomarker1_jsons(outroot=ctx.outroot)
 
-    # freesurfer
+
+def _post_fcn(ctx: Context) -> None:
+    utils.write_fcn_jsons(outroot=ctx.outroot, index=ctx.indexes.get("fcn"))
+
+    # postfcn
+    utils.overwrite_tables(
+        outjob=ctx.outroot / "derivatives" / "fcn",
+        records=ctx.records,
+        srcs=["hub_disruption.tsv"],
+        formats=ctx.table_formats,
+    )
+
+
+def _post_freesurfer(ctx: Context) -> None:
     utils.write_freesurfer_tables_and_jsons(
-        outroot=outroot, inroot=inroot, records=records
+        outroot=ctx.outroot,
+        inroot=ctx.inroot,
+        records=ctx.records,
+        formats=ctx.table_formats,
     )
 
-    # fslanat
+
+def _post_fslanat(ctx: Context) -> None:
     utils.write_fslanat_tables_and_jsons(
-        outroot=outroot, inroot=inroot, records=records
+        outroot=ctx.outroot,
+        inroot=ctx.inroot,
+        records=ctx.records,
+        formats=ctx.table_formats,
     )
 
-    # postdtifit
-    utils.write_postdtifit_jsons(outroot=outroot)
 
-    # postfcn
-    utils.overwrite_tables(
-        outjob=outroot / "derivatives" / "fcn",
+def _post_postdtifit(ctx: Context) -> None:
+    utils.write_postdtifit_jsons(outroot=ctx.outroot)
+
+
+def _post_postgift(ctx: Context) -> None:
+    utils.write_postgift_jsons(outroot=ctx.outroot)
+
+
+def _post_signatures(ctx: Context) -> None:
+    utils.write_signatures_jsons(outroot=ctx.outroot)
+
+
+def _post_qsirecon_fsl_dtifit(ctx: Context) -> None:
+    utils.remove_qsirecon_fsl_dtifit_v3_only(
+        root=ctx.outroot / "derivatives" / "qsirecon_fsl_dtifit"
+    )
+
+
+def _post_idps(ctx: Context) -> None:
+    utils.write_idps(
+        inroot=ctx.inroot,
+        outroot=ctx.outroot,
+        records=ctx.records,
+        formats=ctx.table_formats,
+    )
+
+
+def _post_release_notes(ctx: Context) -> None:
+    utils.write_release_notes(outroot=ctx.outroot)
+
+
+class PostStep(typing.NamedTuple):
+    run: typing.Callable[[Context], None]
+    # jobs that need to finish before the step can start
+    needs: tuple[jobs.STORE_DIR, ...] = ()
+    # files read by the step (relative to inroot) besides those of the jobs it needs
+    inputs: tuple[str, ...] = ()
+    # files and directories written by the step (relative to outroot), by default
+    # the output directories of the jobs it needs
+    outputs: tuple[str, ...] = ()
+
+    @property
+    def name(self) -> str:
+        return self.run.__name__.removeprefix("_post_")
+
+    @property
+    def written(self) -> tuple[str, ...]:
+        return self.outputs or tuple(jobs.JOBS[job].outdir for job in self.needs)
+
+
+POST_STEPS: tuple[PostStep, ...] = (
+    PostStep(_post_bids, needs=("bids",)),
+    PostStep(_post_mriqc, needs=("mriqc",)),
+    PostStep(_post_fmriprep, needs=("fmriprep",)),
+    PostStep(_post_cat12, needs=("cat12",)),
+    PostStep(_post_dwi_biomarker1, needs=("dwi_biomarker1",)),
+    PostStep(_post_fcn, needs=("fcn",)),
+    PostStep(_post_freesurfer, needs=("freesurfer",)),
+    PostStep(_post_fslanat, needs=("fslanat",)),
+    PostStep(_post_postdtifit, needs=("postdtifit",)),
+    PostStep(_post_postgift, needs=("postgift",)),
+    PostStep(_post_signatures, needs=("signatures",)),
+    PostStep(_post_qsirecon_fsl_dtifit, needs=("qsirecon_fsl_dtifit",)),
+    PostStep(
+        _post_idps,
+        inputs=("idp/mri.tsv", "idp/mask_volumes.tsv"),
+        outputs=("idp",),
+    ),
+    PostStep(_post_release_notes, outputs=(datasets.get_release_notes().name,)),
+)
+
+
+def run_step(
+    step: PostStep, ctx: Context, *, incremental: bool = False, resume: bool = False
+) -> None:
+    """Run a post-processing step, unless it is up to date or already done
+
+    Args:
+        step (PostStep): Step to run.
+        ctx (Context): See PostStep.
+        incremental (bool, optional): Skip the step when its fingerprint matches that
+            of the previous incremental run (see manifest). Defaults to False.
+        resume (bool, optional): Skip the step when the journal records it as done.
+            Defaults to False.
+    """
+    if resume and journal.step_is_done(ctx.outroot, step.name):
+        logging.info(f"Skipping {step.name}, which was done before the restart")
+        return
+    if not incremental:
+        step.run(ctx)
+        journal.write_step(ctx.outroot, step.name)
+        return
+
+    entries = {}
+    for job in step.needs:
+        if (index := ctx.indexes.get(job)) is None:
+            index = manifest.read_entries(ctx.outroot, job)
+        if index is not None:
+            entries[job] = index
+    fingerprint = manifest.fingerprint(
+        ctx.records,
+        entries,
+        inputs=[ctx.inroot / src for src in step.inputs],
+        options=ctx.table_formats,
+    )
+    if manifest.step_is_current(ctx.outroot, step.name, fingerprint):
+        logging.info(f"Skipping {step.name}, which is up to date")
+        return
+    step.run(ctx)
+    manifest.write_step(
+        ctx.outroot,
+        step.name,
+        fingerprint,
+        step.written,
+        mirrored={jobs.JOBS[job].outdir: index for job, index in entries.items()},
+    )
+    journal.write_step(ctx.outroot, step.name)
+
+
+def _shard_file(path: Path, shard: shards.Shard | None) -> Path:
+    return path if shard is None else shard.rename(path)
+
+
+def get_n_jobs(n: int, max_jobs: int | None = None) -> int:
+    """Number of jobs that main copies at the same time"""
+    return max_jobs or max(1, min(n, os.cpu_count() or 1))
+
+
+def main(
+    inroot: Path,
+    outroot: Path,
+    max_workers: int | None = None,
+    jobs_to_copy: typing.Sequence[jobs.STORE_DIR] = jobs.STORE_DIRS,
+    max_jobs: int | None = None,
+    *,
+    incremental: bool = False,
+    dry_run: bool = False,
+    plan_file: Path | None = None,
+    table_formats: typing.Collection[str] = (),
+    report_file: Path | None = None,
+    progress: bool = False,
+    strategy: materialize.Strategy
+    | typing.Mapping[jobs.STORE_DIR, materialize.Strategy] = materialize.SYMLINK,
+    resume: bool = False,
+    steps_to_run: typing.Collection[str] | None = None,
+    max_steps: int | None = None,
+    shard: shards.Shard | None = None,
+) -> None:
+    """Assemble a release from the products in inroot
+
+    Args:
+        inroot (Path): Directory containing one subdirectory per STORE_DIR.
+        outroot (Path): Destination of the release.
+        max_workers (int | None, optional): Global budget of threads, split evenly
+            across the jobs that run at the same time. Defaults to None, in which
+            case each job gets the ThreadPoolExecutor default.
+        jobs_to_copy (typing.Sequence[jobs.STORE_DIR], optional): Jobs to copy.
+            Defaults to jobs.STORE_DIRS.
+        max_jobs (int | None, optional): Number of jobs copied at the same time, each
+            in a separate process. Defaults to None, which means one per CPU (up to
+            the number of jobs). With 1, jobs are copied in this process.
+        incremental (bool, optional): Update a release made by a previous incremental
+            run, using the manifest kept next to outroot (see manifest). Only
+            entries that were added, removed or changed since are mirrored again,
+            and post-processing steps whose inputs and outputs are unchanged are
+            skipped. Defaults to False.
+        dry_run (bool, optional): Only plan the release (see plan.make_job), writing
+            the plan to plan_file and logging the number of operations and bytes
+            per job. Nothing is created in outroot. Defaults to False.
+        plan_file (Path | None, optional): Where a dry run writes the plan. When not
+            a dry run, the jobs are copied by executing this (previously written)
+            plan instead of planning them again. Defaults to None, which means
+            plan.get_plan_file(outroot) for dry runs.
+        table_formats (typing.Collection[str], optional): Binary copies (any of
+            utils.TABLE_FORMATS) to write next to the release-level tables, such as
+            the freesurfer tables and idp/mri.tsv. Defaults to ().
+        report_file (Path | None, optional): Where to write the time, filesystem
+            operations, I/O and peak memory of each job and post-processing step
+            (see report.SCHEMA), as parquet or, for a .json file, JSON. Defaults to
+            None, which means report.get_report_file(outroot).
+        progress (bool, optional): Show a status line on stderr, updated as jobs
+            and steps finish. Defaults to False.
+        strategy (materialize.Strategy | typing.Mapping[jobs.STORE_DIR,
+            materialize.Strategy], optional): Whether files are symlinked,
+            hardlinked, reflinked or copied into the release, for all jobs or per
+            job (jobs that are not listed get symlinks). Incremental runs only apply
+            it to entries that they mirror again. Defaults to symlinks.
+        resume (bool, optional): Continue a run that was interrupted, using the
+            journal kept next to outroot (see journal): finished jobs and
+            post-processing steps are skipped, finished directories of other jobs
+            are not visited again, and entries that already mirror their source
+            are kept. Should be called with the same arguments as the interrupted
+            run. Defaults to False, in which case the journal entries of the jobs
+            and post-processing steps that this run does are started afresh.
+        steps_to_run (typing.Collection[str] | None, optional): Names of the
+            post-processing steps to run (see PostStep.name). Defaults to None, which
+            means all of POST_STEPS.
+        max_steps (int | None, optional): Number of post-processing steps run at the
+            same time (in threads). Unlike copying, most steps are bound by CPU
+            (parsing and writing tables). Defaults to None, which means the
+            ThreadPoolExecutor default.
+        shard (shards.Shard | None, optional): Only mirror the entries of the
+            subjects in this shard (see shards.Shard.select), so that several
+            processes (e.g., on different nodes) can each mirror a shard into the
+            same outroot. No post-processing steps are run; run merge once all
+            shards are done. Plans, reports and journals are kept per shard.
+            Defaults to None.
+
+    Raises:
+        ExceptionGroup: Failures of any job or post-processing step. Steps that
+            depend on a failed job are not run.
+
+    Details:
+        Jobs write to disjoint subtrees of outroot, so they are independent. Each
+        post-processing step starts (in a thread) as soon as the jobs that it
+        depends on have finished, and steps that depend on no job once all of
+        them have. Steps only wait for jobs that are part of jobs_to_copy.
+    """
+    records = datasets.get_records()
+    post_steps = [
+        step for step in POST_STEPS if steps_to_run is None or step.name in steps_to_run
+    ]
+    if shard is not None:
+        logging.info(f"Mirroring {shard.name}, leaving post-processing to merge")
+        post_steps = []
+    strategies = (
+        dict.fromkeys(jobs_to_copy, strategy)
+        if isinstance(strategy, materialize.Strategy)
+        else strategy
+    )
+    n_jobs = get_n_jobs(len(jobs_to_copy), max_jobs)
+    job_workers = max(1, max_workers // n_jobs) if max_workers else None
+
+    if n_jobs == 1:
+        pool = futures.ThreadPoolExecutor(max_workers=1)
+    else:
+        # polars is not fork-safe
+        pool = futures.ProcessPoolExecutor(
+            max_workers=n_jobs, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    if dry_run:
+        with pool:
+            plans = pool.map(
+                functools.partial(
+                    plan.make_job,
+                    inroot=inroot,
+                    outroot=outroot,
+                    records=records,
+                    max_workers=job_workers,
+                    incremental=incremental,
+                    stat=True,
+                    shard=shard,
+                ),
+                jobs_to_copy,
+            )
+            if shard is not None:
+                plans = map(shard.select, plans)
+            full = pl.concat(
+                [
+                    *plans,
+                    plan.make_steps(
+                        ((step.name, step.written) for step in post_steps),
+                        inroot=inroot,
+                        outroot=outroot,
+                    ),
+                ]
+            )
+        dst = plan_file or _shard_file(plan.get_plan_file(outroot), shard)
+        plan.write(full, dst)
+        with pl.Config(tbl_rows=-1):
+            logging.info(f"Wrote plan to {dst}\n{plan.summarize(full)}")
+        return
+
+    if not resume:
+        # other processes may be mirroring other jobs (or shards) into outroot
+        journal.clear_jobs(outroot, jobs_to_copy, shard)
+        journal.clear_steps(outroot, [step.name for step in post_steps])
+
+    if plan_file is not None:
+        saved = plan.read(plan_file).filter(pl.col("job").is_not_null())
+        jobs_to_copy = [job for job in jobs_to_copy if job in saved.get_column("job")]
+        planned = saved.partition_by("job", as_dict=True)
+
+    indexes: dict[jobs.STORE_DIR, pl.DataFrame] = {}
+    if resume:
+        for job in jobs_to_copy:
+            if (index := journal.read_job(outroot, job, shard)) is not None:
+                logging.info(f"Skipping {job}, which was done before the restart")
+                indexes[job] = index
+    ctx = Context(
+        inroot=inroot,
+        outroot=outroot,
         records=records,
-        srcs=["hub_disruption.tsv"],
+        indexes=indexes,
+        table_formats=tuple(sorted(table_formats)),
     )
+    errors: list[Exception] = []
+    # steps that need no job (e.g., the release notes) write to outroot itself, so
+    # they wait for all of them, as they did when steps ran after every copy
+    waiting = {
+        step: {
+            job
+            for job in step.needs or jobs_to_copy
+            if job in jobs_to_copy and job not in indexes
+        }
+        for step in post_steps
+    }
+    steps: dict[futures.Future, PostStep] = {}
+    rows: list[dict[str, typing.Any]] = []
+    status = report.Progress(len(jobs_to_copy), len(post_steps)) if progress else None
 
-    # postgift
-    utils.write_postgift_jsons(outroot=outroot)
+    def _record(name: str, kind: str, fut: futures.Future) -> None:
+        # failures lose the measurements made where they were raised
+        if (exc := fut.exception()) is None:
+            row = fut.result()[1]
+        else:
+            row = {"name": name, "kind": kind, "error": repr(exc)}
+        rows.append(row)
+        if status is not None:
+            status.update(row)
 
-    # signatures
-    utils.write_signatures_jsons(outroot=outroot)
+    def _start_ready_steps(executor: futures.Executor) -> None:
+        for step, deps in list(waiting.items()):
+            if not deps:
+                del waiting[step]
+                fut = executor.submit(
+                    report.measured,
+                    step.name,
+                    "step",
+                    run_step,
+                    step,
+                    ctx,
+                    incremental=incremental,
+                    resume=resume,
+                )
+                fut.add_done_callback(functools.partial(_record, step.name, "step"))
+                steps[fut] = step
 
-    # qsirecon_fsl_dtifit
-    utils.remove_qsirecon_fsl_dtifit_v3_only(
-        root=outroot / "derivatives" / "qsirecon_fsl_dtifit"
+    with pool, futures.ThreadPoolExecutor(max_workers=max_steps) as post:
+        copies = {
+            (
+                pool.submit(
+                    report.measured,
+                    job,
+                    "job",
+                    copy_job,
+                    job,
+                    inroot,
+                    outroot,
+                    records,
+                    job_workers,
+                    incremental=incremental,
+                    strategy=strategies.get(job, materialize.SYMLINK),
+                    resume=resume,
+                    shard=shard,
+                )
+                if plan_file is None
+                else pool.submit(
+                    report.measured,
+                    job,
+                    "job",
+                    execute_job,
+                    planned[(job,)],
+                    job_workers,
+                    incremental=incremental,
+                    strategy=strategies.get(job, materialize.SYMLINK),
+                    resume=resume,
+                    shard=shard,
+                )
+            ): job
+            for job in jobs_to_copy
+            if job not in indexes
+        }
+        for fut, job in copies.items():
+            fut.add_done_callback(functools.partial(_record, job, "job"))
+        _start_ready_steps(post)
+        for fut in futures.as_completed(copies):
+            job = copies[fut]
+            try:
+                indexes[job] = fut.result()[0]
+            except Exception as e:
+                logging.exception(f"Failed to copy {job}")
+                errors.append(e)
+                # do not run steps that depend on this job
+                for step in [s for s, deps in waiting.items() if job in deps]:
+                    logging.warning(f"Skipping {step.name}, which needs {job}")
+                    del waiting[step]
+                continue
+            for deps in waiting.values():
+                deps.discard(job)
+            _start_ready_steps(post)
+
+        for fut in futures.as_completed(steps):
+            try:
+                fut.result()
+            except Exception as e:
+                logging.exception(f"Failed to run {steps[fut].name}")
+                errors.append(e)
+
+    if status is not None:
+        status.close()
+    report.write(
+        rows, report_file or _shard_file(report.get_report_file(outroot), shard)
     )
+    report.log(rows)
+    if errors:
+        msg = f"{len(errors)} job(s) or post-processing step(s) failed"
+        raise ExceptionGroup(msg, errors)
+
+
+def merge(
+    inroot: Path,
+    outroot: Path,
+    n_shards: int,
+    jobs_to_merge: typing.Sequence[jobs.STORE_DIR] = jobs.STORE_DIRS,
+    *,
+    incremental: bool = False,
+    table_formats: typing.Collection[str] = (),
+    report_file: Path | None = None,
+    progress: bool = False,
+    resume: bool = False,
+    max_steps: int | None = None,
+) -> None:
+    """Finish a release whose jobs were mirrored in shards (see main)
+
+    Args:
+        inroot (Path): See main.
+        outroot (Path): See main.
+        n_shards (int): Number of shards that the jobs were split into.
+        jobs_to_merge (typing.Sequence[jobs.STORE_DIR], optional): Jobs that were
+            mirrored. Post-processing steps that need other jobs are not run.
+            Defaults to jobs.STORE_DIRS.
+        incremental (bool, optional): See main. Defaults to False.
+        table_formats (typing.Collection[str], optional): See main. Defaults to ().
+        report_file (Path | None, optional): See main. Defaults to None.
+        progress (bool, optional): See main. Defaults to False.
+        resume (bool, optional): Skip the post-processing steps that a previous,
+            interrupted merge finished. Defaults to False.
+        max_steps (int | None, optional): See main. Defaults to None.
 
-    # idps
-    utils.write_idps(inroot=inroot, outroot=outroot)
+    Raises:
+        FileNotFoundError: Any shard of a job is missing or unfinished.
 
-    # everything
-    utils.write_release_notes(outroot=outroot)
+    Details:
+        The indexes that the shards journaled are combined into that of each job,
+        which is journaled (and, for incremental runs, written to the manifest) as
+        if the job had been mirrored in one piece. main then runs the
+        post-processing steps (including the release-level tables), once.
+    """
+    missing = []
+    for job in jobs_to_merge:
+        parts = [
+            journal.read_job(outroot, job, shards.Shard(i, n_shards))
+            for i in range(n_shards)
+        ]
+        if any(part is None for part in parts):
+            missing.append(job)
+            continue
+        # directories that belong to no subject are in every shard
+        index = pl.concat(parts).unique("path", keep="first").sort("path")
+        if incremental:
+            manifest.write_entries(outroot, job, index)
+        journal.write_job(outroot, job, index)
+    if missing:
+        msg = f"Not all {n_shards} shards of {missing} have finished"
+        raise FileNotFoundError(msg)
+
+    if not resume:
+        journal.clear_steps(outroot)
+    main(
+        inroot,
+        outroot,
+        jobs_to_copy=jobs_to_merge,
+        incremental=incremental,
+        table_formats=table_formats,
+        report_file=report_file,
+        progress=progress,
+        # every job is found in the journal, so only the steps run
+        resume=True,
+        steps_to_run=[
+            step.name for step in POST_STEPS if set(step.needs) <= set(jobs_to_merge)
+        ],
+        max_steps=max_steps,
+    )
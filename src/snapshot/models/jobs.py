@@ -22,3 +22,50 @@ STORE_DIR = typing.Literal[
 ]
 
 STORE_DIRS = typing.get_args(STORE_DIR)
+
+
+class Job(typing.NamedTuple):
+    """Layout of the outputs of one STORE_DIR
+
+    Attributes:
+        outdir: Destination, relative to the root of the release.
+        roots: Directories (relative to the job directory, may be glob patterns)
+            that hold one entry per subject.
+        separator: How the sub entity is written in those entries, either BIDS-style
+            (sub-10003) or hive-style (sub=10003).
+    """
+
+    outdir: str
+    roots: tuple[str, ...] = ("",)
+    separator: typing.Literal["-", "="] = "-"
+
+    @property
+    def subject_patterns(self) -> tuple[str, ...]:
+        return tuple(
+            f"{root}/sub{self.separator}*" if root else f"sub{self.separator}*"
+            for root in self.roots
+        )
+
+
+JOBS: dict[STORE_DIR, Job] = {
+    "bedpostx": Job(outdir="derivatives/bedpostx"),
+    "bids": Job(outdir="rawdata"),
+    "brainager": Job(outdir="derivatives/brainager"),
+    "cat12": Job(outdir="derivatives/cat12"),
+    "dwi_biomarker1": Job(outdir="derivatives/dwi_biomarker1", roots=("networks",)),
+    "eddyqc": Job(outdir="derivatives/eddyqc"),
+    "fcn": Job(outdir="derivatives/fcn", roots=("*cleaned",)),
+    "fmriprep": Job(outdir="derivatives/fmriprep"),
+    "freesurfer": Job(outdir="derivatives/freesurfer"),
+    "fslanat": Job(outdir="derivatives/fslanat"),
+    "gift": Job(outdir="derivatives/gift"),
+    "mriqc": Job(outdir="derivatives/mriqc"),
+    "postdtifit": Job(outdir="derivatives/postdtifit", roots=("diffusion_regional",)),
+    "postgift": Job(outdir="derivatives/postgift", roots=("amplitude",), separator="="),
+    "qsiprep-V1": Job(outdir="derivatives/qsiprep-V1"),
+    "qsirecon_fsl_dtifit": Job(
+        outdir="derivatives/qsirecon_fsl_dtifit", roots=("qsirecon-fsl",)
+    ),
+    "signatures": Job(outdir="derivatives/signatures", roots=("*cleaned",)),
+    "synthstrip": Job(outdir="derivatives/synthstrip"),
+}
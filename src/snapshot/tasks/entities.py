@@ -0,0 +1,36 @@
+import re
+import typing
+
+ENTITIES = ("sub", "ses", "task", "run")
+
+# entities appear either BIDS-style (sub-10003) or hive-style (sub=10003), and
+# always at the start of a name or after a separator (so "rest_run-01" gives
+# run=01, but "subset-1" gives nothing)
+ENTITY_PATTERN = re.compile(r"(?<![A-Za-z0-9])(sub|ses|task|run)[-=]([A-Za-z0-9]+)")
+
+
+class Entities(typing.TypedDict, total=False):
+    sub: str
+    ses: str
+    task: str
+    run: str
+
+
+def parse(name: str, inherit: Entities | None = None) -> Entities:
+    """Extract the entities from a file or directory name
+
+    Args:
+        name (str): Name (or path) to parse.
+        inherit (Entities | None, optional): Entities of the parent directory.
+            Values parsed from name take precedence. Defaults to None.
+
+    Returns:
+        Entities: The first value found for each entity.
+    """
+    out: Entities = Entities() if inherit is None else Entities(**inherit)
+    found: set[str] = set()
+    for key, value in ENTITY_PATTERN.findall(name):
+        if key not in found:
+            out[key] = value
+            found.add(key)
+    return out
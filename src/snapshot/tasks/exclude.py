@@ -0,0 +1,104 @@
+import re
+import typing
+
+import polars as pl
+
+from snapshot import datasets
+from snapshot.models import jobs
+from snapshot.tasks import scan
+
+# matches both BIDS-style (ses-V3) and hive-style (ses=V3) names
+V3_PATTERN = re.compile(r"ses[-=]V3")
+
+SUB_PATTERN = re.compile(r"(?<![A-Za-z0-9])sub[-=](\d+)")
+
+
+def is_excluded(name: str, subs: typing.Container[int]) -> bool:
+    """Whether a file or directory name belongs to V3 or to an excluded subject
+
+    Args:
+        name (str): Name to check.
+        subs (typing.Container[int]): Subjects to exclude. Should support O(1)
+            membership tests (e.g., a frozenset).
+
+    Returns:
+        bool: True if the name should be left out of the release.
+
+    Details:
+        Only the values of sub entities are compared against subs, so a subject
+        number that happens to appear inside some other entity (or a checksum,
+        date, etc.) is not mistaken for that subject.
+    """
+    if V3_PATTERN.search(name):
+        return True
+    return any(int(sub) in subs for sub in SUB_PATTERN.findall(name))
+
+
+def ignore_entities(
+    subs: typing.Iterable[int],
+) -> typing.Callable[[str, typing.Iterable[str]], set[str]]:
+    """Entity-aware replacement for shutil.ignore_patterns
+
+    Args:
+        subs (typing.Iterable[int]): Subjects to exclude.
+
+    Returns:
+        typing.Callable: Function that can be used as copytree's ignore argument,
+            ignoring V3 data and anything belonging to subs.
+    """
+    excluded = frozenset(subs)
+
+    def _ignore(path: str, names: typing.Iterable[str]) -> set[str]:  # noqa: ARG001
+        return {name for name in names if is_excluded(name, excluded)}
+
+    return _ignore
+
+
+def subjects_to_exclude(
+    index: pl.DataFrame, job: jobs.Job, records: typing.Collection[int]
+) -> set[int]:
+    """Subjects that are present in a job but which won't be included in release
+
+    Args:
+        index (pl.DataFrame): Index of the job directory (see scan.scan).
+        job (jobs.Job): Layout of the job.
+        records (typing.Collection[int]): Subjects included in the release.
+
+    Returns:
+        set[int]: Subjects not in records, and subjects whose directories only
+            have ses-V3 outputs available.
+
+    Details:
+        The V3-only rule matters for cases like fmriprep, with outputs
+        fmriprep/sub-10003/{figures,log,ses-V3}; ses-V3 will be excluded, but we'd
+        still get fmriprep/sub-10003/{figures,log}. Names like
+        sub-25052_ses-V3_T1w.anat are excluded separately (see is_excluded).
+    """
+    subjects = (
+        scan.match(index, *job.subject_patterns)
+        .filter(pl.col("sub").is_not_null())
+        .select("path", "kind", "sub")
+    )
+    sessions = (
+        scan.match(index, *(f"{p}/ses*" for p in job.subject_patterns))
+        .group_by(parent=pl.col("path").str.replace(r"/[^/]*$", ""))
+        .agg(
+            n_sessions=pl.len(),
+            v3_only=pl.col("name").first().str.contains("V3"),
+        )
+    )
+    subjects = subjects.join(sessions, left_on="path", right_on="parent", how="left")
+    v3_only = (
+        (pl.col("kind") == "dir") & (pl.col("n_sessions") == 1) & pl.col("v3_only")
+    ).fill_null(False)
+    included = (
+        datasets.as_records(records)
+        .series.to_frame()
+        .with_columns(included=pl.lit(True))
+    )
+    return set(
+        subjects.join(included, on="sub", how="left")
+        .filter(pl.col("included").is_null() | v3_only)
+        .get_column("sub")
+        .unique()
+    )
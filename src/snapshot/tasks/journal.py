@@ -0,0 +1,123 @@
+import json
+import os
+import shutil
+import time
+import typing
+from pathlib import Path
+
+import polars as pl
+
+from snapshot.tasks import scan, shards
+
+
+def get_journal_dir(outroot: Path, shard: shards.Shard | None = None) -> Path:
+    """Like manifests, journals are kept next to (not inside) the release
+
+    Each shard keeps a journal of its own, so that shards never write to the same
+    files.
+    """
+    root = outroot.with_name(f"{outroot.name}.journal")
+    return root if shard is None else root / shard.name
+
+
+def _job_file(outroot: Path, job: str, shard: shards.Shard | None) -> Path:
+    return get_journal_dir(outroot, shard) / "jobs" / f"{job}.parquet"
+
+
+def _dirs_file(outroot: Path, job: str, shard: shards.Shard | None) -> Path:
+    return get_journal_dir(outroot, shard) / "dirs" / f"{job}.txt"
+
+
+def _step_file(outroot: Path, step: str) -> Path:
+    return get_journal_dir(outroot) / "steps" / f"{step}.json"
+
+
+def clear(outroot: Path, shard: shards.Shard | None = None) -> None:
+    """Remove the journal, including those of all shards unless one is given"""
+    shutil.rmtree(get_journal_dir(outroot, shard), ignore_errors=True)
+
+
+def clear_jobs(
+    outroot: Path,
+    jobs_to_clear: typing.Iterable[str],
+    shard: shards.Shard | None = None,
+) -> None:
+    """Remove the entries of some jobs
+
+    Entries of other jobs are left alone, since other processes (e.g., other tasks
+    of a Slurm job array) may be mirroring them.
+    """
+    for job in jobs_to_clear:
+        _job_file(outroot, job, shard).unlink(missing_ok=True)
+        _dirs_file(outroot, job, shard).unlink(missing_ok=True)
+
+
+def clear_steps(outroot: Path, steps: typing.Iterable[str] | None = None) -> None:
+    """Remove the entries of some post-processing steps, or of all of them"""
+    if steps is None:
+        shutil.rmtree(get_journal_dir(outroot) / "steps", ignore_errors=True)
+        return
+    for step in steps:
+        _step_file(outroot, step).unlink(missing_ok=True)
+
+
+def read_job(
+    outroot: Path, job: str, shard: shards.Shard | None = None
+) -> pl.DataFrame | None:
+    """Index of a job (or shard of one) that was completely mirrored, if any"""
+    if not (src := _job_file(outroot, job, shard)).exists():
+        return None
+    return pl.read_parquet(src).cast(scan.SCHEMA)  # type: ignore[arg-type]
+
+
+def write_job(
+    outroot: Path, job: str, index: pl.DataFrame, shard: shards.Shard | None = None
+) -> None:
+    dst = _job_file(outroot, job, shard)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_suffix(".tmp")
+    index.select(scan.SCHEMA.names()).write_parquet(tmp)
+    os.replace(tmp, dst)
+
+
+def read_dirs(outroot: Path, job: str, shard: shards.Shard | None = None) -> set[str]:
+    """Directories of a job whose files were all mirrored (see DirLog)"""
+    if not (src := _dirs_file(outroot, job, shard)).exists():
+        return set()
+    with src.open() as f:
+        # the last line may have been cut short
+        return {line[:-1] for line in f if line.endswith("\n")}
+
+
+class DirLog:
+    """Append-only record of the directories of a job that are done
+
+    Lines are flushed as they are written, so the record survives the process
+    being killed (e.g., at the end of a Slurm allocation).
+    """
+
+    def __init__(
+        self, outroot: Path, job: str, shard: shards.Shard | None = None
+    ) -> None:
+        self.dst = _dirs_file(outroot, job, shard)
+
+    def __enter__(self) -> typing.Self:
+        self.dst.parent.mkdir(parents=True, exist_ok=True)
+        self._f = self.dst.open("a", buffering=1)
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._f.close()
+
+    def add(self, path: str) -> None:
+        self._f.write(f"{path}\n")
+
+
+def step_is_done(outroot: Path, step: str) -> bool:
+    return _step_file(outroot, step).exists()
+
+
+def write_step(outroot: Path, step: str) -> None:
+    dst = _step_file(outroot, step)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    dst.write_text(json.dumps({"finished": time.time()}))
@@ -0,0 +1,241 @@
+import functools
+import hashlib
+import json
+import os
+import shutil
+import typing
+from importlib import resources
+from pathlib import Path
+
+import polars as pl
+
+from snapshot import datasets
+from snapshot.tasks import scan
+
+# columns of an index that determine whether an entry needs to be mirrored again.
+# Directories are compared by kind only, because their mtime changes whenever
+# their contents do
+ENTRY_COLUMNS = ["path", "kind", "target", "size", "mtime_ns"]
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_manifest_dir(outroot: Path) -> Path:
+    """Manifests are kept next to (not inside) the release"""
+    return outroot.with_name(f"{outroot.name}.manifest")
+
+
+def _entries_file(outroot: Path, job: str) -> Path:
+    return get_manifest_dir(outroot) / "jobs" / f"{job}.parquet"
+
+
+def _step_file(outroot: Path, step: str) -> Path:
+    return get_manifest_dir(outroot) / "steps" / f"{step}.json"
+
+
+def read_entries(outroot: Path, job: str) -> pl.DataFrame | None:
+    if not (src := _entries_file(outroot, job)).exists():
+        return None
+    return pl.read_parquet(src)
+
+
+def write_entries(outroot: Path, job: str, index: pl.DataFrame) -> None:
+    dst = _entries_file(outroot, job)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    index.select(ENTRY_COLUMNS).write_parquet(dst)
+
+
+def diff(
+    old: pl.DataFrame, new: pl.DataFrame
+) -> tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+    """Compare the manifest of a job against its current index
+
+    Args:
+        old (pl.DataFrame): Entries recorded by the previous run.
+        new (pl.DataFrame): Entries that should be mirrored now. Must have been
+            scanned with stat=True.
+
+    Returns:
+        tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]: Entries of new that are
+            not in old (added), entries of old that are not in new (removed), and
+            entries of new whose kind, symlink target, or (for files) size or mtime
+            differ from old (changed).
+    """
+    added = new.join(old, on="path", how="anti")
+    removed = old.join(new, on="path", how="anti")
+    changed = (
+        new.join(old.select(ENTRY_COLUMNS), on="path", how="inner", suffix="_old")
+        .filter(
+            (pl.col("kind") != pl.col("kind_old"))
+            | pl.col("target").ne_missing(pl.col("target_old"))
+            | (
+                (pl.col("kind") == "file")
+                & (
+                    pl.col("size").ne_missing(pl.col("size_old"))
+                    | pl.col("mtime_ns").ne_missing(pl.col("mtime_ns_old"))
+                )
+            )
+        )
+        .select(new.columns)
+    )
+    return added, removed, changed
+
+
+def remove(root: Path, entries: pl.DataFrame) -> None:
+    """Delete entries (and anything below them) from a mirrored tree"""
+    for path in entries.sort("path", descending=True).get_column("path"):
+        dst = root / path
+        if dst.is_dir() and not dst.is_symlink():
+            shutil.rmtree(dst)
+        else:
+            dst.unlink(missing_ok=True)
+
+
+def hash_file(src: Path) -> str:
+    h = hashlib.sha256()
+    with src.open("rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def digest_entries(index: pl.DataFrame) -> str:
+    """Stable digest of the entries of an index"""
+    data = index.select(ENTRY_COLUMNS).sort("path").write_csv()
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+@functools.cache
+def _digest_reference_data() -> str:
+    h = hashlib.sha256()
+    for src in sorted(
+        (f for f in resources.files("snapshot.data").iterdir() if f.is_file()),
+        key=lambda f: f.name,
+    ):
+        h.update(src.name.encode())
+        h.update(src.read_bytes())
+    # not bundled, but part of the participants table
+    if (demographics := datasets.get_demographics()).exists():
+        st = demographics.stat()
+        h.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def fingerprint(
+    records: typing.Collection[int],
+    entries: typing.Mapping[str, pl.DataFrame],
+    inputs: typing.Iterable[Path] = (),
+    options: typing.Iterable[str] = (),
+) -> str:
+    """Summarize everything that a post-processing step depends on
+
+    Args:
+        records (typing.Collection[int]): Subjects included in the release.
+        entries (typing.Mapping[str, pl.DataFrame]): Index of each job that the step
+            needs.
+        inputs (typing.Iterable[Path], optional): Other files read by the step.
+            Compared by size and mtime. Defaults to ().
+        options (typing.Iterable[str], optional): Settings that change what the step
+            writes (e.g., table formats). Defaults to ().
+
+    Returns:
+        str: Hex digest.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(sorted(records)).encode())
+    h.update(_digest_reference_data().encode())
+    for job in sorted(entries):
+        h.update(f"{job}:{digest_entries(entries[job])}".encode())
+    for src in inputs:
+        st = src.stat() if src.exists() else None
+        h.update(f"{src}:{st and st.st_size}:{st and st.st_mtime_ns}".encode())
+    h.update(json.dumps(list(options)).encode())
+    return h.hexdigest()
+
+
+def _generated_files(
+    outroot: Path,
+    outputs: typing.Iterable[str],
+    mirrored: typing.Mapping[str, pl.DataFrame],
+) -> list[str]:
+    # files that are still as they were mirrored (e.g., hardlinks or copies of the
+    # source files) were not written by the step
+    untouched = [
+        index.filter(pl.col("kind") == "file").select(
+            pl.lit(f"{outdir}/").add(pl.col("path")).alias("path"),
+            "size",
+            "mtime_ns",
+        )
+        for outdir, index in mirrored.items()
+    ]
+    files = []
+    for output in outputs:
+        if (dst := outroot / output).is_dir():
+            index = (
+                scan.scan(dst, stat=bool(untouched))
+                .filter(pl.col("kind") == "file")
+                .with_columns(pl.lit(f"{output}/").add(pl.col("path")).alias("path"))
+            )
+            if untouched:
+                index = index.join(
+                    pl.concat(untouched), on=["path", "size", "mtime_ns"], how="anti"
+                )
+            files.extend(index.get_column("path"))
+        elif dst.is_file() and not dst.is_symlink():
+            files.append(output)
+    return files
+
+
+def write_step(
+    outroot: Path,
+    step: str,
+    fingerprint: str,
+    outputs: typing.Iterable[str],
+    mirrored: typing.Mapping[str, pl.DataFrame] | None = None,
+) -> None:
+    """Record a finished post-processing step
+
+    Args:
+        outroot (Path): Root of the release.
+        step (str): Name of the step.
+        fingerprint (str): See fingerprint.
+        outputs (typing.Iterable[str]): Files and directories (relative to outroot)
+            written by the step. The regular files (not symlinks) found there are
+            hashed, so that later runs can check that they are still intact.
+        mirrored (typing.Mapping[str, pl.DataFrame] | None, optional): Index of
+            each job that was mirrored into outputs (scanned with stat=True), by
+            the output directory of the job. Files that are still as they were
+            mirrored (e.g., hardlinks or copies) are not hashed. Defaults to None.
+    """
+    files = {}
+    for path in _generated_files(outroot, outputs, mirrored or {}):
+        st = (outroot / path).stat()
+        files[path] = [st.st_size, st.st_mtime_ns, hash_file(outroot / path)]
+    dst = _step_file(outroot, step)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"fingerprint": fingerprint, "files": files}))
+    os.replace(tmp, dst)
+
+
+def step_is_current(outroot: Path, step: str, fingerprint: str) -> bool:
+    """Whether a step already ran with the same inputs and its outputs are intact
+
+    Generated files are only re-hashed when their size or mtime has changed.
+    """
+    if not (src := _step_file(outroot, step)).exists():
+        return False
+    record: dict[str, typing.Any] = json.loads(src.read_text())
+    if record.get("fingerprint") != fingerprint:
+        return False
+    for path, (size, mtime_ns, digest) in record.get("files", {}).items():
+        dst = outroot / path
+        try:
+            st = dst.stat()
+        except FileNotFoundError:
+            return False
+        if (st.st_size, st.st_mtime_ns) == (size, mtime_ns):
+            continue
+        if hash_file(dst) != digest:
+            return False
+    return True
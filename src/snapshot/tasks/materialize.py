@@ -0,0 +1,169 @@
+import errno
+import fcntl
+import fnmatch
+import os
+import stat
+import typing
+
+MODE = typing.Literal["symlink", "hardlink", "reflink", "copy"]
+MODES: tuple[MODE, ...] = typing.get_args(MODE)
+
+# from linux/fs.h
+FICLONE = 0x40049409
+
+# bytes per copy_file_range or sendfile call
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# the filesystem cannot share the blocks or inode of a file (or not across
+# filesystems), so its contents are copied instead
+NO_REFLINK = frozenset(
+    {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS}
+)
+NO_HARDLINK = frozenset({errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOENT})
+NO_COPY_FILE_RANGE = frozenset(
+    {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}
+)
+
+
+class Strategy(typing.NamedTuple):
+    """How the files of a job are materialized in the release
+
+    Attributes:
+        default: Mode of files that match none of the rules.
+        rules: Pairs of glob pattern and mode, matched in order against the names
+            of files, e.g. (("*.tsv", "copy"), ("*.nii.gz", "reflink")).
+    """
+
+    default: MODE = "symlink"
+    rules: tuple[tuple[str, MODE], ...] = ()
+
+    def mode(self, name: str) -> MODE:
+        for pattern, mode in self.rules:
+            if fnmatch.fnmatchcase(name, pattern):
+                return mode
+        return self.default
+
+
+# what copytree has always done
+SYMLINK = Strategy()
+
+
+def parse(spec: str) -> Strategy:
+    """Strategy from a string like "symlink,*.tsv=copy,*.nii.gz=reflink"
+
+    The (optional) item without a pattern is the default.
+    """
+    default: MODE = "symlink"
+    rules = []
+    for item in filter(None, spec.split(",")):
+        pattern, _, mode = item.rpartition("=")
+        if mode not in MODES:
+            msg = f"Unknown materialization mode {mode!r}, expected one of {MODES}"
+            raise ValueError(msg)
+        if pattern:
+            rules.append((pattern, typing.cast(MODE, mode)))
+        else:
+            default = typing.cast(MODE, mode)
+    return Strategy(default=default, rules=tuple(rules))
+
+
+def _copy_data(src_fd: int, dst_fd: int) -> None:
+    copy_file_range = getattr(os, "copy_file_range", None)
+    while copy_file_range is not None:
+        try:
+            if copy_file_range(src_fd, dst_fd, CHUNK_SIZE) == 0:
+                return
+        except OSError as e:
+            if e.errno not in NO_COPY_FILE_RANGE:
+                raise
+            copy_file_range = None
+    # both calls advance the file offsets, so this picks up where the other stopped
+    while os.sendfile(dst_fd, src_fd, None, CHUNK_SIZE) > 0:
+        pass
+
+
+def create(src: str, name: str, dir_fd: int, mode: MODE) -> MODE:
+    """Materialize a file in a directory
+
+    Args:
+        src (str): Absolute path of the file, with symlinks already resolved.
+        name (str): Name of the new entry.
+        dir_fd (int): Directory in which to create it.
+        mode (MODE): symlink to src; hardlink (same inode); reflink (separate inode
+            sharing the blocks of src, with FICLONE); or copy (copy_file_range, or
+            sendfile where that is not supported).
+
+    Returns:
+        MODE: What was actually done. Hardlinks and reflinks that the filesystem
+            does not support fall back to copies. Directories and missing files are
+            always symlinked.
+
+    Details:
+        Copies and reflinks keep the permissions and times of src. A partially
+        written copy is removed before the error is raised.
+    """
+    if mode == "symlink":
+        os.symlink(src, name, dir_fd=dir_fd)
+        return mode
+    if mode == "hardlink":
+        try:
+            os.link(src, name, dst_dir_fd=dir_fd)
+        except OSError as e:
+            if e.errno not in NO_HARDLINK:
+                raise
+            mode = "copy"
+        else:
+            return mode
+
+    try:
+        src_fd = os.open(src, os.O_RDONLY)
+    except FileNotFoundError:
+        # dangling, as a symlink would be
+        os.symlink(src, name, dir_fd=dir_fd)
+        return "symlink"
+    try:
+        st = os.fstat(src_fd)
+        if not stat.S_ISREG(st.st_mode):
+            os.symlink(src, name, dir_fd=dir_fd)
+            return "symlink"
+        dst_fd = os.open(
+            name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600, dir_fd=dir_fd
+        )
+        try:
+            if mode == "reflink":
+                try:
+                    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                except OSError as e:
+                    if e.errno not in NO_REFLINK:
+                        raise
+                    mode = "copy"
+            if mode == "copy":
+                _copy_data(src_fd, dst_fd)
+            os.fchmod(dst_fd, stat.S_IMODE(st.st_mode))
+            os.utime(dst_fd, ns=(st.st_atime_ns, st.st_mtime_ns))
+        except BaseException:
+            os.unlink(name, dir_fd=dir_fd)
+            raise
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    return mode
+
+
+def is_current(src: str, name: str, dir_fd: int) -> bool:
+    """Whether an existing entry already mirrors src, as create would have made it
+
+    Symlinks must point to src. Other files must have the size and mtime of src,
+    which copies only get once they are complete.
+    """
+    st = os.stat(name, dir_fd=dir_fd, follow_symlinks=False)
+    if stat.S_ISLNK(st.st_mode):
+        return os.readlink(name, dir_fd=dir_fd) == src
+    if not stat.S_ISREG(st.st_mode):
+        return False
+    try:
+        src_st = os.stat(src)
+    except FileNotFoundError:
+        return False
+    return (st.st_size, st.st_mtime_ns) == (src_st.st_size, src_st.st_mtime_ns)
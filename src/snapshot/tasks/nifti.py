@@ -0,0 +1,140 @@
+import gzip
+import logging
+import os
+import struct
+import typing
+from concurrent import futures
+from pathlib import Path
+
+import polars as pl
+
+from snapshot import datasets
+
+# sizeof_hdr, and where dim (the number of dimensions followed by their lengths)
+# lives in each version of the header
+HEADERS = {
+    348: (40, "8h"),  # NIfTI-1
+    540: (16, "8q"),  # NIfTI-2
+}
+
+CACHE_SCHEMA = pl.Schema(
+    {
+        "path": pl.String,
+        "size": pl.Int64,
+        "mtime_ns": pl.Int64,
+        "shape": pl.List(pl.Int64),
+    }
+)
+
+
+def get_cache_file() -> Path:
+    return datasets.get_cache_dir() / "nifti-shapes.parquet"
+
+
+def _open(src: Path) -> typing.BinaryIO:
+    if src.name.endswith(".gz"):
+        return typing.cast(typing.BinaryIO, gzip.open(src, "rb"))
+    return src.open("rb")
+
+
+def read_shape(src: Path) -> tuple[int, ...]:
+    """Shape of a NIfTI-1 or NIfTI-2 image, read from its header alone
+
+    Args:
+        src (Path): Image, optionally gzipped.
+
+    Returns:
+        tuple[int, ...]: Length of each dimension, as nibabel's img.shape.
+
+    Details:
+        Only the first 348 (NIfTI-1) or 540 (NIfTI-2) bytes are inflated, so the
+        cost does not depend on the size of the image.
+    """
+    with _open(src) as f:
+        header = f.read(540)
+    if len(header) < min(HEADERS):
+        msg = f"{src} is too short to be a NIfTI image ({len(header)} bytes)"
+        raise ValueError(msg)
+    for endian in "<>":
+        (sizeof_hdr,) = struct.unpack_from(f"{endian}i", header)
+        if sizeof_hdr in HEADERS:
+            break
+    else:
+        msg = f"{src} does not have a NIfTI-1 or NIfTI-2 header"
+        raise ValueError(msg)
+    offset, fmt = HEADERS[sizeof_hdr]
+    if len(header) < sizeof_hdr:
+        msg = f"{src} has a truncated header"
+        raise ValueError(msg)
+    ndim, *dim = struct.unpack_from(f"{endian}{fmt}", header, offset)
+    if not 0 < ndim <= len(dim):
+        msg = f"{src} has an invalid number of dimensions ({ndim})"
+        raise ValueError(msg)
+    return tuple(dim[:ndim])
+
+
+def _read_cache(cache: Path) -> dict[tuple[str, int, int], tuple[int, ...]]:
+    if not cache.exists():
+        return {}
+    try:
+        d = pl.read_parquet(cache).cast(CACHE_SCHEMA)  # type: ignore[arg-type]
+    except datasets.get_cache_errors():
+        logging.warning(f"Ignoring unreadable cache {cache}")
+        return {}
+    return {
+        (path, size, mtime_ns): tuple(shape)
+        for path, size, mtime_ns, shape in d.iter_rows()
+    }
+
+
+def _write_cache(
+    shapes: typing.Mapping[tuple[str, int, int], tuple[int, ...]], cache: Path
+) -> None:
+    d = pl.DataFrame(
+        [(*key, list(shape)) for key, shape in shapes.items()],
+        schema=CACHE_SCHEMA,
+        orient="row",
+    )
+    try:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache.with_name(f"{cache.name}.{os.getpid()}.tmp")
+        d.write_parquet(tmp)
+        os.replace(tmp, cache)
+    except OSError as e:
+        logging.warning(f"Unable to cache image shapes: {e}")
+
+
+def read_shapes(
+    srcs: typing.Iterable[Path],
+    max_workers: int | None = None,
+    cache: Path | None = None,
+) -> dict[Path, tuple[int, ...]]:
+    """Shapes of many images, reusing those read by previous runs
+
+    Args:
+        srcs (typing.Iterable[Path]): Images.
+        max_workers (int | None, optional): See ThreadPoolExecutor. Defaults to None.
+        cache (Path | None, optional): Parquet file with shapes from previous runs,
+            keyed by (resolved path, size, mtime). Only the shapes of srcs are
+            kept, so that it does not grow with every release. Defaults to
+            get_cache_file().
+
+    Returns:
+        dict[Path, tuple[int, ...]]: Shape of each image (see read_shape).
+    """
+    cache = cache or get_cache_file()
+    cached = _read_cache(cache)
+    keys = {}
+    for src in srcs:
+        st = src.stat()
+        keys[src] = (os.fspath(src.resolve()), st.st_size, st.st_mtime_ns)
+    todo = [src for src, key in keys.items() if key not in cached]
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for src, shape in zip(todo, executor.map(read_shape, todo), strict=True):
+            cached[keys[src]] = shape
+    # images that were removed or changed since are dropped
+    shapes = {key: cached[key] for key in keys.values()}
+    if todo or len(shapes) < len(cached):
+        _write_cache(shapes, cache)
+    logging.info(f"Read {len(todo)} of {len(keys)} image headers")
+    return {src: shapes[key] for src, key in keys.items()}
@@ -0,0 +1,215 @@
+import functools
+import logging
+import os
+import time
+import typing
+from concurrent import futures
+from pathlib import Path
+
+import polars as pl
+
+from snapshot.models import jobs
+from snapshot.tasks import exclude, manifest, scan, shards
+
+# keep: already mirrored by a previous (incremental) run
+# mkdir, link: mirror an entry of the job directory
+# remove: delete an entry mirrored by a previous run (and anything below it)
+# exclude: entry (and anything below it) that is left out of the release
+# rewrite: output of a post-processing step
+OP = pl.Enum(["keep", "mkdir", "link", "remove", "exclude", "rewrite"])
+
+SCHEMA = pl.Schema(
+    {
+        "job": pl.String,
+        "step": pl.String,
+        "op": OP,
+        "inroot": pl.String,
+        "outroot": pl.String,
+        **scan.SCHEMA,
+        # bytes reachable through the entry (the target of a symlink)
+        "bytes": pl.Int64,
+    }
+)
+
+
+def get_plan_file(outroot: Path) -> Path:
+    return outroot.with_name(f"{outroot.name}.plan.parquet")
+
+
+def _bytes(root: Path, index: pl.DataFrame, max_workers: int | None) -> pl.Series:
+    def _size(path: str) -> int | None:
+        try:
+            return os.stat(root / path).st_size
+        except OSError:
+            return None
+
+    links = index.filter(pl.col("kind") == "symlink").get_column("path")
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        sizes = dict(zip(links, executor.map(_size, links), strict=True))
+    return pl.Series(
+        "bytes",
+        [
+            sizes.get(path) if kind == "symlink" else size
+            for path, kind, size in index.select("path", "kind", "size").iter_rows()
+        ],
+        dtype=pl.Int64,
+    )
+
+
+def _with_op(
+    index: pl.DataFrame, op: str | pl.Expr, job: str, inroot: Path, outroot: Path
+) -> pl.DataFrame:
+    # entries read back from a manifest only have some of the columns
+    index = pl.concat([pl.DataFrame(schema=scan.SCHEMA), index], how="diagonal_relaxed")
+    return index.with_columns(
+        job=pl.lit(job),
+        step=pl.lit(None, dtype=pl.String),
+        op=op if isinstance(op, pl.Expr) else pl.lit(op),
+        inroot=pl.lit(os.fspath(inroot)),
+        outroot=pl.lit(os.fspath(outroot)),
+        bytes=pl.lit(None, dtype=pl.Int64),
+    ).select(SCHEMA.names())
+
+
+def make_job(
+    job: jobs.STORE_DIR,
+    inroot: Path,
+    outroot: Path,
+    records: typing.Collection[int],
+    max_workers: int | None = None,
+    *,
+    incremental: bool = False,
+    stat: bool = False,
+    shard: shards.Shard | None = None,
+) -> pl.DataFrame:
+    """Work needed to mirror one STORE_DIR into the release, without doing it
+
+    Args:
+        job (jobs.STORE_DIR): Job to plan.
+        inroot (Path): See copy_to_dst_wf.main.
+        outroot (Path): See copy_to_dst_wf.main.
+        records (typing.Collection[int]): Subjects included in the release.
+        max_workers (int | None, optional): See scan.scan. Defaults to None.
+        incremental (bool, optional): Compare against the manifest of a previous
+            run (see manifest.diff) instead of planning a full mirror. Defaults to
+            False.
+        stat (bool, optional): Record size, mtime and bytes of each entry. Implied
+            by incremental. Defaults to False.
+        shard (shards.Shard | None, optional): Only walk the directories of the
+            subjects in this shard. The plan still needs shards.Shard.select, which
+            also drops the directories of other subjects. Defaults to None.
+
+    Returns:
+        pl.DataFrame: One row per operation (see SCHEMA), sorted so that the
+            directories come before their contents.
+    """
+    start = time.perf_counter()
+    injobdir = inroot / job
+    outjobdir = outroot / jobs.JOBS[job].outdir
+    index = scan.scan(
+        injobdir,
+        max_workers=max_workers,
+        stat=stat or incremental,
+        subs=None if shard is None else functools.partial(shard.has, job),
+    )
+
+    # get list of subjects that are present in the input
+    # directory but which won't be included in release
+    subs_to_exclude = exclude.subjects_to_exclude(
+        index, job=jobs.JOBS[job], records=records
+    )
+    logging.info(f"Planning {injobdir}, excluding {subs_to_exclude}")
+    kept = scan.prune(index, injobdir, exclude.ignore_entities(subs_to_exclude))
+    dropped = index.join(kept.select("path"), on="path", how="anti")
+    # only record the top of each excluded subtree
+    excluded = (
+        dropped.with_columns(parent=pl.col("path").str.replace(r"/?[^/]*$", ""))
+        .join(dropped.select(parent="path"), on="parent", how="anti")
+        .drop("parent")
+    )
+    mirror = (
+        pl.when(pl.col("kind") == "dir").then(pl.lit("mkdir")).otherwise(pl.lit("link"))
+    )
+
+    if (
+        incremental
+        and outjobdir.exists()
+        and (old := manifest.read_entries(outroot, job)) is not None
+    ):
+        added, removed, changed = manifest.diff(old, kept)
+        todo = pl.concat([added, changed]).select("path", todo=pl.lit(True))
+        ops = [
+            _with_op(
+                kept.join(todo, on="path", how="left"),
+                pl.when(pl.col("todo")).then(mirror).otherwise(pl.lit("keep")),
+                job,
+                inroot,
+                outroot,
+            ),
+            _with_op(
+                pl.concat([removed, changed.select(removed.columns)]),
+                "remove",
+                job,
+                inroot,
+                outroot,
+            ),
+        ]
+    else:
+        ops = [_with_op(kept, mirror, job, inroot, outroot)]
+    ops.append(_with_op(excluded, "exclude", job, inroot, outroot))
+    plan = pl.concat(ops, how="vertical_relaxed").cast(SCHEMA)  # type: ignore[arg-type]
+    if stat:
+        plan = plan.with_columns(_bytes(injobdir, plan, max_workers))
+    logging.info(f"Planned {job} in {time.perf_counter() - start:0.2f} seconds")
+    return plan.sort("path")
+
+
+def make_steps(
+    steps: typing.Iterable[tuple[str, typing.Iterable[str]]],
+    inroot: Path,
+    outroot: Path,
+) -> pl.DataFrame:
+    """Outputs of post-processing steps, as rewrite operations
+
+    Args:
+        steps (typing.Iterable[tuple[str, typing.Iterable[str]]]): Name of each step
+            and the paths (relative to outroot) that it writes.
+        inroot (Path): See copy_to_dst_wf.main.
+        outroot (Path): See copy_to_dst_wf.main.
+
+    Returns:
+        pl.DataFrame: One row per output (see SCHEMA).
+    """
+    rows = [
+        {"step": step, "path": path, "op": "rewrite"}
+        for step, outputs in steps
+        for path in outputs
+    ]
+    return pl.DataFrame(rows, schema=SCHEMA).with_columns(
+        inroot=pl.lit(os.fspath(inroot)), outroot=pl.lit(os.fspath(outroot))
+    )
+
+
+def mirrored(plan: pl.DataFrame) -> pl.DataFrame:
+    """Index (see scan.SCHEMA) of what a job will look like once its plan is done"""
+    return plan.filter(pl.col("op").is_in(["keep", "mkdir", "link"])).select(
+        scan.SCHEMA.names()
+    )
+
+
+def summarize(plan: pl.DataFrame) -> pl.DataFrame:
+    """Number of operations and bytes of each type, per job or step"""
+    return (
+        plan.with_columns(job=pl.coalesce("job", "step"))
+        .group_by("job", "op")
+        .agg(n=pl.len(), bytes=pl.col("bytes").sum())
+        .sort("job", "op")
+    )
+
+
+def write(plan: pl.DataFrame, dst: Path) -> None:
+    plan.write_parquet(dst)
+
+
+def read(src: Path) -> pl.DataFrame:
+    return pl.read_parquet(src).cast(SCHEMA)  # type: ignore[arg-type]
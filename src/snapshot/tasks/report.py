@@ -0,0 +1,194 @@
+import collections
+import contextlib
+import json
+import logging
+import resource
+import sys
+import threading
+import time
+import typing
+from datetime import UTC, datetime
+from pathlib import Path
+
+import polars as pl
+
+# counted by the tasks themselves (see count), as opposed to those read from
+# /proc/self/io: entries visited by scan.scan, directories it listed, lstat calls,
+# and directories and files (by materialize.MODE) created by copytree
+COUNTS = (
+    "entries",
+    "readdir",
+    "stat",
+    "mkdir",
+    "symlink",
+    "hardlink",
+    "reflink",
+    "copy",
+)
+
+SCHEMA = pl.Schema(
+    {
+        "name": pl.String,
+        "kind": pl.Enum(["job", "step"]),
+        "start": pl.Datetime("us", "UTC"),
+        "seconds": pl.Float64,
+        **dict.fromkeys(COUNTS, pl.Int64),
+        "read_bytes": pl.Int64,
+        "write_bytes": pl.Int64,
+        "read_syscalls": pl.Int64,
+        "write_syscalls": pl.Int64,
+        "max_rss": pl.Int64,
+        "error": pl.String,
+    }
+)
+
+_counts: collections.Counter[str] = collections.Counter()
+_lock = threading.Lock()
+
+
+def get_report_file(outroot: Path) -> Path:
+    return outroot.with_name(f"{outroot.name}.report.parquet")
+
+
+def count(**n: int) -> None:
+    """Add to the counts of this process (see COUNTS)"""
+    with _lock:
+        _counts.update(n)
+
+
+def _io() -> dict[str, int]:
+    # not available outside of Linux
+    try:
+        fields = dict(
+            line.split(": ") for line in Path("/proc/self/io").read_text().splitlines()
+        )
+    except OSError:
+        return {}
+    return {
+        "read_bytes": int(fields["rchar"]),
+        "write_bytes": int(fields["wchar"]),
+        "read_syscalls": int(fields["syscr"]),
+        "write_syscalls": int(fields["syscw"]),
+    }
+
+
+@contextlib.contextmanager
+def measure(name: str, kind: str) -> typing.Iterator[dict[str, typing.Any]]:
+    """Time a job or post-processing step, along with the I/O it does
+
+    Args:
+        name (str): Job or step.
+        kind (str): "job" or "step".
+
+    Yields:
+        dict[str, typing.Any]: Row of the report (see SCHEMA), filled in on exit.
+
+    Details:
+        Counts are those of the whole process, so jobs and steps that run at the
+        same time in one process (in threads) share them. With several jobs, each
+        runs in a process of its own, one job at a time. With only one (see
+        copy_to_dst_wf.get_n_jobs), it runs in a thread of the main process, so its
+        counts include those of the steps that run alongside it. max_rss is the
+        peak resident memory of the process so far.
+    """
+    row: dict[str, typing.Any] = {
+        "name": name,
+        "kind": kind,
+        "start": datetime.now(UTC),
+    }
+    with _lock:
+        counts = _counts.copy()
+    io = _io()
+    start = time.perf_counter()
+    try:
+        yield row
+    except Exception as e:
+        row["error"] = repr(e)
+        raise
+    finally:
+        row["seconds"] = time.perf_counter() - start
+        with _lock:
+            row.update({k: _counts[k] - counts[k] for k in COUNTS})
+        row.update({k: v - io[k] for k, v in _io().items() if k in io})
+        # KiB on Linux
+        row["max_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measured(
+    name: str, kind: str, f: typing.Callable[..., typing.Any], *args, **kwargs
+) -> tuple[typing.Any, dict[str, typing.Any]]:
+    """Call f, returning its result along with its row of the report
+
+    Picklable, so that jobs can be measured in the process that runs them.
+    """
+    with measure(name, kind) as row:
+        return f(*args, **kwargs), row
+
+
+def to_frame(rows: typing.Iterable[typing.Mapping[str, typing.Any]]) -> pl.DataFrame:
+    return pl.DataFrame(list(rows), schema=SCHEMA)
+
+
+def write(rows: typing.Iterable[typing.Mapping[str, typing.Any]], dst: Path) -> None:
+    """Write the report as parquet, or as JSON (one object per row) for .json files"""
+    report = to_frame(rows).sort("start")
+    if dst.suffix == ".json":
+        dst.write_text(json.dumps(report.to_dicts(), default=str, indent=2))
+    else:
+        report.write_parquet(dst)
+
+
+def summarize(rows: typing.Iterable[typing.Mapping[str, typing.Any]]) -> pl.DataFrame:
+    """Slowest jobs and steps first"""
+    return (
+        to_frame(rows)
+        .select(
+            "name",
+            "kind",
+            "seconds",
+            *COUNTS,
+            write_mib=pl.col("write_bytes") / 1024**2,
+            max_rss_mib=pl.col("max_rss") / 1024**2,
+            failed=pl.col("error").is_not_null(),
+        )
+        .sort("seconds", descending=True)
+    )
+
+
+class Progress:
+    """Single status line, rewritten as jobs and steps finish"""
+
+    def __init__(
+        self, n_jobs: int, n_steps: int, stream: typing.TextIO | None = None
+    ) -> None:
+        self.total = {"job": n_jobs, "step": n_steps}
+        self.done = {"job": 0, "step": 0}
+        self.stream = stream or sys.stderr
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def update(self, row: typing.Mapping[str, typing.Any]) -> None:
+        with self._lock:
+            self.done[row["kind"]] += 1
+            status = "failed" if row.get("error") else "finished"
+            line = (
+                f"[{time.perf_counter() - self.start:0.0f}s] "
+                f"jobs {self.done['job']}/{self.total['job']}, "
+                f"steps {self.done['step']}/{self.total['step']}: "
+                f"{status} {row['name']} in {row.get('seconds') or 0:0.1f}s"
+            )
+            if self.stream.isatty():
+                self.stream.write(f"\r\x1b[K{line}")
+            else:
+                self.stream.write(f"{line}\n")
+            self.stream.flush()
+
+    def close(self) -> None:
+        if self.stream.isatty():
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+def log(rows: typing.Iterable[typing.Mapping[str, typing.Any]]) -> None:
+    with pl.Config(tbl_rows=-1, tbl_cols=-1):
+        logging.info(f"Run report\n{summarize(rows)}")
@@ -0,0 +1,278 @@
+import os
+import re
+import typing
+from concurrent import futures
+from pathlib import Path
+
+import polars as pl
+
+from snapshot.tasks import entities, report
+
+KIND = pl.Enum(["dir", "file", "symlink"])
+
+SCHEMA = pl.Schema(
+    {
+        "path": pl.String,
+        "name": pl.String,
+        "kind": KIND,
+        "target": pl.String,
+        "sub": pl.Int64,
+        "ses": pl.String,
+        "task": pl.String,
+        "run": pl.String,
+        "size": pl.Int64,
+        "mtime_ns": pl.Int64,
+    }
+)
+
+Row = tuple[
+    str,
+    str,
+    str,
+    str | None,
+    str | None,
+    str | None,
+    str | None,
+    str | None,
+    int | None,
+    int | None,
+]
+
+
+# (st_dev, st_ino) of a directory
+Key = tuple[int, int]
+
+
+def _key(st: os.stat_result) -> Key:
+    return st.st_dev, st.st_ino
+
+
+def _row(
+    entry: os.DirEntry[str],
+    path: str,
+    parent: entities.Entities,
+    *,
+    stat: bool,
+    above: typing.Container[Key],
+) -> tuple[Row, entities.Entities]:
+    ents = entities.parse(entry.name, inherit=parent)
+    if entry.is_symlink():
+        target = os.readlink(entry.path)
+        # symlinks to directories are walked like directories (keeping the
+        # target), so that their contents can be pruned, unless they lead back
+        # to a directory that the walk is already in, which would loop
+        if entry.is_dir() and _key(entry.stat()) not in above:
+            kind = "dir"
+        else:
+            kind = "symlink"
+    elif entry.is_dir(follow_symlinks=False):
+        kind = "dir"
+        target = None
+    else:
+        kind = "file"
+        target = None
+    if stat:
+        st = entry.stat(follow_symlinks=False)
+        size, mtime_ns = st.st_size, st.st_mtime_ns
+    else:
+        size, mtime_ns = None, None
+    row = (
+        path,
+        entry.name,
+        kind,
+        target,
+        ents.get("sub"),
+        ents.get("ses"),
+        ents.get("task"),
+        ents.get("run"),
+        size,
+        mtime_ns,
+    )
+    return row, ents
+
+
+def _walks(row: Row, subs: typing.Callable[[int], bool] | None) -> bool:
+    if row[2] != "dir":
+        return False
+    # entries with a sub that is not a number belong to no subject (see SCHEMA)
+    if subs is None or row[4] is None or not row[4].isdigit():
+        return True
+    return subs(int(row[4]))
+
+
+def _walk(
+    root: str,
+    rel: str,
+    parent: entities.Entities,
+    above: frozenset[Key],
+    *,
+    stat: bool,
+    subs: typing.Callable[[int], bool] | None,
+) -> list[Row]:
+    rows: list[Row] = []
+    # each directory comes with the keys of the directories it is in (itself
+    # included), whatever the symlinks that led to them
+    stack = [(rel, parent, above)]
+    n_dirs = 0
+    n_stat = 0
+    while stack:
+        d, ents, keys = stack.pop()
+        n_dirs += 1
+        with os.scandir(os.path.join(root, d)) as it:
+            for entry in it:
+                row, child = _row(
+                    entry, f"{d}/{entry.name}", ents, stat=stat, above=keys
+                )
+                rows.append(row)
+                if _walks(row, subs):
+                    # free for symlinks (see _row), and when stat reused lstat
+                    n_stat += not (stat or entry.is_symlink())
+                    stack.append((row[0], child, keys | {_key(entry.stat())}))
+    if stat:
+        n_stat += len(rows)
+    report.count(entries=len(rows), readdir=n_dirs, stat=n_stat)
+    return rows
+
+
+def _to_frame(rows: list[Row]) -> pl.DataFrame:
+    return (
+        pl.DataFrame(
+            rows,
+            schema={k: pl.String if k == "sub" else v for k, v in SCHEMA.items()},
+            orient="row",
+        )
+        .with_columns(pl.col("sub").cast(pl.Int64, strict=False))
+        .sort("path")
+    )
+
+
+def scan(
+    root: Path,
+    max_workers: int | None = None,
+    *,
+    stat: bool = False,
+    subs: typing.Callable[[int], bool] | None = None,
+) -> pl.DataFrame:
+    """Walk a directory tree once, recording each entry in a table
+
+    Args:
+        root (Path): Directory to index.
+        max_workers (int | None, optional): See ThreadPoolExecutor. Each top-level
+            subdirectory is walked by a separate worker. Defaults to None.
+        stat (bool, optional): Also record size and mtime_ns (one lstat per entry).
+            Defaults to False.
+        subs (typing.Callable[[int], bool] | None, optional): Which subjects to
+            walk. The directories of other subjects are recorded, but not their
+            contents. Defaults to None, which means all of them.
+
+    Returns:
+        pl.DataFrame: One row per entry (see SCHEMA), with paths relative to root
+            and sorted so that directories precede their contents. Entities are
+            inherited from parent directories. Symlinks to files are recorded but
+            not followed. Symlinks to directories are followed, and recorded as
+            directories (with their target), unless they lead back to a
+            directory that they are in (by device and inode, so that cycles
+            through other symlinks are caught too), in which case they are
+            recorded as symlinks.
+    """
+    rows: list[Row] = []
+    todo: list[tuple[str, entities.Entities, frozenset[Key]]] = []
+    above = frozenset({_key(root.stat())})
+    n_stat = 1
+    with os.scandir(root) as it:
+        for entry in it:
+            row, ents = _row(
+                entry, entry.name, entities.Entities(), stat=stat, above=above
+            )
+            rows.append(row)
+            if _walks(row, subs):
+                n_stat += not (stat or entry.is_symlink())
+                todo.append((row[0], ents, above | {_key(entry.stat())}))
+    if stat:
+        n_stat += len(rows)
+    report.count(entries=len(rows), readdir=1, stat=n_stat)
+
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunk in executor.map(
+            lambda x: _walk(os.fspath(root), *x, stat=stat, subs=subs), todo
+        ):
+            rows.extend(chunk)
+
+    return _to_frame(rows)
+
+
+def _translate(pattern: str) -> str:
+    """Convert a glob pattern into an anchored regex for relative paths"""
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:[^/]+/)*")
+            i += 3
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[" and (j := pattern.find("]", i + 1)) > i + 1:
+            inner = pattern[i + 1 : j]
+            if inner.startswith("!"):
+                inner = "^" + inner[1:]
+            out.append(f"[{inner}]")
+            i = j
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "^" + "".join(out) + "$"
+
+
+def match(index: pl.DataFrame, *patterns: str) -> pl.DataFrame:
+    """Select the entries of an index whose relative path matches any glob pattern"""
+    regex = "|".join(f"(?:{_translate(pattern)})" for pattern in patterns)
+    return index.filter(pl.col("path").str.contains(regex))
+
+
+def glob(root: Path, pattern: str, index: pl.DataFrame | None = None) -> list[Path]:
+    """Path.glob, answered from an index of root when one is available"""
+    if index is None:
+        return list(root.glob(pattern))
+    return [root / p for p in match(index, pattern).get_column("path")]
+
+
+def rglob(root: Path, pattern: str, index: pl.DataFrame | None = None) -> list[Path]:
+    """Path.rglob, answered from an index of root when one is available"""
+    return glob(root, f"**/{pattern}", index=index)
+
+
+def prune(
+    index: pl.DataFrame,
+    root: Path,
+    ignore: typing.Callable[[str, list[str]], typing.Iterable[str]],
+) -> pl.DataFrame:
+    """Drop the entries that copytree would ignore, along with their contents
+
+    Args:
+        index (pl.DataFrame): Index of root, as produced by scan.
+        root (Path): Root of the index.
+        ignore (typing.Callable): See shutil.copytree. Called once per directory.
+
+    Returns:
+        pl.DataFrame: The retained entries.
+    """
+    dropped: set[str] = set()
+    by_parent = (
+        index.with_columns(
+            parent=pl.col("path").str.replace(r"/?[^/]*$", ""),
+        )
+        .group_by("parent", maintain_order=True)
+        .agg("path", "name")
+        .sort("parent")
+    )
+    for parent, paths, names in by_parent.iter_rows():
+        if parent in dropped:
+            dropped.update(paths)
+            continue
+        ignored = set(ignore(os.fspath(root / parent), names))
+        dropped.update(p for p, n in zip(paths, names, strict=True) if n in ignored)
+    return index.filter(pl.col("path").is_in(dropped).not_())
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import hashlib
+import typing
+from pathlib import Path
+
+if typing.TYPE_CHECKING:
+    import polars as pl
+
+
+def of(job: str, sub: int, count: int) -> int:
+    """Shard of the entries of a subject in a job
+
+    Stable across processes, hosts and versions of Python and polars (unlike hash
+    or pl.Expr.hash), so that independent runs agree on it.
+    """
+    digest = hashlib.blake2b(f"{job}/{sub}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest) % count
+
+
+class Shard(typing.NamedTuple):
+    """One of count parts of a run, which can mirror jobs without coordinating
+
+    Attributes:
+        index: Which part, from 0.
+        count: Number of parts.
+    """
+
+    index: int
+    count: int
+
+    @property
+    def name(self) -> str:
+        return f"shard-{self.index}-of-{self.count}"
+
+    def has(self, job: str, sub: int) -> bool:
+        """Whether the entries of a subject in a job belong to this shard"""
+        return of(job, sub, self.count) == self.index
+
+    def rename(self, path: Path) -> Path:
+        """Variant of a file (e.g., a report) that belongs to this shard"""
+        return path.with_name(f"{path.stem}.{self.name}{path.suffix}")
+
+    def select(self, ops: pl.DataFrame) -> pl.DataFrame:
+        """Operations of a job (see plan.SCHEMA) that belong to this shard
+
+        Entries of a subject belong to the shard of the subject (see of).
+        Directories that belong to no subject (such as the root of the job) are
+        created by every shard, and their other entries belong to shard 0.
+        """
+        import polars as pl
+
+        job = ops.get_column("job").first()
+        subs = ops.get_column("sub").drop_nulls().unique().to_list()
+        mine = [sub for sub in subs if self.has(str(job), sub)]
+        return ops.filter(
+            pl.when(pl.col("sub").is_not_null())
+            .then(pl.col("sub").is_in(mine))
+            .when((pl.col("kind") == "dir") & pl.col("op").is_in(["keep", "mkdir"]))
+            .then(pl.lit(True))
+            .otherwise(pl.lit(self.index == 0))
+        )
+
+
+def parse(spec: str) -> Shard:
+    """Shard from a string like "3/8" (the fourth of eight)"""
+    index, _, count = spec.partition("/")
+    try:
+        shard = Shard(int(index), int(count))
+    except ValueError as e:
+        msg = f"Expected a shard like 3/8, got {spec!r}"
+        raise ValueError(msg) from e
+    if not 0 <= shard.index < shard.count:
+        msg = f"Shard {shard.index} is not one of {shard.count} shards"
+        raise ValueError(msg)
+    return shard
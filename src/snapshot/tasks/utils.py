@@ -1,28 +1,164 @@
+import functools
 import json
 import logging
+import os
 import re
 import shutil
+import time
 import typing
+from concurrent import futures
 from pathlib import Path
 
-import nibabel as nb
 import polars as pl
 
 from snapshot import datasets
+from snapshot.tasks import nifti, scan, wide
 
 # values to parse from src files as null (n/a will be used for output)
-NULLS = ["", "na", "n/a", "NA"]
+NULLS = datasets.NULLS
 
 # https://bids-specification.readthedocs.io/en/v1.9.0/common-principles.html#units
 DATETIME_FORMAT = "%Y-%m-%d%H:%M:%S"
 
 SIDECAR_FIELDS_TO_REMOVE = ["InstitutionAddress"]
 
+# binary copies that can be written next to a tsv (see to_bids_tsv)
+TABLE_FORMATS = ("parquet", "arrow")
 
-def to_bids_tsv(d: pl.DataFrame, dst: Path) -> None:
+
+@functools.cache
+def _read_data_dictionary(sidecar: Path) -> dict[str, typing.Any]:
+    return json.loads(sidecar.read_text())
+
+
+def typed_schema(
+    d: pl.DataFrame | pl.LazyFrame, sidecar: Path
+) -> dict[str, pl.DataType]:
+    """Types for the columns of a table, derived from its data dictionary
+
+    Args:
+        d (pl.DataFrame | pl.LazyFrame): Table.
+        sidecar (Path): BIDS data dictionary (json) describing the columns of d.
+
+    Returns:
+        dict[str, pl.DataType]: New types for the string columns that the dictionary
+            gives Levels for. Those become enums when all values are levels, and
+            categoricals otherwise (always for lazy tables), so that they are stored
+            dictionary encoded. Other columns keep their types.
+    """
+    dictionary = _read_data_dictionary(sidecar)
+    schema: dict[str, pl.DataType] = {}
+    for column, dtype in d.collect_schema().items():
+        levels = dictionary.get(column, {}).get("Levels")
+        if not levels or dtype != pl.String:
+            continue
+        if (
+            isinstance(d, pl.DataFrame)
+            and d.get_column(column).drop_nulls().is_in(list(levels)).all()
+        ):
+            schema[column] = pl.Enum(list(levels))
+        else:
+            schema[column] = pl.Categorical()
+    return schema
+
+
+def write_companions(
+    d: pl.DataFrame | pl.LazyFrame,
+    dst: Path,
+    formats: typing.Collection[str],
+    sidecar: Path | None = None,
+) -> None:
+    """Write binary copies of a table next to its tsv
+
+    Args:
+        d (pl.DataFrame | pl.LazyFrame): Table. Lazy tables are streamed.
+        dst (Path): Destination of the tsv. Companions replace its suffix.
+        formats (typing.Collection[str]): Any of TABLE_FORMATS.
+        sidecar (Path | None, optional): Data dictionary used to type the columns
+            (see typed_schema). Defaults to None, in which case the table is written
+            with the types that polars inferred.
+
+    Raises:
+        ValueError: Unknown format.
+    """
+    if unknown := set(formats) - set(TABLE_FORMATS):
+        msg = f"Unknown table formats {unknown}, expected some of {TABLE_FORMATS}"
+        raise ValueError(msg)
+    if sidecar is not None and sidecar.exists():
+        d = d.cast(typed_schema(d, sidecar))  # type: ignore[arg-type]
+    if isinstance(d, pl.LazyFrame):
+        if "parquet" in formats:
+            d.sink_parquet(dst.with_suffix(".parquet"), compression="zstd")
+        if "arrow" in formats:
+            d.sink_ipc(dst.with_suffix(".arrow"), compression="zstd")
+        return
+    if "parquet" in formats:
+        d.write_parquet(dst.with_suffix(".parquet"), compression="zstd")
+    if "arrow" in formats:
+        d.write_ipc(dst.with_suffix(".arrow"), compression="zstd")
+
+
+def to_bids_tsv(
+    d: pl.DataFrame,
+    dst: Path,
+    formats: typing.Collection[str] = (),
+    sidecar: Path | None = None,
+) -> None:
+    """Write a table as BIDS tsv, optionally with binary companions
+
+    Args:
+        d (pl.DataFrame): Table.
+        dst (Path): Destination. Replaced (rather than written through) if it is a
+            link.
+        formats (typing.Collection[str], optional): Binary copies to write alongside
+            (see write_companions). Defaults to ().
+        sidecar (Path | None, optional): Data dictionary of the table. Defaults to
+            None, which means the json next to dst.
+    """
     if dst.exists():
         dst.unlink()
     d.write_csv(dst, separator="\t", null_value="n/a", datetime_format=DATETIME_FORMAT)
+    if formats:
+        write_companions(d, dst, formats, sidecar or dst.with_suffix(".json"))
+
+
+def to_bids_tsvs(
+    tables: typing.Iterable[tuple[pl.DataFrame, Path]], max_workers: int | None = None
+) -> int:
+    """Write many (small) tables concurrently, each with to_bids_tsv
+
+    Args:
+        tables (typing.Iterable[tuple[pl.DataFrame, Path]]): Pairs of table and
+            destination.
+        max_workers (int | None, optional): See ThreadPoolExecutor. Defaults to None.
+
+    Returns:
+        int: Number of tables written.
+    """
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        done = list(executor.map(lambda x: to_bids_tsv(*x), tables))
+    return len(done)
+
+
+def partition_tables(
+    d: pl.DataFrame, by: str, dsts: typing.Mapping[typing.Any, Path]
+) -> typing.Iterator[tuple[pl.DataFrame, Path]]:
+    """Split a table into one table per value of a column, in a single pass
+
+    Args:
+        d (pl.DataFrame): Table to split.
+        by (str): Column to split on (dropped from the parts).
+        dsts (typing.Mapping[typing.Any, Path]): Destination for each value of by.
+            Values without a destination are skipped, and destinations whose value
+            is absent from d get an empty table (header only).
+
+    Returns:
+        typing.Iterator[tuple[pl.DataFrame, Path]]: Pairs for to_bids_tsvs.
+    """
+    parts = d.partition_by(by, as_dict=True, include_key=False)
+    empty = d.clear().drop(by)
+    for key, dst in dsts.items():
+        yield parts.get((key,), empty), dst
 
 
 def _get_entity(f: Path, pattern: str) -> str:
@@ -40,31 +176,42 @@ def _get_ses(f: Path) -> str:
     return _get_entity(f=f, pattern=r"(?<=ses-)V[13]")
 
 
-def write_participants(records: typing.Collection[int], outdir: Path) -> None:
-    found_participants = [int(_get_sub(d)) for d in outdir.glob("sub*") if d.is_dir()]
+def write_participants(
+    records: typing.Collection[int],
+    outdir: Path,
+    formats: typing.Collection[str] = (),
+) -> None:
+    found_participants = datasets.RecordSet(
+        int(_get_sub(d)) for d in outdir.glob("sub*") if d.is_dir()
+    )
     demographics = (
         pl.scan_csv(datasets.get_demographics(), null_values=NULLS)
         .select("record_id", "guid")
         .rename({"record_id": "sub"})
     )
     tbl = (
-        pl.scan_csv(datasets.get_ilog(), null_values=NULLS)
+        datasets.scan_table("ilog")
         .select(sub="subject_id", ses="visit")
         .filter(pl.col("ses").str.contains("V1"))
-        .filter(pl.col("sub").is_in(records))
-        .filter(pl.col("sub").is_in(found_participants))
+        .pipe(datasets.as_records(records).semi_join)
+        .pipe(found_participants.semi_join)
         .join(demographics, on="sub", how="left")
         .with_columns(participant_id=pl.concat_str(pl.lit("sub-"), pl.col("sub")))
         .drop("sub")
         .select("participant_id", "guid")
         .collect()
     )
-    to_bids_tsv(tbl, dst=outdir / "participants.tsv")
+    to_bids_tsv(
+        tbl,
+        dst=outdir / "participants.tsv",
+        formats=formats,
+        sidecar=datasets.get_participants_json(),
+    )
 
     shutil.copy2(datasets.get_participants_json(), outdir)
 
 
-def write_sessions(outdir: Path) -> None:
+def write_sessions(outdir: Path, max_workers: int | None = None) -> None:
     mappings = {
         "visit": "session_id",
         "subject_id": "sub",
@@ -95,12 +242,12 @@ def write_sessions(outdir: Path) -> None:
         "Cuff Leg": "cuff_leg",
     }
     ilog = (
-        pl.read_csv(datasets.get_ilog(), null_values=NULLS)
+        datasets.scan_table("ilog")
         .filter(pl.col("visit").str.contains("V1"))
         .rename(mappings)
         .select(mappings.values())
         .join(
-            datasets.get_device_serial_number_tbl(),
+            datasets.scan_table("device_serial_numbers"),
             how="left",
             on=["sub", "session_id"],
         )
@@ -114,26 +261,40 @@ def write_sessions(outdir: Path) -> None:
             .then(pl.lit("baseline_visit"))
             .otherwise(pl.lit("3mo_postop")),
         )
+        .collect()
     )
 
     # look at parents of ses* dir rather than simply sub* because there may
     # be files that match sub* at the top level
+    dsts = {}
     for sesdir in outdir.glob("sub*/ses*"):
         sub = int(_get_sub(sesdir))
-        session = ilog.filter(pl.col("sub") == sub).drop("sub")
-        to_bids_tsv(session, dst=sesdir.parent / f"sub-{sub}_sessions.tsv")
+        dsts[sub] = sesdir.parent / f"sub-{sub}_sessions.tsv"
+    to_bids_tsvs(partition_tables(ilog, "sub", dsts), max_workers=max_workers)
 
     shutil.copy2(datasets.get_sessions_json(), outdir / "sessions.json")
 
 
-def update_scans(outdir: Path) -> None:
-    qclog = pl.read_csv(datasets.get_qclog(), null_values=NULLS).select(
-        "sub", "ses", "scan", "rating"
-    )
-    for scanstsv in outdir.rglob("*sub*scans.tsv"):
+def update_scans(
+    outdir: Path, index: pl.DataFrame | None = None, max_workers: int | None = None
+) -> None:
+    qclog = datasets.scan_table("qclog").select("sub", "ses", "scan", "rating")
+    scanstsvs = scan.rglob(outdir, "*sub*scans.tsv", index=index)
+    if scanstsvs:
+        # one lazy scan per file (their columns differ, so they cannot share a
+        # multi-file scan), combined into a single query
         scans = (
-            pl.read_csv(scanstsv, null_values=NULLS, separator="\t")
-            .select("filename")
+            pl.concat(
+                pl.scan_csv(
+                    scanstsv,
+                    null_values=NULLS,
+                    separator="\t",
+                    schema_overrides={"filename": pl.String},
+                    include_file_paths="scanstsv",
+                ).select("scanstsv", "filename")
+                for scanstsv in scanstsvs
+            )
+            .with_row_index()
             .with_columns(
                 sub=pl.col("filename").str.extract(r"\d{5}", 0).cast(pl.Int64),
                 ses=pl.col("filename").str.extract("V1|V3", 0),
@@ -153,37 +314,61 @@ def update_scans(outdir: Path) -> None:
                 ),
             )
             .join(qclog, ("sub", "ses", "scan"), how="left")
-            .select("filename", "rating")
+            .sort("index")
+            .select("scanstsv", "filename", "rating")
+            .collect()
         )
-        scanstsv.unlink()
-        to_bids_tsv(scans, scanstsv)
+        dsts = {os.fspath(scanstsv): scanstsv for scanstsv in scanstsvs}
+        to_bids_tsvs(partition_tables(scans, "scanstsv", dsts), max_workers=max_workers)
+    for scanstsv in scanstsvs:
         if (scansjson := scanstsv.with_suffix(".json")).exists():
             scansjson.unlink()
     shutil.copy2(datasets.get_scans_json(), outdir / "scans.json")
 
 
-def write_events(outdir: Path) -> None:
-    pressure = pl.read_csv(datasets.get_applied_pressures(), null_values=NULLS)
-    for nii in outdir.rglob("*bold.nii.gz"):
+def write_events(
+    outdir: Path, index: pl.DataFrame | None = None, max_workers: int | None = None
+) -> None:
+    runs = []
+    for nii in scan.rglob(outdir, "*bold.nii.gz", index=index):
         fname = nii.with_name(nii.name.replace("bold.nii.gz", "events.tsv"))
         if "cuff_run-01" in nii.name:
-            scan = "CUFF1"
+            cuff = "CUFF1"
         elif "cuff_run-02" in nii.name:
-            scan = "CUFF2"
+            cuff = "CUFF2"
         elif "rest" in nii.name:
             if fname.exists():
                 fname.unlink()
             continue
         else:
-            scan = ""
-        events = (
-            pressure.filter(pl.col("record_id") == int(_get_sub(nii)))
-            .filter(pl.col("visit") == _get_ses(nii))
-            .filter(pl.col("scan") == scan)
-            .with_columns(onset=0, duration=nb.nifti1.Nifti1Image.load(nii).shape[-1])
-            .select("onset", "duration", "applied_pressure")
+            cuff = ""
+        runs.append((nii, fname, int(_get_sub(nii)), _get_ses(nii), cuff))
+
+    shapes = nifti.read_shapes((run[0] for run in runs), max_workers=max_workers)
+    events = (
+        pl.DataFrame(
+            [
+                (os.fspath(fname), sub, ses, cuff, shapes[nii][-1])
+                for nii, fname, sub, ses, cuff in runs
+            ],
+            schema={
+                "events": pl.String,
+                "record_id": pl.Int64,
+                "visit": pl.String,
+                "scan": pl.String,
+                "duration": pl.Int64,
+            },
+            orient="row",
         )
-        to_bids_tsv(events, fname)
+        .join(
+            datasets.load_table("applied_pressures"),
+            on=["record_id", "visit", "scan"],
+            how="inner",
+        )
+        .select("events", pl.lit(0).alias("onset"), "duration", "applied_pressure")
+    )
+    dsts = {os.fspath(fname): fname for _, fname, *_ in runs}
+    to_bids_tsvs(partition_tables(events, "events", dsts), max_workers=max_workers)
     shutil.copy2(datasets.get_events_json(), outdir)
 
 
@@ -195,34 +380,122 @@ def write_changes(outdir: Path) -> None:
     shutil.copy2(datasets.get_changes(), outdir / "CHANGES")
 
 
+def sink_bids_tsv(
+    table: pl.LazyFrame,
+    dst: Path,
+    formats: typing.Collection[str] = (),
+    sidecar: Path | None = None,
+) -> None:
+    """Streaming counterpart of to_bids_tsv
+
+    Args:
+        table (pl.LazyFrame): Query producing the table. It is run in streaming
+            mode, so the table is never held in memory as a whole.
+        dst (Path): Destination. Written to a temporary file first, so dst may also
+            be one of the sources of table, and a link at dst is replaced rather than
+            written through.
+        formats (typing.Collection[str], optional): See to_bids_tsv. When given, the
+            first companion is written from table, and the tsv is derived from it,
+            so that the source is only parsed once. Defaults to ().
+        sidecar (Path | None, optional): See to_bids_tsv. Defaults to None.
+    """
+    tmp = dst.with_name(f".{dst.name}.tmp")
+    if formats:
+        write_companions(table, dst, formats, sidecar or dst.with_suffix(".json"))
+        table = (
+            pl.scan_parquet(dst.with_suffix(".parquet"))
+            if "parquet" in formats
+            else pl.scan_ipc(dst.with_suffix(".arrow"))
+        )
+    table.sink_csv(
+        tmp,
+        separator="\t",
+        null_value="n/a",
+        datetime_format=DATETIME_FORMAT,
+        mkdir=True,
+    )
+    os.replace(tmp, dst)
+
+
+def filter_table(
+    src: Path,
+    dst: Path,
+    records: typing.Collection[int],
+    sidecar: Path | None = None,
+    formats: typing.Collection[str] = (),
+) -> None:
+    """Keep the V1 rows of released subjects in a derivative table
+
+    Args:
+        src (Path): Source tsv. May be the same as dst.
+        dst (Path): Destination tsv (see sink_bids_tsv).
+        records (typing.Collection[int]): Subjects included in the release.
+        sidecar (Path | None, optional): Data dictionary of the table. Only the
+            columns that it describes are kept (others are dropped, with a
+            warning). Defaults to None, in which case all columns are kept.
+        formats (typing.Collection[str], optional): See to_bids_tsv. Defaults to ().
+
+    Details:
+        Tables are filtered on their ses and sub columns or, when they have none,
+        on the entities of their bids_name column. The filters are pushed down into
+        the scan.
+    """
+    records = datasets.as_records(records)
+    table = pl.scan_csv(src, separator="\t", null_values=NULLS)
+    columns = table.collect_schema().names()
+    if "ses" in columns:
+        table = table.filter(pl.col("ses").str.contains("V1")).pipe(records.semi_join)
+    else:
+        table = table.filter(pl.col("bids_name").str.contains("ses-V1")).pipe(
+            records.semi_join_entity
+        )
+    if sidecar is not None:
+        described = _read_data_dictionary(sidecar)
+        if dropped := [c for c in columns if c not in described]:
+            logging.warning(f"Dropping columns of {src} not in {sidecar}: {dropped}")
+        table = table.select(c for c in columns if c in described)
+    sink_bids_tsv(table, dst, formats=formats, sidecar=sidecar)
+
+
 def write_cat12_tables_and_jsons(
-    inroot: Path, outroot: Path, records: typing.Collection[int]
+    inroot: Path,
+    outroot: Path,
+    records: typing.Collection[int],
+    formats: typing.Collection[str] = (),
 ) -> None:
     dst = outroot / "derivatives" / "cat12"
-    df = (
-        pl.read_csv(
-            inroot / "cat12" / "cluster_volumes.tsv", separator="\t", null_values=NULLS
-        )
-        .filter(pl.col("ses").str.contains("V1"))
-        .filter(pl.col("sub").is_in(records))
+    filter_table(
+        inroot / "cat12" / "cluster_volumes.tsv",
+        dst / "cluster_volumes.tsv",
+        records=records,
+        sidecar=datasets.get_cat12_json(),
+        formats=formats,
     )
-    to_bids_tsv(df, dst / "cluster_volumes.tsv")
     shutil.copy2(datasets.get_cat12_json(), dst / "cluster_volumes.json")
 
 
 def write_freesurfer_tables_and_jsons(
-    outroot: Path, inroot: Path, records: typing.Collection[int]
+    outroot: Path,
+    inroot: Path,
+    records: typing.Collection[int],
+    formats: typing.Collection[str] = (),
 ) -> None:
     dst = outroot / "derivatives" / "freesurfer"
-    for tbl in ["aparc", "aseg", "headers", "gm_morph"]:
-        df = (
-            pl.read_csv(
-                inroot / "freesurfer" / f"{tbl}.tsv", null_values=NULLS, separator="\t"
+    records = datasets.as_records(records)
+    tbls = ["aparc", "aseg", "headers", "gm_morph"]
+    with futures.ThreadPoolExecutor() as executor:
+        for fut in [
+            executor.submit(
+                filter_table,
+                inroot / "freesurfer" / f"{tbl}.tsv",
+                dst / f"{tbl}.tsv",
+                records=records,
+                sidecar=datasets.get_data(f"{tbl}.json"),
+                formats=formats,
             )
-            .filter(pl.col("ses").str.contains("V1"))
-            .filter(pl.col("sub").is_in(records))
-        )
-        to_bids_tsv(df, dst / f"{tbl}.tsv")
+            for tbl in tbls
+        ]:
+            fut.result()
 
     shutil.copy2(datasets.get_aparc_json(), dst / "aparc.json")
     shutil.copy2(datasets.get_aseg_json(), dst / "aseg.json")
@@ -231,40 +504,35 @@ def write_freesurfer_tables_and_jsons(
 
 
 def write_fslanat_tables_and_jsons(
-    inroot: Path, outroot: Path, records: typing.Collection[int]
+    inroot: Path,
+    outroot: Path,
+    records: typing.Collection[int],
+    formats: typing.Collection[str] = (),
 ) -> None:
     dst = outroot / "derivatives" / "fslanat"
-    df = (
-        pl.read_csv(
-            inroot / "fslanat" / "fslanat.tsv", null_values=NULLS, separator="\t"
-        )
-        .filter(pl.col("ses").str.contains("V1"))
-        .filter(pl.col("sub").is_in(records))
+    filter_table(
+        inroot / "fslanat" / "fslanat.tsv",
+        dst / "fslanat.tsv",
+        records=records,
+        sidecar=datasets.get_fslanat_json(),
+        formats=formats,
     )
-    to_bids_tsv(df, dst / "fslanat.tsv")
 
     shutil.copy2(datasets.get_fslanat_json(), dst / "fslanat.json")
 
 
 def overwrite_tables(
-    outjob: Path, records: typing.Collection[int], srcs: typing.Collection[str]
+    outjob: Path,
+    records: typing.Collection[int],
+    srcs: typing.Collection[str],
+    formats: typing.Collection[str] = (),
 ) -> None:
+    records = datasets.as_records(records)
     for src in srcs:
-        file = outjob / src
-        d = pl.read_csv(file, null_values=NULLS, separator="\t")
-        if "ses" in d.columns:
-            df = d.filter(pl.col("ses").str.contains("V1")).filter(
-                pl.col("sub").is_in(records)
-            )
-        else:
-            df = d.filter(pl.col("bids_name").str.contains("ses-V1")).filter(
-                pl.col("bids_name").str.contains_any([str(s) for s in records])
-            )
-
-        to_bids_tsv(df, file)
+        filter_table(outjob / src, outjob / src, records=records, formats=formats)
 
 
-def write_fcn_jsons(outroot: Path) -> None:
+def write_fcn_jsons(outroot: Path, index: pl.DataFrame | None = None) -> None:
     dst = outroot / "derivatives" / "fcn"
     shutil.copy2(datasets.get_confounds_json(), dst / "confounds.json")
     shutil.copy2(datasets.get_connectivity_json(), dst / "connectivity.json")
@@ -272,16 +540,11 @@ def write_fcn_jsons(outroot: Path) -> None:
     shutil.copy2(datasets.get_disruption_json(), dst / "disruption.json")
 
     # handle typo in ledoit_wolf estimator
-    for sub in (dst / "connectivity").glob("sub*"):
-        for ses in sub.glob("ses*"):
-            for task in ses.glob("task*"):
-                for run in task.glob("run*"):
-                    for atlas in run.glob("atlas*"):
-                        for estimator in atlas.glob("estimator*"):
-                            if "leodit_wolf" in estimator.name:
-                                estimator.rename(
-                                    estimator.with_name("estimator=ledoit_wolf")
-                                )
+    for estimator in scan.glob(
+        dst, "connectivity/sub*/ses*/task*/run*/atlas*/estimator*", index=index
+    ):
+        if "leodit_wolf" in estimator.name:
+            estimator.rename(estimator.with_name("estimator=ledoit_wolf"))
 
 
 def write_signatures_jsons(outroot: Path) -> None:
@@ -304,14 +567,63 @@ def write_signatures_jsons(outroot: Path) -> None:
     )
 
 
-def clean_sidecars(root: Path) -> None:
-    for sidecar in root.rglob("*json"):
-        data: dict[str, typing.Any] = json.loads(sidecar.read_text())
-        for field in SIDECAR_FIELDS_TO_REMOVE:
-            if data.get(field):
-                del data[field]
-        sidecar.unlink()
-        sidecar.write_text(json.dumps(data, indent=2, sort_keys=True))
+class CleanedSidecars(typing.NamedTuple):
+    checked: int
+    rewritten: int
+    seconds: float
+
+
+def _clean_sidecar(sidecar: Path) -> bool:
+    raw = sidecar.read_bytes()
+    # most sidecars have none of the fields, so skip parsing them
+    if not any(f'"{field}"'.encode() in raw for field in SIDECAR_FIELDS_TO_REMOVE):
+        return False
+    data: dict[str, typing.Any] = json.loads(raw)
+    fields = [field for field in SIDECAR_FIELDS_TO_REMOVE if data.get(field)]
+    if not fields:
+        return False
+    for field in fields:
+        del data[field]
+    # replaces (rather than writes through) the symlink to the source
+    tmp = sidecar.with_name(f".{sidecar.name}.tmp")
+    tmp.write_text(json.dumps(data, indent=2, sort_keys=True))
+    os.replace(tmp, sidecar)
+    return True
+
+
+def clean_sidecars(
+    root: Path, index: pl.DataFrame | None = None, max_workers: int | None = None
+) -> CleanedSidecars:
+    """Remove SIDECAR_FIELDS_TO_REMOVE from the json sidecars below root
+
+    Args:
+        root (Path): Directory to search.
+        index (pl.DataFrame | None, optional): Index of root (see scan.scan).
+            Defaults to None.
+        max_workers (int | None, optional): See ThreadPoolExecutor. Defaults to None.
+
+    Returns:
+        CleanedSidecars: Number of sidecars checked and rewritten, and time taken.
+
+    Details:
+        Only sidecars that contain one of the fields are rewritten, atomically
+        (temp file and rename). The others are left as they are (e.g., as links to
+        the source).
+    """
+    start = time.perf_counter()
+    sidecars = scan.rglob(root, "*json", index=index)
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        rewritten = sum(executor.map(_clean_sidecar, sidecars))
+    cleaned = CleanedSidecars(
+        checked=len(sidecars),
+        rewritten=rewritten,
+        seconds=time.perf_counter() - start,
+    )
+    logging.info(
+        f"Cleaned {cleaned.rewritten} of {cleaned.checked} sidecars in {root} "
+        f"({cleaned.checked / max(cleaned.seconds, 1e-9):0.0f} files/second)"
+    )
+    return cleaned
 
 
 def write_release_notes(outroot: Path) -> None:
@@ -333,23 +645,50 @@ def write_postgift_jsons(outroot: Path) -> None:
     shutil.copy2(datasets.get_gift_connectivity_json(), dst / "connectivity.json")
 
 
-def write_idps(inroot: Path, outroot: Path) -> None:
-    records = datasets.get_recordids()
+def write_idps(
+    inroot: Path,
+    outroot: Path,
+    records: typing.Collection[int],
+    formats: typing.Collection[str] = (),
+    *,
+    long: bool = False,
+) -> None:
+    """Release the V1 rows of the (wide) idp tables
+
+    Args:
+        inroot (Path): Root of the products, with an idp directory.
+        outroot (Path): Root of the release.
+        records (typing.Collection[int]): Subjects included in the release.
+        formats (typing.Collection[str], optional): See to_bids_tsv. Defaults to ().
+        long (bool, optional): Also write a long (tidy) parquet table
+            (<name>_long.parquet) with one row per subject, session and measure.
+            Defaults to False.
+
+    Details:
+        mri.tsv has tens of thousands of columns; see wide.read.
+    """
     dst = outroot / "idp"
-    mask_volumes_json: dict[str, typing.Any] = json.loads(
-        datasets.get_mask_volumes_json().read_text()
-    )
-    mris_json: dict[str, typing.Any] = json.loads(datasets.get_mri_json().read_text())
-
-    columns = {
-        "mask_volumes.tsv": list(mask_volumes_json.keys()),
-        "mri.tsv": list(mris_json.keys()),
+    sidecars = {
+        "mask_volumes.tsv": datasets.get_mask_volumes_json(),
+        "mri.tsv": datasets.get_mri_json(),
     }
 
+    records = datasets.as_records(records)
+    dst.mkdir(parents=True, exist_ok=True)
     for f in ["mri.tsv", "mask_volumes.tsv"]:
-        pl.scan_csv(inroot / "idp" / f, separator="\t").filter(
-            pl.col("ses") == "V1", pl.col("sub").is_in(records)
-        ).select(*columns[f]).sink_csv(dst / f, separator="\t", mkdir=True)
+        table = wide.read(
+            inroot / "idp" / f,
+            _read_data_dictionary(sidecars[f]),
+            rows=lambda index: index.filter(pl.col("ses") == "V1").pipe(
+                records.semi_join
+            ),
+            null_values=NULLS,
+        )
+        to_bids_tsv(table, dst / f, formats=formats, sidecar=sidecars[f])
+        if long:
+            wide.to_long(table).write_parquet(
+                dst / f"{Path(f).stem}_long.parquet", compression="zstd"
+            )
 
     shutil.copy2(datasets.get_mask_volumes_json(), dst / "mask_volumes.json")
     shutil.copy2(datasets.get_mri_json(), dst / "mri.json")
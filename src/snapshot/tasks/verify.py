@@ -0,0 +1,284 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import time
+import typing
+from concurrent import futures
+from pathlib import Path
+
+import polars as pl
+
+from snapshot.models import jobs
+from snapshot.tasks import exclude, scan
+
+PROBLEM = pl.Enum(["relative", "dangling", "outside", "excluded"])
+
+PROBLEMS_SCHEMA = pl.Schema(
+    {
+        "job": pl.String,
+        "path": pl.String,
+        "problem": PROBLEM,
+        # target of a link, or the excluded subject
+        "detail": pl.String,
+    }
+)
+
+MANIFEST_SCHEMA = pl.Schema(
+    {
+        "job": pl.String,
+        "path": pl.String,
+        "size": pl.Int64,
+        "mtime_ns": pl.Int64,
+        "blake2b": pl.String,
+    }
+)
+
+# files written by the post-processing steps, rather than mirrored
+CHECKSUM_SUFFIXES = (".tsv", ".json")
+
+CHUNK_SIZE = 1024 * 1024
+
+# paths checked or stat'ed per task
+BATCH_SIZE = 1024
+
+
+def get_verify_file(outroot: Path) -> Path:
+    return outroot.with_name(f"{outroot.name}.verify.parquet")
+
+
+def hash_file(src: str) -> str:
+    h = hashlib.blake2b()
+    with open(src, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _exists(paths: list[str]) -> list[bool]:
+    return [os.path.exists(path) for path in paths]
+
+
+def _stat(paths: list[str]) -> list[tuple[int, int]]:
+    return [(st.st_size, st.st_mtime_ns) for st in (os.stat(path) for path in paths)]
+
+
+def _below(paths: typing.Iterable[str], dirs: typing.Collection[str]) -> list[bool]:
+    """Whether each path is inside one of dirs"""
+    if not dirs:
+        return [False for _ in paths]
+    return [
+        any(path[:i] in dirs for i, c in enumerate(path) if c == "/") for path in paths
+    ]
+
+
+def _batched(
+    executor: futures.Executor, f: typing.Callable[[list[str]], list], paths: list[str]
+) -> list:
+    batches = [paths[i : i + BATCH_SIZE] for i in range(0, len(paths), BATCH_SIZE)]
+    return [x for batch in executor.map(f, batches) for x in batch]
+
+
+def check_links(
+    index: pl.DataFrame,
+    roots: typing.Iterable[Path],
+    executor: futures.Executor,
+) -> pl.DataFrame:
+    """Symlinks of an index that are relative, dangling, or point outside roots
+
+    Symlinks to directories, which scan follows and records as directories, are
+    checked along with the others.
+
+    Returns:
+        pl.DataFrame: path, problem and detail (the target) of each bad link.
+    """
+    prefixes = tuple(
+        {os.path.join(p, "") for root in roots for p in (root, root.resolve())}
+    )
+    links = index.filter(pl.col("target").is_not_null()).select("path", "target")
+    targets = links.get_column("target").to_list()
+    return (
+        links.with_columns(exists=pl.Series(_batched(executor, _exists, targets)))
+        .select(
+            "path",
+            problem=pl.when(~pl.col("target").str.starts_with("/"))
+            .then(pl.lit("relative"))
+            .when(~pl.col("exists"))
+            .then(pl.lit("dangling"))
+            .when(
+                ~pl.any_horizontal(
+                    pl.col("target").str.starts_with(prefix) for prefix in prefixes
+                )
+            )
+            .then(pl.lit("outside"))
+            .cast(PROBLEM),
+            detail="target",
+        )
+        .filter(pl.col("problem").is_not_null())
+    )
+
+
+def check_entities(
+    index: pl.DataFrame,
+    root: Path,
+    job: jobs.Job,
+    records: typing.Collection[int],
+) -> pl.DataFrame:
+    """Entries of a mirrored job that main would have excluded (see plan.make_job)
+
+    Returns:
+        pl.DataFrame: path, problem and detail (the subject, if any) of the top of
+            each excluded subtree.
+    """
+    subs = exclude.subjects_to_exclude(index, job=job, records=records)
+    kept = scan.prune(index, root, exclude.ignore_entities(subs))
+    dropped = index.join(kept.select("path"), on="path", how="anti")
+    return (
+        dropped.with_columns(parent=pl.col("path").str.replace(r"/?[^/]*$", ""))
+        .join(dropped.select(parent="path"), on="parent", how="anti")
+        .select(
+            "path",
+            problem=pl.lit("excluded", dtype=PROBLEM),
+            detail=pl.col("sub").cast(pl.String),
+        )
+    )
+
+
+def checksums(
+    root: Path,
+    files: pl.DataFrame,
+    old: pl.DataFrame | None,
+    max_workers: int | None = None,
+) -> pl.DataFrame:
+    """Hash files, reusing the digests of files whose size and mtime are unchanged
+
+    Args:
+        root (Path): Directory that the paths are relative to.
+        files (pl.DataFrame): job, path, size and mtime_ns of each file.
+        old (pl.DataFrame | None): Manifest of a previous verification (see
+            MANIFEST_SCHEMA).
+        max_workers (int | None, optional): Processes used for hashing. Defaults to
+            None (one per CPU).
+
+    Returns:
+        pl.DataFrame: files, with a blake2b column.
+    """
+    if old is not None:
+        files = files.join(
+            old.select("job", "path", "size", "mtime_ns", "blake2b"),
+            on=["job", "path", "size", "mtime_ns"],
+            how="left",
+        )
+    else:
+        files = files.with_columns(blake2b=pl.lit(None, dtype=pl.String))
+    todo = files.filter(pl.col("blake2b").is_null()).get_column("path").to_list()
+    logging.info(f"Hashing {len(todo)} of {files.height} files")
+    if not todo:
+        return files
+    # hashing is CPU bound
+    with futures.ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        srcs = [os.path.join(root, path) for path in todo]
+        digests = dict(
+            zip(todo, executor.map(hash_file, srcs, chunksize=16), strict=True)
+        )
+    return files.with_columns(
+        pl.col("blake2b").fill_null(
+            pl.col("path").replace_strict(digests, default=None)
+        )
+    )
+
+
+def verify(
+    inroot: Path,
+    outroot: Path,
+    records: typing.Collection[int],
+    jobs_to_check: typing.Iterable[jobs.STORE_DIR] = jobs.STORE_DIRS,
+    max_workers: int | None = None,
+    *,
+    hash_files: bool = False,
+    roots: typing.Iterable[Path] = (),
+    manifest_file: Path | None = None,
+) -> pl.DataFrame:
+    """Check a finished release
+
+    Args:
+        inroot (Path): See copy_to_dst_wf.main.
+        outroot (Path): See copy_to_dst_wf.main.
+        records (typing.Collection[int]): Subjects included in the release.
+        jobs_to_check (typing.Iterable[jobs.STORE_DIR], optional): Jobs whose output
+            directories are checked. Defaults to jobs.STORE_DIRS.
+        max_workers (int | None, optional): Threads used to walk and stat the
+            release, and processes used to hash files. Defaults to None.
+        hash_files (bool, optional): Also hash the regular files with
+            CHECKSUM_SUFFIXES (those written by post-processing steps), and write
+            them to manifest_file. Defaults to False.
+        roots (typing.Iterable[Path], optional): Directories besides inroot that
+            links may point into, e.g., where symlinks in the products lead.
+            Defaults to ().
+        manifest_file (Path | None, optional): Digests of the files. Files whose
+            size and mtime match those recorded by a previous verification are not
+            hashed again. Defaults to None, which means get_verify_file(outroot).
+
+    Returns:
+        pl.DataFrame: One row per problem (see PROBLEMS_SCHEMA): symlinks that are
+            relative, dangling or point outside inroot (and roots), and entries
+            that the entity rules of main would have excluded (V3 data, subjects not
+            in records and subjects with only V3 data).
+    """
+    start = time.perf_counter()
+    roots = [inroot, *roots]
+    problems = [pl.DataFrame(schema=PROBLEMS_SCHEMA)]
+    generated = [pl.DataFrame(schema={"job": pl.String, "path": pl.String})]
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for job in jobs_to_check:
+            layout = jobs.JOBS[job]
+            if not (outjobdir := outroot / layout.outdir).exists():
+                logging.warning(f"Skipping {job}, which is not in {outroot}")
+                continue
+            index = scan.scan(outjobdir, max_workers=max_workers)
+            for found in [
+                check_links(index, roots, executor),
+                check_entities(index, outjobdir, layout, records),
+            ]:
+                problems.append(found.select(pl.lit(job).alias("job"), *found.columns))
+            # files below symlinks to directories are those of the source
+            linked = index.filter(
+                pl.col("kind") == "dir", pl.col("target").is_not_null()
+            )
+            tables = index.filter(
+                pl.col("kind") == "file",
+                pl.any_horizontal(
+                    pl.col("name").str.ends_with(suffix) for suffix in CHECKSUM_SUFFIXES
+                ),
+            )
+            below = _below(tables.get_column("path"), set(linked.get_column("path")))
+            generated.append(
+                tables.filter(~pl.Series(below, dtype=pl.Boolean)).select(
+                    job=pl.lit(job), path=pl.lit(f"{layout.outdir}/") + pl.col("path")
+                )
+            )
+        files = pl.concat(generated)
+        if hash_files:
+            paths = [os.path.join(outroot, p) for p in files.get_column("path")]
+            stats = _batched(executor, _stat, paths)
+            files = files.with_columns(
+                size=pl.Series([size for size, _ in stats], dtype=pl.Int64),
+                mtime_ns=pl.Series([mtime_ns for _, mtime_ns in stats], dtype=pl.Int64),
+            )
+
+    if hash_files:
+        dst = manifest_file or get_verify_file(outroot)
+        old = pl.read_parquet(dst) if dst.exists() else None
+        checksums(outroot, files, old, max_workers=max_workers).select(
+            MANIFEST_SCHEMA.names()
+        ).cast(MANIFEST_SCHEMA).write_parquet(dst)  # type: ignore[arg-type]
+
+    result = pl.concat(problems).cast(PROBLEMS_SCHEMA)  # type: ignore[arg-type]
+    with pl.Config(tbl_rows=20):
+        logging.info(
+            f"Verified {outroot} in {time.perf_counter() - start:0.2f} seconds, "
+            f"found {result.height} problems\n{result.group_by('job', 'problem').len()}"
+        )
+    return result
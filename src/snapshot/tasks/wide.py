@@ -0,0 +1,103 @@
+import io
+import logging
+import typing
+from pathlib import Path
+
+import polars as pl
+
+# columns that identify a row of a wide table
+INDEX = ["sub", "ses"]
+
+
+def read_header(src: Path, separator: str = "\t") -> list[str]:
+    """Column names of a delimited file, without reading past its first line"""
+    with src.open() as f:
+        return f.readline().rstrip("\r\n").split(separator)
+
+
+def _read_index(src: Path, header: list[str], separator: str) -> pl.DataFrame:
+    positions = [header.index(c) for c in INDEX]
+    n = max(positions) + 1
+    index = []
+    short = 0
+    with src.open() as f:
+        f.readline()
+        for i, line in enumerate(f):
+            fields = line.rstrip("\r\n").split(separator, n)
+            # blank (e.g., trailing) lines are skipped, as pl.read_csv does
+            if len(fields) < n:
+                short += bool(line.strip())
+                continue
+            index.append([i, *(fields[j] for j in positions)])
+    if short:
+        logging.warning(f"Skipped {short} lines of {src} that lack {INDEX}")
+    return pl.DataFrame(
+        index,
+        schema={"index": pl.UInt32, **dict.fromkeys(INDEX, pl.String)},
+        orient="row",
+    ).with_columns(pl.col("sub").cast(pl.Int64, strict=False))
+
+
+def read(
+    src: Path,
+    columns: typing.Iterable[str],
+    rows: typing.Callable[[pl.DataFrame], pl.DataFrame],
+    separator: str = "\t",
+    null_values: list[str] | None = None,
+) -> pl.DataFrame:
+    """Read some of the rows and columns of a (very) wide table
+
+    Args:
+        src (Path): Table with a header row and INDEX columns.
+        columns (typing.Iterable[str]): Columns to read, e.g., the keys of the data
+            dictionary of the table. Columns absent from src are skipped, with a
+            warning.
+        rows (typing.Callable[[pl.DataFrame], pl.DataFrame]): Selects rows, given a
+            table of their INDEX columns (sub as Int64, ses as String) and their
+            position (index, the number of the line after the header). Lines too
+            short to have the INDEX columns are skipped.
+        separator (str, optional): Field separator. Defaults to "\\t".
+        null_values (list[str] | None, optional): See pl.read_csv. Defaults to None.
+
+    Returns:
+        pl.DataFrame: Selected rows, in the order of src, and columns, in the order
+            of columns (as when selecting them by name).
+
+    Details:
+        polars slows down markedly with tens of thousands of columns, both when
+        parsing and when filtering. So the INDEX columns are first read by splitting
+        just the start of each line, rows are selected from those, and only the
+        lines of selected rows are then parsed, with the wanted columns picked by
+        position.
+    """
+    header = read_header(src, separator=separator)
+    wanted = dict.fromkeys(columns)
+    if missing := wanted.keys() - set(header):
+        logging.warning(f"{len(missing)} columns are missing from {src}")
+    keep = set(rows(_read_index(src, header, separator)).get_column("index").to_list())
+    buffer = io.BytesIO()
+    with src.open("rb") as f:
+        buffer.write(f.readline())
+        for i, line in enumerate(f):
+            if i in keep:
+                buffer.write(line)
+    table = pl.read_csv(
+        buffer.getvalue(),
+        separator=separator,
+        columns=[i for i, c in enumerate(header) if c in wanted],
+        null_values=null_values,
+        schema_overrides={"sub": pl.Int64},
+    )
+    # only the selected rows are parsed, so reordering the columns is cheap
+    return table.select(c for c in wanted if c not in missing)
+
+
+def to_long(table: pl.DataFrame) -> pl.DataFrame:
+    """One row per subject, session and numeric column of a wide table"""
+    index = [c for c in INDEX if c in table.columns]
+    on = [
+        c for c, dtype in table.schema.items() if c not in index and dtype.is_numeric()
+    ]
+    return table.unpivot(on=on, index=index, variable_name="variable").with_columns(
+        pl.col("variable").cast(pl.Categorical())
+    )
@@ -0,0 +1,51 @@
+import itertools
+import typing
+from pathlib import Path
+
+import pytest
+
+from snapshot.flows import copy_to_dst_wf
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Keep the caches of datasets and nifti out of the user's cache directory"""
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setenv("SNAPSHOT_CACHE_DIR", str(cache_dir))
+    return cache_dir
+
+
+@pytest.fixture
+def products(tmp_path: Path) -> typing.Callable[..., Path]:
+    """Make inroot (tmp_path / "in"), with a brain.nii.gz in each session"""
+
+    def _make(
+        jobs: typing.Iterable[str] = ("synthstrip",),
+        subs: typing.Iterable[int] = (10003,),
+        sessions: typing.Iterable[str] = ("V1",),
+        data: bytes = b"0",
+    ) -> Path:
+        inroot = tmp_path / "in"
+        for job, sub, ses in itertools.product(jobs, subs, sessions):
+            dst = inroot / job / f"sub-{sub}" / f"ses-{ses}"
+            dst.mkdir(parents=True, exist_ok=True)
+            (dst / "brain.nii.gz").write_bytes(data)
+        return inroot
+
+    return _make
+
+
+@pytest.fixture
+def release(monkeypatch: pytest.MonkeyPatch) -> typing.Callable[..., None]:
+    """Set the subjects of the release, and (optionally) the steps that main runs"""
+
+    def _set(
+        records: typing.Iterable[int],
+        steps: typing.Iterable[copy_to_dst_wf.PostStep] | None = None,
+    ) -> None:
+        recordids = list(records)
+        monkeypatch.setattr(copy_to_dst_wf.datasets, "get_recordids", lambda: recordids)
+        if steps is not None:
+            monkeypatch.setattr(copy_to_dst_wf, "POST_STEPS", tuple(steps))
+
+    return _set
@@ -0,0 +1,124 @@
+from pathlib import Path
+
+import pytest
+
+from snapshot import cli
+from snapshot.flows import copy_to_dst_wf
+from snapshot.models import jobs
+from snapshot.tasks import materialize, shards
+
+
+@pytest.fixture
+def calls(monkeypatch: pytest.MonkeyPatch) -> list[dict]:
+    found: list[dict] = []
+
+    def main(inroot: Path, outroot: Path, **kwargs) -> None:
+        found.append({"inroot": inroot, "outroot": outroot, **kwargs})
+
+    monkeypatch.setattr(copy_to_dst_wf, "main", main)
+    for name in ["SLURM_ARRAY_TASK_ID", "SLURM_ARRAY_TASK_MIN"]:
+        monkeypatch.delenv(name, raising=False)
+    return found
+
+
+def test_split_jobs_covers_all_jobs():
+    tasks = [cli.split_jobs(jobs.STORE_DIRS, i, 4) for i in range(4)]
+    assert sorted(job for task in tasks for job in task) == sorted(jobs.STORE_DIRS)
+    assert {len(task) for task in tasks} == {4, 5}
+    with pytest.raises(ValueError, match="not one of"):
+        cli.split_jobs(jobs.STORE_DIRS, 4, 4)
+
+
+def test_steps_for_runs_each_step_once():
+    tasks = [cli.split_jobs(jobs.STORE_DIRS, i, 3) for i in range(3)]
+    steps = [
+        s for i, task in enumerate(tasks) for s in cli.steps_for(task, first=i == 0)
+    ]
+    assert sorted(steps) == sorted(step.name for step in copy_to_dst_wf.POST_STEPS)
+    assert "release_notes" in cli.steps_for(tasks[0], first=True)
+
+
+def test_run_passes_options(calls: list[dict]):
+    assert (
+        cli.main(
+            [
+                "run",
+                "in",
+                "out",
+                "--jobs",
+                "bids",
+                "mriqc",
+                "fmriprep",
+                "--skip-jobs",
+                "mriqc",
+                "--job-workers",
+                "8",
+                "--max-jobs",
+                "2",
+                "--materialize",
+                "hardlink",
+                "--materialize-job",
+                "bids=symlink,*.tsv=copy",
+                "--dry-run",
+            ]
+        )
+        == 0
+    )
+    (call,) = calls
+    assert call["jobs_to_copy"] == ["bids", "fmriprep"]
+    assert call["max_workers"] == 16
+    assert call["dry_run"]
+    assert call["steps_to_run"] == ["bids", "fmriprep", "idps", "release_notes"]
+    assert call["strategy"] == {
+        "bids": materialize.Strategy(rules=(("*.tsv", "copy"),)),
+        "fmriprep": materialize.Strategy(default="hardlink"),
+    }
+
+
+def test_run_only_runs_the_steps_of_its_jobs(calls: list[dict]):
+    cli.main(["run", "in", "out", "--jobs", "synthstrip"])
+    (call,) = calls
+    assert call["jobs_to_copy"] == ["synthstrip"]
+    assert call["steps_to_run"] == ["idps", "release_notes"]
+
+
+def test_run_splits_jobs_across_array_tasks(
+    calls: list[dict], monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv("SLURM_ARRAY_TASK_ID", "2")
+    monkeypatch.setenv("SLURM_ARRAY_TASK_MIN", "1")
+    monkeypatch.setenv("SLURM_ARRAY_TASK_COUNT", "6")
+    cli.main(["run", "in", "out"])
+    (call,) = calls
+    assert call["jobs_to_copy"] == list(jobs.STORE_DIRS[1::6])
+    assert call["steps_to_run"] == ["bids", "fmriprep", "postgift"]
+    assert call["report_file"] == Path("out.report.task-1-of-6.parquet")
+    assert call["plan_file"] is None
+
+
+def test_run_keeps_the_files_it_is_given(
+    calls: list[dict], monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv("SLURM_ARRAY_TASK_ID", "0")
+    monkeypatch.setenv("SLURM_ARRAY_TASK_COUNT", "2")
+    cli.main(["run", "in", "out", "--dry-run", "--report-file", "report.json"])
+    (call,) = calls
+    assert call["plan_file"] == Path("out.plan.task-0-of-2.parquet")
+    assert call["report_file"] == Path("report.json")
+
+
+def test_run_rejects_unknown_modes(calls: list[dict]):
+    with pytest.raises(SystemExit):
+        cli.main(["run", "in", "out", "--materialize-job", "bids=softlink"])
+    assert not calls
+
+
+def test_run_mirrors_the_shard_of_the_array_task(
+    calls: list[dict], monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv("SLURM_ARRAY_TASK_ID", "3")
+    monkeypatch.setenv("SLURM_ARRAY_TASK_COUNT", "4")
+    cli.main(["run", "in", "out", "--shards", "4"])
+    (call,) = calls
+    assert call["jobs_to_copy"] == list(jobs.STORE_DIRS)
+    assert call["shard"] == shards.Shard(3, 4)
@@ -0,0 +1,317 @@
+import asyncio
+import os
+import typing
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from snapshot import datasets
+from snapshot.flows import copy_to_dst_wf
+from snapshot.tasks import exclude, journal, materialize, plan, report, shards
+
+
+@pytest.fixture
+def src(tmp_path: Path) -> Path:
+    root = tmp_path / "src"
+    for sub in ["10003", "10004"]:
+        anat = root / f"sub-{sub}" / "ses-V1" / "anat"
+        anat.mkdir(parents=True)
+        (anat / f"sub-{sub}_ses-V1_T1w.nii.gz").write_bytes(b"0")
+    (root / "sub-10003" / "ses-V3").mkdir()
+    (root / "sub-10003" / "ses-V3" / "sub-10003_ses-V3_T1w.nii.gz").write_bytes(b"0")
+    (root / "dataset_description.json").write_text("{}")
+    return root
+
+
+def test_copytree_links_files(src: Path, tmp_path: Path):
+    dst = tmp_path / "dst"
+    asyncio.run(
+        copy_to_dst_wf.copytree(
+            src, dst, ignore=exclude.ignore_entities([10004]), max_in_flight=2
+        )
+    )
+    t1w = dst / "sub-10003" / "ses-V1" / "anat" / "sub-10003_ses-V1_T1w.nii.gz"
+
+    assert t1w.is_symlink()
+    assert t1w.readlink() == src / t1w.relative_to(dst)
+    assert (dst / "dataset_description.json").is_symlink()
+    assert not (dst / "sub-10003" / "ses-V3").exists()
+    assert not (dst / "sub-10004").exists()
+
+
+def test_copytree_reports_failures(
+    src: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    symlink = os.symlink
+
+    def fail(src: str, dst: str, **kwargs) -> None:
+        if "10004" in dst:
+            raise PermissionError(src)
+        symlink(src, dst, **kwargs)
+
+    monkeypatch.setattr(copy_to_dst_wf.os, "symlink", fail)
+    dst = tmp_path / "dst"
+    with pytest.raises(ExceptionGroup) as excinfo:
+        asyncio.run(copy_to_dst_wf.copytree(src, dst, max_workers=2))
+
+    assert len(excinfo.value.exceptions) == 1
+    assert excinfo.group_contains(PermissionError)
+    assert (dst / "dataset_description.json").is_symlink()
+
+
+def test_copytree_resolves_symlinks(tmp_path: Path):
+    store = tmp_path / "store"
+    (store / "real" / "ses-V1").mkdir(parents=True)
+    (store / "real" / "ses-V1" / "fmriprep.toml").write_text("")
+    (store / "alias").symlink_to("real")
+    (store / "chain.toml").symlink_to("alias/ses-V1/fmriprep.toml")
+    src = tmp_path / "src"
+    log = src / "sub-10003" / "log"
+    log.mkdir(parents=True)
+    (log / "relative.toml").symlink_to("../../../store/chain.toml")
+    (log / "absolute.toml").symlink_to(store / "alias" / "ses-V1" / "fmriprep.toml")
+    (log / "parent.toml").symlink_to(store / "alias" / ".." / "chain.toml")
+    (log / "dangling.toml").symlink_to(store / "alias" / "missing.toml")
+    (log / "dir").symlink_to(store / "alias")
+    dst = tmp_path / "dst"
+
+    asyncio.run(copy_to_dst_wf.copytree(src, dst))
+
+    for link in log.iterdir():
+        mirrored = dst / link.relative_to(src)
+        if link.name == "dir":
+            # directories are mirrored, rather than linked whole
+            assert not mirrored.is_symlink()
+            toml = mirrored / "ses-V1" / "fmriprep.toml"
+            assert toml.readlink() == store / "real" / "ses-V1" / "fmriprep.toml"
+            continue
+        assert mirrored.readlink() == link.resolve(), link.name
+
+
+def test_copytree_keeps_symlinks_above_src(src: Path, tmp_path: Path):
+    # e.g., a project directory that is reached through a mount alias
+    (tmp_path / "alias").symlink_to(tmp_path)
+    store = tmp_path / "store"
+    (store / "ses-V1").mkdir(parents=True)
+    (store / "ses-V1" / "brain.nii.gz").touch()
+    (src / "sub-10004" / "derivatives").symlink_to(tmp_path / "alias" / "store")
+    alias = tmp_path / "alias" / "src"
+    dst = tmp_path / "dst"
+
+    asyncio.run(copy_to_dst_wf.copytree(alias, dst))
+
+    t1w = dst / "sub-10003" / "ses-V1" / "anat" / "sub-10003_ses-V1_T1w.nii.gz"
+    assert t1w.readlink() == alias / t1w.relative_to(dst)
+    # below src, symlinks to directories are resolved
+    brain = dst / "sub-10004" / "derivatives" / "ses-V1" / "brain.nii.gz"
+    assert brain.readlink() == store / "ses-V1" / "brain.nii.gz"
+
+
+def test_copytree_materializes_by_name(src: Path, tmp_path: Path):
+    dst = tmp_path / "dst"
+    strategy = materialize.Strategy(rules=(("*.json", "copy"),))
+
+    asyncio.run(copy_to_dst_wf.copytree(src, dst, strategy=strategy))
+
+    assert not (dst / "dataset_description.json").is_symlink()
+    assert (dst / "dataset_description.json").read_text() == "{}"
+    assert (dst / "sub-10003" / "ses-V3" / "sub-10003_ses-V3_T1w.nii.gz").is_symlink()
+
+
+@pytest.mark.parametrize("max_jobs", [1, 2])
+def test_main_runs_steps_after_their_jobs(
+    products: typing.Callable[..., Path],
+    release: typing.Callable[..., None],
+    tmp_path: Path,
+    max_jobs: int,
+):
+    inroot = products(jobs=["synthstrip", "eddyqc"], subs=[10003, 10004])
+    outroot = tmp_path / "out"
+    seen = {}
+
+    def step(ctx: copy_to_dst_wf.Context) -> None:
+        seen["synthstrip"] = (ctx.outroot / "derivatives" / "synthstrip").exists()
+        seen["index"] = ctx.indexes["synthstrip"]
+
+    release([10003], [copy_to_dst_wf.PostStep(step, needs=("synthstrip",))])
+    copy_to_dst_wf.main(
+        inroot, outroot, jobs_to_copy=["synthstrip", "eddyqc"], max_jobs=max_jobs
+    )
+
+    assert seen["synthstrip"]
+    assert set(seen["index"]["sub"]) == {10003}
+    assert not (outroot / "derivatives" / "eddyqc" / "sub-10004").exists()
+    written = pl.read_parquet(report.get_report_file(outroot))
+    assert set(written.get_column("name")) == {"synthstrip", "eddyqc", "step"}
+    assert written.get_column("error").is_null().all()
+
+
+def test_main_runs_steps_that_need_no_job_last(
+    products: typing.Callable[..., Path],
+    release: typing.Callable[..., None],
+    tmp_path: Path,
+):
+    inroot = products()
+    outroot = tmp_path / "out"
+    release([10003])
+
+    # the real POST_STEPS, of which the release notes write to outroot itself
+    copy_to_dst_wf.main(
+        inroot,
+        outroot,
+        jobs_to_copy=["synthstrip"],
+        max_jobs=1,
+        steps_to_run=["release_notes"],
+    )
+
+    assert (outroot / datasets.get_release_notes().name).exists()
+
+
+def test_execute_job_resumes(products: typing.Callable[..., Path], tmp_path: Path):
+    inroot = products(subs=[10003, 10004, 10005])
+    outroot = tmp_path / "out"
+    ops = plan.make_job("synthstrip", inroot, outroot, [10003, 10004, 10005])
+    # interrupted after finishing sub-10003, and halfway through sub-10004
+    outjobdir = outroot / "derivatives" / "synthstrip"
+    for sub in ["10003", "10004"]:
+        (outjobdir / f"sub-{sub}" / "ses-V1").mkdir(parents=True)
+    brain = outjobdir / "sub-10003" / "ses-V1" / "brain.nii.gz"
+    # stale, but the journal says that the directory is done
+    brain.symlink_to(tmp_path / "stale.nii.gz")
+    wrong = outjobdir / "sub-10004" / "ses-V1" / "brain.nii.gz"
+    wrong.symlink_to(tmp_path / "wrong.nii.gz")
+    with journal.DirLog(outroot, "synthstrip") as log:
+        for path in ["", "sub-10003", "sub-10003/ses-V1"]:
+            log.add(path)
+
+    copy_to_dst_wf.execute_job(ops, resume=True)
+
+    assert brain.readlink() == tmp_path / "stale.nii.gz"
+    assert wrong.readlink() == inroot / "synthstrip" / wrong.relative_to(outjobdir)
+    assert (outjobdir / "sub-10005" / "ses-V1" / "brain.nii.gz").is_symlink()
+    assert journal.read_job(outroot, "synthstrip") is not None
+    assert "sub-10005/ses-V1" in journal.read_dirs(outroot, "synthstrip")
+
+
+def test_main_resumes(
+    products: typing.Callable[..., Path],
+    release: typing.Callable[..., None],
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    inroot = products(jobs=["synthstrip", "eddyqc"])
+    outroot = tmp_path / "out"
+    ran = []
+
+    def synthstrip(ctx: copy_to_dst_wf.Context) -> None:  # noqa: ARG001
+        ran.append("synthstrip")
+
+    def eddyqc(ctx: copy_to_dst_wf.Context) -> None:
+        ran.append("eddyqc")
+        if len(ran) < 3:
+            raise ValueError(ctx.outroot)
+
+    release(
+        [10003],
+        [
+            copy_to_dst_wf.PostStep(synthstrip, needs=("synthstrip",)),
+            copy_to_dst_wf.PostStep(eddyqc, needs=("eddyqc",)),
+        ],
+    )
+    kwargs = {"jobs_to_copy": ["synthstrip", "eddyqc"], "max_jobs": 1}
+    with pytest.raises(ExceptionGroup):
+        copy_to_dst_wf.main(inroot, outroot, **kwargs)
+    monkeypatch.setattr(copy_to_dst_wf, "copy_job", None)
+    copy_to_dst_wf.main(inroot, outroot, **kwargs, resume=True)
+
+    assert sorted(ran) == ["eddyqc", "eddyqc", "synthstrip"]
+
+
+def test_main_keeps_the_journal_of_other_tasks(
+    products: typing.Callable[..., Path],
+    release: typing.Callable[..., None],
+    tmp_path: Path,
+):
+    inroot = products(jobs=["synthstrip", "eddyqc"])
+    outroot = tmp_path / "out"
+
+    def step(ctx: copy_to_dst_wf.Context) -> None:
+        pass
+
+    release([10003], [copy_to_dst_wf.PostStep(step, needs=("synthstrip",))])
+    # two tasks of a job array, each copying one of the jobs
+    copy_to_dst_wf.main(
+        inroot, outroot, jobs_to_copy=["synthstrip"], max_jobs=1, steps_to_run=["step"]
+    )
+    copy_to_dst_wf.main(
+        inroot, outroot, jobs_to_copy=["eddyqc"], max_jobs=1, steps_to_run=[]
+    )
+
+    assert journal.read_job(outroot, "synthstrip") is not None
+    assert journal.read_job(outroot, "eddyqc") is not None
+    assert journal.step_is_done(outroot, "step")
+
+
+def test_main_mirrors_shards_then_merges(
+    products: typing.Callable[..., Path],
+    release: typing.Callable[..., None],
+    tmp_path: Path,
+):
+    subs = list(range(10003, 10011))
+    inroot = products(subs=subs)
+    (inroot / "synthstrip" / "dataset_description.json").write_text("{}")
+    outroot = tmp_path / "out"
+    seen = []
+
+    def step(ctx: copy_to_dst_wf.Context) -> None:
+        seen.append(ctx.indexes["synthstrip"])
+
+    release(subs, [copy_to_dst_wf.PostStep(step, needs=("synthstrip",))])
+    for i in range(3):
+        copy_to_dst_wf.main(
+            inroot,
+            outroot,
+            jobs_to_copy=["synthstrip"],
+            max_jobs=1,
+            shard=shards.Shard(i, 3),
+        )
+    assert not seen
+    with pytest.raises(FileNotFoundError, match="synthstrip"):
+        copy_to_dst_wf.merge(inroot, outroot, 4, jobs_to_merge=["synthstrip"])
+    copy_to_dst_wf.merge(inroot, outroot, 3, jobs_to_merge=["synthstrip"])
+
+    outjobdir = outroot / "derivatives" / "synthstrip"
+    assert (outjobdir / "dataset_description.json").is_symlink()
+    for sub in subs:
+        assert (outjobdir / f"sub-{sub}" / "ses-V1" / "brain.nii.gz").is_symlink()
+    (index,) = seen
+    assert index.get_column("path").is_unique().all()
+    assert set(index.get_column("sub").drop_nulls()) == set(subs)
+    assert shards.Shard(1, 3).rename(report.get_report_file(outroot)).exists()
+
+
+def test_main_prunes_symlinked_subjects(
+    release: typing.Callable[..., None], tmp_path: Path
+):
+    # as tools/make_test_products does, subjects are symlinks into the products
+    store = tmp_path / "store"
+    for sub, sessions in [("10003", ["V1", "V3"]), ("10004", ["V3"])]:
+        for ses in sessions:
+            (store / sub / f"ses-{ses}").mkdir(parents=True)
+            (store / sub / f"ses-{ses}" / "brain.nii.gz").touch()
+    inroot = tmp_path / "in"
+    (inroot / "synthstrip").mkdir(parents=True)
+    for sub in ["10003", "10004"]:
+        (inroot / "synthstrip" / f"sub-{sub}").symlink_to(store / sub)
+    outroot = tmp_path / "out"
+    release([10003, 10004], [])
+
+    copy_to_dst_wf.main(inroot, outroot, jobs_to_copy=["synthstrip"], max_jobs=1)
+
+    sub = outroot / "derivatives" / "synthstrip" / "sub-10003"
+    assert not sub.is_symlink()
+    assert (sub / "ses-V1" / "brain.nii.gz").is_symlink()
+    assert not (sub / "ses-V3").exists()
+    # only has V3 data
+    assert not (outroot / "derivatives" / "synthstrip" / "sub-10004").exists()
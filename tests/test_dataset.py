@@ -1,4 +1,8 @@
+import pickle
+from pathlib import Path
+
 import polars as pl
+import pytest
 
 from snapshot import datasets
 
@@ -69,3 +73,53 @@ def test_get_release_notes():
 
 def test_get_deviceserialnumber():
     assert isinstance(datasets.get_device_serial_number_tbl(), pl.DataFrame)
+
+
+def test_load_table_once(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("SNAPSHOT_CACHE_DIR", str(tmp_path))
+    datasets.load_table.cache_clear()
+
+    assert datasets.load_table("qclog") is datasets.load_table("qclog")
+    assert len(list(tmp_path.glob("qclog-*.arrow"))) == 1
+
+
+def test_load_table_from_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("SNAPSHOT_CACHE_DIR", str(tmp_path))
+    datasets.load_table.cache_clear()
+    parsed = datasets.load_table("applied_pressures")
+    datasets.load_table.cache_clear()
+    monkeypatch.setattr(pl, "read_csv", None)
+
+    assert datasets.load_table("applied_pressures").equals(parsed)
+    assert parsed.schema["record_id"] == pl.Int64
+
+
+def test_scan_table():
+    d = datasets.scan_table("ilog").filter(pl.col("visit") == "V1").collect()
+
+    assert d.get_column("visit").unique().to_list() == ["V1"]
+
+
+def test_record_set():
+    records = datasets.RecordSet([10003, 10004])
+    d = pl.DataFrame({"sub": [10003, 10005], "ses": ["V1", "V1"]})
+
+    assert 10003 in records and 10005 not in records
+    assert records.semi_join(d).get_column("sub").to_list() == [10003]
+    assert records.semi_join(d.lazy()).collect().equals(records.semi_join(d))
+    assert list(pickle.loads(pickle.dumps(records))) == [10003, 10004]  # noqa: S301
+
+
+def test_record_set_entity():
+    records = datasets.RecordSet([10003])
+    d = pl.DataFrame(
+        {
+            "bids_name": [
+                "sub-10003_ses-V1_task-rest",
+                "sub-20001_ses-V1_desc-10003",
+                "sub-100031_ses-V1",
+            ]
+        }
+    )
+
+    assert records.semi_join_entity(d).height == 1
@@ -0,0 +1,56 @@
+from pathlib import Path
+
+from snapshot.models import jobs
+from snapshot.tasks import exclude, scan
+
+
+def test_is_excluded_v3():
+    assert exclude.is_excluded("ses-V3", set())
+    assert exclude.is_excluded("sub-25052_ses-V3_T1w.anat", set())
+    assert exclude.is_excluded("ses=V3", set())
+    assert not exclude.is_excluded("ses-V1", set())
+
+
+def test_is_excluded_sub():
+    assert exclude.is_excluded("sub-10003", {10003})
+    assert exclude.is_excluded("sub=10003", {10003})
+    assert exclude.is_excluded("sub-10003_ses-V1_T1w.nii.gz", {10003})
+    assert not exclude.is_excluded("sub-10004", {10003})
+
+
+def test_is_excluded_ignores_other_entities():
+    assert not exclude.is_excluded("sub-20001_desc-10003_mask.nii.gz", {10003})
+
+
+def test_ignore_entities():
+    ignore = exclude.ignore_entities([10003])
+    names = ["sub-10003", "sub-10003.html", "sub-10004", "ses-V3", "dataset.json"]
+
+    assert ignore("", names) == {"sub-10003", "sub-10003.html", "ses-V3"}
+
+
+def test_every_store_dir_has_a_job():
+    assert set(jobs.JOBS) == set(jobs.STORE_DIRS)
+
+
+def test_subjects_to_exclude(tmp_path: Path):
+    (tmp_path / "sub-10003" / "ses-V1").mkdir(parents=True)
+    (tmp_path / "sub-10004" / "ses-V3").mkdir(parents=True)
+    (tmp_path / "sub-10004" / "figures").mkdir()
+    (tmp_path / "sub-10005" / "ses-V1").mkdir(parents=True)
+    (tmp_path / "sub-10005.html").write_text("")
+    index = scan.scan(tmp_path)
+
+    assert exclude.subjects_to_exclude(
+        index, job=jobs.JOBS["fmriprep"], records=[10003, 10004]
+    ) == {10004, 10005}
+
+
+def test_subjects_to_exclude_hive(tmp_path: Path):
+    (tmp_path / "amplitude" / "sub=10003" / "ses=V1").mkdir(parents=True)
+    (tmp_path / "amplitude" / "sub=10004" / "ses=V1").mkdir(parents=True)
+    index = scan.scan(tmp_path)
+
+    assert exclude.subjects_to_exclude(
+        index, job=jobs.JOBS["postgift"], records=[10003]
+    ) == {10004}
@@ -0,0 +1,52 @@
+import subprocess
+import sys
+
+import pytest
+
+# modules that are slow to import: polars (with its own dependencies), and
+# nibabel and numpy, which nifti no longer needs
+HEAVY = ("polars", "nibabel", "numpy", "importlib.metadata")
+
+# microseconds, well below the time that importing polars takes alone
+BUDGET = 150_000
+
+
+def import_times(module: str) -> dict[str, int]:
+    """Cumulative import time of each module imported along with module"""
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "snapshot",
+        "snapshot.cli",
+        "snapshot.datasets",
+        "snapshot.models.jobs",
+        "snapshot.tasks.materialize",
+        "snapshot.tasks.shards",
+    ],
+)
+def test_light_modules_do_not_import_heavy_ones(module: str):
+    # the fastest of a few tries, so that a busy machine does not fail the test
+    tries = [import_times(module) for _ in range(3)]
+    assert not set(HEAVY) & set(tries[0])
+    assert min(times[module] for times in tries) < BUDGET
+
+
+def test_copy_to_dst_wf_does_not_import_nibabel():
+    times = import_times("snapshot.flows.copy_to_dst_wf")
+    assert "nibabel" not in times
+    assert "importlib.metadata" not in times
@@ -0,0 +1,122 @@
+import json
+import typing
+from pathlib import Path
+
+import pytest
+
+from snapshot.flows import copy_to_dst_wf
+from snapshot.tasks import manifest, materialize
+
+
+@pytest.fixture
+def inroot(products: typing.Callable[..., Path]) -> Path:
+    return products(subs=[10003, 10004])
+
+
+def _copy(inroot: Path, outroot: Path) -> None:
+    copy_to_dst_wf.copy_job(
+        "synthstrip", inroot, outroot, records=[10003, 10004], incremental=True
+    )
+
+
+def test_diff_unchanged(inroot: Path, tmp_path: Path):
+    outroot = tmp_path / "out"
+    _copy(inroot, outroot)
+    old = manifest.read_entries(outroot, "synthstrip")
+    assert old is not None
+    new = copy_to_dst_wf.copy_job(
+        "synthstrip", inroot, outroot, records=[10003, 10004], incremental=True
+    )
+
+    assert all(len(d) == 0 for d in manifest.diff(old, new))
+
+
+def test_incremental_copy(inroot: Path, tmp_path: Path):
+    outroot = tmp_path / "out"
+    _copy(inroot, outroot)
+    dst = outroot / "derivatives" / "synthstrip"
+    untouched = dst / "sub-10003" / "ses-V1" / "brain.nii.gz"
+    before = untouched.lstat().st_mtime_ns
+
+    src = inroot / "synthstrip"
+    (src / "sub-10004" / "ses-V1" / "brain.nii.gz").unlink()
+    (src / "sub-10004" / "ses-V1" / "mask.nii.gz").symlink_to(
+        src / "sub-10003" / "ses-V1" / "brain.nii.gz"
+    )
+    _copy(inroot, outroot)
+
+    assert untouched.lstat().st_mtime_ns == before
+    assert not (dst / "sub-10004" / "ses-V1" / "brain.nii.gz").exists()
+    assert (dst / "sub-10004" / "ses-V1" / "mask.nii.gz").is_symlink()
+
+
+def test_step_is_current(tmp_path: Path):
+    outroot = tmp_path / "out"
+    (outroot / "idp").mkdir(parents=True)
+    (outroot / "idp" / "mri.tsv").write_text("sub\n10003\n")
+    fingerprint = manifest.fingerprint([10003], {})
+    manifest.write_step(outroot, "idps", fingerprint, outputs=["idp"])
+
+    assert manifest.step_is_current(outroot, "idps", fingerprint)
+    assert not manifest.step_is_current(outroot, "idps", "other")
+    (outroot / "idp" / "mri.tsv").write_text("sub\n10004\n")
+    assert not manifest.step_is_current(outroot, "idps", fingerprint)
+
+
+def test_main_skips_current_steps(
+    inroot: Path, release: typing.Callable[..., None], tmp_path: Path
+):
+    outroot = tmp_path / "out"
+    runs = []
+
+    def step(ctx: copy_to_dst_wf.Context) -> None:
+        runs.append(ctx)
+        (ctx.outroot / "derivatives" / "synthstrip" / "table.tsv").write_text("")
+
+    release([10003], [copy_to_dst_wf.PostStep(step, needs=("synthstrip",))])
+    for _ in range(2):
+        copy_to_dst_wf.main(
+            inroot, outroot, jobs_to_copy=["synthstrip"], max_jobs=1, incremental=True
+        )
+    assert len(runs) == 1
+
+    (outroot / "derivatives" / "synthstrip" / "table.tsv").unlink()
+    copy_to_dst_wf.main(
+        inroot, outroot, jobs_to_copy=["synthstrip"], max_jobs=1, incremental=True
+    )
+    assert len(runs) == 2
+
+
+def test_write_step_skips_mirrored_files(inroot: Path, tmp_path: Path):
+    outroot = tmp_path / "out"
+    copy_to_dst_wf.main(
+        inroot,
+        outroot,
+        jobs_to_copy=["synthstrip"],
+        max_jobs=1,
+        incremental=True,
+        strategy=materialize.Strategy(default="hardlink"),
+        steps_to_run=[],
+    )
+    dst = outroot / "derivatives" / "synthstrip"
+    (dst / "table.tsv").write_text("sub\n10003\n")
+    (dst / "sub-10004" / "ses-V1" / "brain.nii.gz").unlink()
+    (dst / "sub-10004" / "ses-V1" / "brain.nii.gz").write_bytes(b"1")
+    index = manifest.read_entries(outroot, "synthstrip")
+    assert index is not None
+
+    manifest.write_step(
+        outroot,
+        "synthstrip",
+        "fingerprint",
+        outputs=["derivatives/synthstrip"],
+        mirrored={"derivatives/synthstrip": index},
+    )
+
+    record = json.loads(
+        (manifest.get_manifest_dir(outroot) / "steps" / "synthstrip.json").read_text()
+    )
+    assert sorted(record["files"]) == [
+        "derivatives/synthstrip/sub-10004/ses-V1/brain.nii.gz",
+        "derivatives/synthstrip/table.tsv",
+    ]
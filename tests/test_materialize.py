@@ -0,0 +1,72 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from snapshot.tasks import materialize
+
+
+@pytest.fixture
+def src(tmp_path: Path) -> Path:
+    src = tmp_path / "src" / "sub-10003_ses-V1_T1w.nii.gz"
+    src.parent.mkdir()
+    src.write_bytes(os.urandom(1024 * 1024 + 1))
+    src.chmod(0o640)
+    os.utime(src, ns=(1_000_000_000, 2_000_000_000))
+    return src
+
+
+@pytest.mark.parametrize("mode", materialize.MODES)
+def test_create(src: Path, tmp_path: Path, mode: materialize.MODE):
+    dst = tmp_path / "dst"
+    dst.mkdir()
+    fd = os.open(dst, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        done = materialize.create(os.fspath(src), src.name, fd, mode)
+    finally:
+        os.close(fd)
+    out = dst / src.name
+
+    assert out.read_bytes() == src.read_bytes()
+    if mode == "symlink":
+        assert out.readlink() == src
+        return
+    assert not out.is_symlink()
+    assert out.stat().st_mtime_ns == src.stat().st_mtime_ns
+    assert out.stat().st_mode == src.stat().st_mode
+    if mode == "hardlink":
+        assert done == "hardlink"
+        assert out.samefile(src)
+    else:
+        # reflinks fall back to copies where they are not supported
+        assert done in {mode, "copy"}
+        assert not out.samefile(src)
+
+
+@pytest.mark.parametrize("mode", ["hardlink", "copy"])
+def test_create_symlinks_directories_and_missing_files(
+    tmp_path: Path, mode: materialize.MODE
+):
+    fd = os.open(tmp_path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        done = [
+            materialize.create(os.fspath(tmp_path / src), dst, fd, mode)
+            for src, dst in [("", "dir"), ("missing", "dangling")]
+        ]
+    finally:
+        os.close(fd)
+
+    assert done == ["symlink", "symlink"]
+    assert (tmp_path / "dir").readlink() == tmp_path
+    assert (tmp_path / "dangling").readlink() == tmp_path / "missing"
+
+
+def test_strategy():
+    strategy = materialize.parse("reflink,*.tsv=copy,*.json=hardlink")
+
+    assert strategy.mode("sub-10003_ses-V1_scans.tsv") == "copy"
+    assert strategy.mode("sub-10003_ses-V1_T1w.json") == "hardlink"
+    assert strategy.mode("sub-10003_ses-V1_T1w.nii.gz") == "reflink"
+    assert materialize.parse("") == materialize.SYMLINK
+    with pytest.raises(ValueError, match="Unknown materialization mode"):
+        materialize.parse("*.tsv=move")
@@ -0,0 +1,83 @@
+from pathlib import Path
+
+import nibabel as nb
+import numpy as np
+import polars as pl
+import pytest
+
+from snapshot.tasks import nifti, utils
+
+
+def _save(dst: Path, shape: tuple[int, ...], image=nb.nifti1.Nifti1Image) -> Path:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    image(np.zeros(shape, dtype=np.uint8), np.eye(4)).to_filename(dst)
+    return dst
+
+
+@pytest.mark.parametrize(
+    ("image", "name"),
+    [
+        (nb.nifti1.Nifti1Image, "bold.nii.gz"),
+        (nb.nifti1.Nifti1Image, "bold.nii"),
+        (nb.nifti2.Nifti2Image, "bold.nii.gz"),
+    ],
+)
+def test_read_shape(tmp_path: Path, image, name: str):
+    src = _save(tmp_path / name, (2, 3, 4, 5), image=image)
+
+    assert nifti.read_shape(src) == nb.load(src).shape
+
+
+def test_read_shape_not_nifti(tmp_path: Path):
+    (src := tmp_path / "bold.nii").write_bytes(b"\0" * 600)
+
+    with pytest.raises(ValueError, match="NIfTI"):
+        nifti.read_shape(src)
+
+
+@pytest.mark.parametrize("data", [b"", b"\x5c\x01"])
+def test_read_shape_truncated(tmp_path: Path, data: bytes):
+    (src := tmp_path / "bold.nii").write_bytes(data)
+
+    with pytest.raises(ValueError, match=r"bold\.nii"):
+        nifti.read_shape(src)
+
+
+def test_read_shapes_prunes_the_cache(tmp_path: Path):
+    srcs = [_save(tmp_path / f"{i}.nii.gz", (2, 2, 2, i + 1)) for i in range(3)]
+    nifti.read_shapes(srcs)
+    nifti.read_shapes(srcs[1:])
+
+    cached = pl.read_parquet(nifti.get_cache_file()).get_column("path")
+    assert sorted(cached) == sorted(str(src.resolve()) for src in srcs[1:])
+
+
+def test_read_shapes_cached(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    srcs = [_save(tmp_path / f"{i}.nii.gz", (2, 2, 2, i + 1)) for i in range(3)]
+    first = nifti.read_shapes(srcs)
+
+    def _fail(src: Path) -> tuple[int, ...]:
+        raise AssertionError(src)
+
+    monkeypatch.setattr(nifti, "read_shape", _fail)
+
+    assert nifti.read_shapes(srcs) == first
+    assert [shape[-1] for shape in first.values()] == [1, 2, 3]
+
+
+def test_write_events(tmp_path: Path):
+    func = tmp_path / "sub-10003" / "ses-V1" / "func"
+    _save(func / "sub-10003_ses-V1_task-cuff_run-01_bold.nii.gz", (2, 2, 2, 7))
+    _save(func / "sub-10003_ses-V1_task-cuff_run-02_bold.nii.gz", (2, 2, 2, 3))
+    _save(func / "sub-10003_ses-V1_task-rest_run-01_bold.nii.gz", (2, 2, 2, 3))
+    utils.write_events(tmp_path)
+    cuff1 = pl.read_csv(
+        func / "sub-10003_ses-V1_task-cuff_run-01_events.tsv", separator="\t"
+    )
+    cuff2 = pl.read_csv(
+        func / "sub-10003_ses-V1_task-cuff_run-02_events.tsv", separator="\t"
+    )
+
+    assert cuff1.rows() == [(0, 7, 80)]
+    assert cuff2.columns == ["onset", "duration", "applied_pressure"]
+    assert not (func / "sub-10003_ses-V1_task-rest_run-01_events.tsv").exists()
@@ -0,0 +1,55 @@
+import typing
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from snapshot.flows import copy_to_dst_wf
+from snapshot.tasks import plan
+
+
+@pytest.fixture
+def inroot(products: typing.Callable[..., Path]) -> Path:
+    inroot = products(subs=[10003, 10004], sessions=["V1", "V3"], data=b"00")
+    ses = inroot / "synthstrip" / "sub-10003" / "ses-V1"
+    (ses / "mask.nii.gz").symlink_to(ses / "brain.nii.gz")
+    return inroot
+
+
+def test_make_job(inroot: Path, tmp_path: Path):
+    ops = plan.make_job("synthstrip", inroot, tmp_path / "out", [10003], stat=True)
+    counts = dict(ops.group_by("op").len().iter_rows())
+
+    assert counts == {"mkdir": 2, "link": 2, "exclude": 2}
+    assert set(ops.filter(pl.col("op") == "exclude").get_column("path")) == {
+        "sub-10004",
+        "sub-10003/ses-V3",
+    }
+    assert ops.filter(pl.col("op") == "link").get_column("bytes").sum() == 4
+
+
+def test_dry_run(inroot: Path, release: typing.Callable[..., None], tmp_path: Path):
+    outroot = tmp_path / "out"
+    release([10003])
+    copy_to_dst_wf.main(inroot, outroot, jobs_to_copy=["synthstrip"], dry_run=True)
+    summary = plan.summarize(plan.read(plan.get_plan_file(outroot)))
+
+    assert not outroot.exists()
+    assert summary.filter(job="synthstrip", op="link").get_column("n").item() == 2
+    assert summary.filter(job="idps").get_column("op").item() == "rewrite"
+
+
+def test_execute_saved_plan(
+    inroot: Path, release: typing.Callable[..., None], tmp_path: Path
+):
+    outroot = tmp_path / "out"
+    ops = plan.make_job("synthstrip", inroot, outroot, [10003])
+    plan.write(ops, tmp_path / "plan.parquet")
+    release([10003], [])
+    copy_to_dst_wf.main(
+        inroot, outroot, plan_file=tmp_path / "plan.parquet", max_jobs=1
+    )
+    dst = outroot / "derivatives" / "synthstrip"
+
+    assert (dst / "sub-10003" / "ses-V1" / "mask.nii.gz").is_symlink()
+    assert not (dst / "sub-10003" / "ses-V3").exists()
@@ -0,0 +1,60 @@
+import io
+import json
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from snapshot.tasks import report, scan
+
+
+def test_measure_counts_scan(tmp_path: Path):
+    for sub in ["10003", "10004"]:
+        (tmp_path / f"sub-{sub}" / "ses-V1").mkdir(parents=True)
+        (tmp_path / f"sub-{sub}" / "ses-V1" / "T1w.nii.gz").write_bytes(b"0")
+
+    with report.measure("bids", "job") as row:
+        scan.scan(tmp_path, stat=True)
+
+    assert row["entries"] == 6
+    assert row["readdir"] == 5
+    # one per entry, and one of the root (see scan.scan)
+    assert row["stat"] == 7
+    assert row["mkdir"] == 0
+    assert row["seconds"] > 0
+    assert "error" not in row
+
+
+def test_measure_records_errors():
+    with pytest.raises(ValueError), report.measure("idps", "step") as row:
+        msg = "mri.tsv"
+        raise ValueError(msg)
+
+    assert row["error"] == "ValueError('mri.tsv')"
+    assert row["seconds"] >= 0
+
+
+@pytest.mark.parametrize("suffix", [".parquet", ".json"])
+def test_write(tmp_path: Path, suffix: str):
+    _, job = report.measured("bids", "job", sum, [1, 2])
+    _, step = report.measured("idps", "step", len, [])
+    dst = tmp_path / f"report{suffix}"
+    report.write([step, job], dst)
+
+    if suffix == ".json":
+        written = pl.DataFrame(json.loads(dst.read_text()))
+    else:
+        written = pl.read_parquet(dst)
+    assert written.get_column("name").to_list() == ["bids", "idps"]
+    assert written.get_column("kind").cast(pl.String).to_list() == ["job", "step"]
+
+
+def test_progress():
+    stream = io.StringIO()
+    progress = report.Progress(n_jobs=2, n_steps=1, stream=stream)
+    progress.update({"name": "bids", "kind": "job", "seconds": 1.0})
+    progress.update({"name": "idps", "kind": "step", "error": "ValueError()"})
+
+    lines = stream.getvalue().splitlines()
+    assert lines[0].endswith("jobs 1/2, steps 0/1: finished bids in 1.0s")
+    assert lines[1].endswith("jobs 1/2, steps 1/1: failed idps in 0.0s")
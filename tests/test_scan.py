@@ -0,0 +1,90 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from snapshot.tasks import scan
+
+
+@pytest.fixture
+def tree(tmp_path: Path) -> Path:
+    root = tmp_path / "fmriprep"
+    anat = root / "sub-10003" / "ses-V1" / "anat"
+    anat.mkdir(parents=True)
+    (anat / "sub-10003_ses-V1_T1w.nii.gz").write_bytes(b"0")
+    func = root / "sub-10003" / "ses-V1" / "func"
+    func.mkdir()
+    (func / "sub-10003_ses-V1_task-rest_run-01_bold.nii.gz").write_bytes(b"0")
+    (root / "sub-10004" / "ses-V3").mkdir(parents=True)
+    (root / "sub-10003.html").write_text("")
+    (root / "sub-10003" / "log").mkdir()
+    (root / "sub-10003" / "log" / "fmriprep.toml").symlink_to(anat)
+    return root
+
+
+def test_scan_records_entities(tree: Path):
+    index = scan.scan(tree)
+    bold = index.filter(index["name"].str.ends_with("bold.nii.gz")).row(0, named=True)
+
+    assert (bold["sub"], bold["ses"], bold["task"], bold["run"]) == (
+        10003,
+        "V1",
+        "rest",
+        "01",
+    )
+
+
+def test_scan_records_kind_and_target(tree: Path):
+    index = scan.scan(tree)
+    toml = index.filter(index["name"] == "fmriprep.toml").row(0, named=True)
+    kinds = dict(index.select("path", "kind").iter_rows())
+
+    # a symlink to a directory, which is walked
+    assert toml["kind"] == "dir"
+    assert toml["target"] == str(tree / "sub-10003" / "ses-V1" / "anat")
+    assert "sub-10003/log/fmriprep.toml/sub-10003_ses-V1_T1w.nii.gz" in kinds
+    assert kinds["sub-10003"] == "dir"
+    assert kinds["sub-10003.html"] == "file"
+
+
+def test_glob_matches_pathlib(tree: Path):
+    index = scan.scan(tree)
+    for pattern in ["sub-*", "sub*/ses*", "*.html"]:
+        assert sorted(scan.glob(tree, pattern, index=index)) == sorted(
+            tree.glob(pattern)
+        )
+    # unlike pathlib, the index includes what is below symlinks to directories
+    linked = (
+        tree / "sub-10003" / "log" / "fmriprep.toml" / "sub-10003_ses-V1_T1w.nii.gz"
+    )
+    assert sorted(scan.rglob(tree, "*nii.gz", index=index)) == sorted(
+        [*tree.rglob("*nii.gz"), linked]
+    )
+
+
+def test_prune_drops_contents(tree: Path):
+    index = scan.prune(scan.scan(tree), tree, shutil.ignore_patterns("*ses-V3*"))
+
+    assert not index["path"].str.contains("ses-V3").any()
+    assert (index["path"] == "sub-10004").any()
+
+
+def test_scan_does_not_follow_loops(tree: Path):
+    (tree / "sub-10003" / "ses-V1" / "anat" / "up").symlink_to(tree / "sub-10003")
+    kinds = dict(scan.scan(tree).select("path", "kind").iter_rows())
+
+    assert kinds["sub-10003/ses-V1/anat/up"] == "symlink"
+
+
+def test_scan_does_not_follow_cycles(tree: Path):
+    # siblings that link to each other, rather than to an ancestor
+    (tree / "a").mkdir()
+    (tree / "b").mkdir()
+    (tree / "a" / "to_b").symlink_to(tree / "b")
+    (tree / "b" / "to_a").symlink_to(tree / "a")
+    kinds = dict(scan.scan(tree).select("path", "kind").iter_rows())
+
+    assert kinds["a/to_b"] == "dir"
+    assert kinds["a/to_b/to_a"] == "symlink"
+    assert kinds["b/to_a"] == "dir"
+    assert kinds["b/to_a/to_b"] == "symlink"
@@ -0,0 +1,65 @@
+import typing
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from snapshot.tasks import plan, shards
+
+
+def test_of_is_stable():
+    assert shards.of("bids", 10003, 1) == 0
+    assert shards.of("bids", 10003, 8) == shards.of("bids", 10003, 8)
+    assert len({shards.of("bids", sub, 4) for sub in range(10000, 10100)}) == 4
+
+
+def test_select_splits_subjects():
+    ops = pl.DataFrame(
+        [
+            {"job": "bids", "op": "mkdir", "path": "", "kind": "dir"},
+            {"job": "bids", "op": "link", "path": "README", "kind": "file"},
+            *(
+                {"job": "bids", "op": op, "path": path, "kind": kind, "sub": sub}
+                for sub in range(10000, 10020)
+                for op, path, kind in [
+                    ("mkdir", f"sub-{sub}", "dir"),
+                    ("link", f"sub-{sub}/T1w.nii.gz", "file"),
+                ]
+            ),
+        ],
+        schema=plan.SCHEMA,
+    )
+    parts = [shards.Shard(i, 3).select(ops) for i in range(3)]
+
+    subs = [set(part.get_column("sub").drop_nulls()) for part in parts]
+    assert set.union(*subs) == set(range(10000, 10020))
+    assert sum(map(len, subs)) == 20
+    assert all("" in part.get_column("path") for part in parts)
+    assert [("README" in part.get_column("path")) for part in parts] == [
+        True,
+        False,
+        False,
+    ]
+
+
+def test_make_job_only_walks_the_subjects_of_the_shard(
+    products: typing.Callable[..., Path], tmp_path: Path
+):
+    subs = range(10000, 10020)
+    args = ("synthstrip", products(subs=subs), tmp_path / "out", list(subs))
+    full = plan.make_job(*args)
+    for i in range(3):
+        shard = shards.Shard(i, 3)
+        walked = plan.make_job(*args, shard=shard)
+
+        assert set(walked.filter(pl.col("kind") == "file").get_column("sub")) == {
+            sub for sub in subs if shard.has("synthstrip", sub)
+        }
+        assert shard.select(walked).equals(shard.select(full))
+
+
+def test_parse():
+    assert shards.parse("3/8") == shards.Shard(3, 8)
+    for spec in ["8/8", "3", "a/b"]:
+        with pytest.raises(ValueError, match="shard"):
+            shards.parse(spec)
@@ -3,6 +3,7 @@ import typing
 from pathlib import Path
 
 import polars as pl
+import pytest
 
 from snapshot import datasets
 from snapshot.tasks import utils
@@ -76,6 +77,24 @@ def test_clean_sidecars(tmp_path: Path) -> None:
     assert all(no_institutionname + no_institutionname)
 
 
+def test_clean_sidecars_links(tmp_path: Path) -> None:
+    src = tmp_path / "src"
+    dst = tmp_path / "dst"
+    src.mkdir()
+    dst.mkdir()
+    (src / "sub-00_T1w.json").write_text(json.dumps({"InstitutionAddress": "here"}))
+    (src / "sub-01_T1w.json").write_text(json.dumps({"InstitutionName": "there"}))
+    for name in ["sub-00_T1w.json", "sub-01_T1w.json"]:
+        (dst / name).symlink_to(src / name)
+    cleaned = utils.clean_sidecars(dst)
+
+    assert (cleaned.checked, cleaned.rewritten) == (2, 1)
+    assert not (dst / "sub-00_T1w.json").is_symlink()
+    assert json.loads((dst / "sub-00_T1w.json").read_text()) == {}
+    assert "InstitutionAddress" in (src / "sub-00_T1w.json").read_text()
+    assert (dst / "sub-01_T1w.json").is_symlink()
+
+
 def test_write_participants(tmp_path: Path):
     participants = tmp_path / "participants.tsv"
     sidecar = tmp_path / "participants.json"
@@ -105,6 +124,130 @@ def test_write_sessions(tmp_path: Path):
     assert dst.exists()
 
 
+def test_write_sessions_per_subject(tmp_path: Path):
+    for sub in [10003, 99999]:
+        for ses in ["V1", "V3"]:
+            (tmp_path / f"sub-{sub}" / f"ses-{ses}").mkdir(parents=True)
+    utils.write_sessions(tmp_path, max_workers=2)
+    found = pl.read_csv(
+        tmp_path / "sub-10003" / "sub-10003_sessions.tsv", separator="\t"
+    )
+    missing = pl.read_csv(
+        tmp_path / "sub-99999" / "sub-99999_sessions.tsv", separator="\t"
+    )
+
+    assert found.get_column("session_id").to_list() == ["ses-V1"]
+    assert missing.is_empty() and missing.columns == found.columns
+
+
+def test_partition_tables(tmp_path: Path):
+    d = pl.DataFrame({"sub": [1, 2, 1], "x": ["a", "b", "c"]})
+    dsts = {1: tmp_path / "1.tsv", 3: tmp_path / "3.tsv"}
+    n = utils.to_bids_tsvs(utils.partition_tables(d, "sub", dsts))
+
+    assert n == 2
+    assert (tmp_path / "1.tsv").read_text() == "x\na\nc\n"
+    assert (tmp_path / "3.tsv").read_text() == "x\n"
+    assert not (tmp_path / "2.tsv").exists()
+
+
+def test_update_scans(tmp_path: Path):
+    src = tmp_path / "src.tsv"
+    src.write_text(
+        "filename\tacq_time\n"
+        "anat/sub-10003_ses-V1_T1w.nii.gz\t2021-01-01T00:00:00\n"
+        "func/sub-10003_ses-V1_task-rest_run-01_bold.nii.gz\t2021-01-01T00:00:00\n"
+    )
+    linked = tmp_path / "sub-10003" / "ses-V1" / "sub-10003_ses-V1_scans.tsv"
+    linked.parent.mkdir(parents=True)
+    linked.symlink_to(src)
+    other = tmp_path / "sub-99999" / "ses-V1" / "sub-99999_ses-V1_scans.tsv"
+    other.parent.mkdir(parents=True)
+    other.write_text("filename\ndwi/sub-99999_ses-V1_dwi.nii.gz\n")
+    utils.update_scans(tmp_path)
+    scans = pl.read_csv(linked, separator="\t", null_values=utils.NULLS)
+
+    assert scans.columns == ["filename", "rating"]
+    assert scans.get_column("filename").str.starts_with("anat").to_list() == [
+        True,
+        False,
+    ]
+    assert scans.get_column("rating").null_count() == 0
+    assert "acq_time" in src.read_text()
+    assert pl.read_csv(other, separator="\t").get_column("rating").to_list() == ["n/a"]
+
+
+def test_to_bids_tsv_companions(tmp_path: Path):
+    d = pl.DataFrame(
+        {
+            "sub": [10003, 10004],
+            "ses": ["V1", "V1"],
+            "hemisphere": ["lh", "left"],
+            "Volume_mm3": [1.0, None],
+        }
+    )
+    dst = tmp_path / "aseg.tsv"
+    utils.to_bids_tsv(
+        d, dst, formats=["parquet", "arrow"], sidecar=datasets.get_aseg_json()
+    )
+    parquet = pl.read_parquet(dst.with_suffix(".parquet"))
+
+    assert parquet.schema["ses"] == pl.Enum(["V1", "V3"])
+    assert parquet.schema["hemisphere"] == pl.Categorical()
+    assert pl.read_ipc(dst.with_suffix(".arrow")).equals(parquet)
+    assert pl.read_csv(dst, separator="\t", null_values=utils.NULLS).equals(d)
+
+
+def test_to_bids_tsv_unknown_format(tmp_path: Path):
+    with pytest.raises(ValueError, match="csv"):
+        utils.to_bids_tsv(pl.DataFrame({"a": [1]}), tmp_path / "a.tsv", formats=["csv"])
+
+
+def test_write_companions_lazy(tmp_path: Path):
+    d = pl.DataFrame({"ses": ["V1", "V3"], "x": [1, 2]})
+    utils.write_companions(
+        d.lazy(), tmp_path / "t.tsv", ["parquet"], sidecar=datasets.get_aseg_json()
+    )
+    parquet = pl.read_parquet(tmp_path / "t.parquet")
+
+    assert parquet.schema["ses"] == pl.Categorical()
+    assert parquet.cast({"ses": pl.String}).equals(d)
+
+
+def test_filter_table(tmp_path: Path):
+    src = tmp_path / "src.tsv"
+    src.write_text(
+        "sub\tses\tvolume\textra\n"
+        "10003\tV1\t1.5\ta\n"
+        "10003\tV3\t2.5\tb\n"
+        "99999\tV1\tn/a\tc\n"
+    )
+    sidecar = tmp_path / "src.json"
+    sidecar.write_text(json.dumps({"sub": {}, "ses": {}, "volume": {}}))
+    utils.filter_table(src, tmp_path / "dst.tsv", [10003], sidecar=sidecar)
+
+    assert (tmp_path / "dst.tsv").read_text() == "sub\tses\tvolume\n10003\tV1\t1.5\n"
+
+
+def test_overwrite_tables(tmp_path: Path):
+    src = tmp_path / "src.tsv"
+    src.write_text(
+        "bids_name\tvalue\n"
+        "sub-10003_ses-V1_task-rest\t1\n"
+        "sub-10003_ses-V3_task-rest\t2\n"
+        "sub-99999_ses-V1_task-10003\t3\n"
+    )
+    outjob = tmp_path / "fcn"
+    outjob.mkdir()
+    (outjob / "hub_disruption.tsv").symlink_to(src)
+    utils.overwrite_tables(outjob, [10003], ["hub_disruption.tsv"])
+    d = pl.read_csv(outjob / "hub_disruption.tsv", separator="\t")
+
+    assert d.get_column("value").to_list() == [1]
+    assert not (outjob / "hub_disruption.tsv").is_symlink()
+    assert len(src.read_text().splitlines()) == 4
+
+
 def test_write_readme(tmp_path: Path):
     dst = tmp_path / "README"
     utils.write_readme(dst.parent)
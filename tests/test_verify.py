@@ -0,0 +1,123 @@
+import asyncio
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from snapshot.flows import copy_to_dst_wf
+from snapshot.tasks import verify
+
+
+@pytest.fixture
+def roots(tmp_path: Path) -> tuple[Path, Path]:
+    inroot = tmp_path / "in"
+    anat = inroot / "synthstrip" / "sub-10003" / "ses-V1" / "anat"
+    anat.mkdir(parents=True)
+    (anat / "brain.nii.gz").write_bytes(b"0")
+    (inroot / "synthstrip" / "brains.tsv").write_text("sub\n10003\n")
+    outroot = tmp_path / "out"
+    outjobdir = outroot / "derivatives" / "synthstrip"
+    asyncio.run(copy_to_dst_wf.copytree(inroot / "synthstrip", outjobdir))
+    # written by a post-processing step
+    (outjobdir / "brains.tsv").unlink()
+    (outjobdir / "brains.tsv").write_text("sub\n10003\n")
+    return inroot, outroot
+
+
+def test_verify_clean_release(roots: tuple[Path, Path]):
+    inroot, outroot = roots
+
+    problems = verify.verify(inroot, outroot, [10003], jobs_to_check=["synthstrip"])
+
+    assert problems.is_empty()
+
+
+def test_verify_finds_problems(roots: tuple[Path, Path], tmp_path: Path):
+    inroot, outroot = roots
+    outjobdir = outroot / "derivatives" / "synthstrip"
+    anat = outjobdir / "sub-10003" / "ses-V1" / "anat"
+    (anat / "relative.nii.gz").symlink_to("brain.nii.gz")
+    (anat / "dangling.nii.gz").symlink_to(inroot / "missing.nii.gz")
+    (tmp_path / "elsewhere.nii.gz").write_bytes(b"0")
+    (anat / "outside.nii.gz").symlink_to(tmp_path / "elsewhere.nii.gz")
+    (outjobdir / "sub-10003" / "ses-V3").mkdir()
+    (outjobdir / "sub-10004" / "ses-V1").mkdir(parents=True)
+
+    problems = verify.verify(inroot, outroot, [10003], jobs_to_check=["synthstrip"])
+
+    assert dict(problems.select("path", "problem").iter_rows()) == {
+        "sub-10003/ses-V1/anat/relative.nii.gz": "relative",
+        "sub-10003/ses-V1/anat/dangling.nii.gz": "dangling",
+        "sub-10003/ses-V1/anat/outside.nii.gz": "outside",
+        "sub-10003/ses-V3": "excluded",
+        "sub-10004": "excluded",
+    }
+    allowed = verify.verify(
+        inroot, outroot, [10003], jobs_to_check=["synthstrip"], roots=[tmp_path]
+    )
+    assert "outside" not in allowed.get_column("problem")
+
+
+def test_verify_follows_symlinked_directories(roots: tuple[Path, Path]):
+    inroot, outroot = roots
+    outjobdir = outroot / "derivatives" / "synthstrip"
+    linked = inroot / "products" / "sub-10004"
+    for ses in ["V1", "V3"]:
+        (linked / f"ses-{ses}" / "anat").mkdir(parents=True)
+        (linked / f"ses-{ses}" / "anat" / "brain.nii.gz").write_bytes(b"0")
+    (linked / "ses-V1" / "scans.tsv").write_text("filename\n")
+    (outjobdir / "sub-10004").symlink_to(linked)
+    (outjobdir / "sub-10003" / "ses-V2").symlink_to("ses-V1")
+
+    problems = verify.verify(
+        inroot, outroot, [10003, 10004], jobs_to_check=["synthstrip"], hash_files=True
+    )
+
+    assert dict(problems.select("path", "problem").iter_rows()) == {
+        "sub-10003/ses-V2": "relative",
+        "sub-10004/ses-V3": "excluded",
+    }
+    manifest = pl.read_parquet(verify.get_verify_file(outroot))
+    assert manifest.get_column("path").to_list() == [
+        "derivatives/synthstrip/brains.tsv"
+    ]
+
+
+def test_verify_hashes_generated_files(roots: tuple[Path, Path]):
+    inroot, outroot = roots
+
+    verify.verify(
+        inroot, outroot, [10003], jobs_to_check=["synthstrip"], hash_files=True
+    )
+    manifest = pl.read_parquet(verify.get_verify_file(outroot))
+
+    assert manifest.get_column("path").to_list() == [
+        "derivatives/synthstrip/brains.tsv"
+    ]
+    assert manifest.get_column("blake2b").to_list() == [
+        verify.hash_file(str(outroot / "derivatives" / "synthstrip" / "brains.tsv"))
+    ]
+
+
+def test_checksums_reuses_unchanged_digests(tmp_path: Path):
+    for name in ["a.tsv", "b.tsv"]:
+        (tmp_path / name).write_text(name)
+    files = pl.DataFrame(
+        {"job": ["bids", "bids"], "path": ["a.tsv", "b.tsv"], "size": [5, 5]}
+    ).with_columns(
+        mtime_ns=pl.Series(
+            [(tmp_path / p).stat().st_mtime_ns for p in ["a.tsv", "b.tsv"]]
+        )
+    )
+    old = files.with_columns(blake2b=pl.lit("cached")).with_columns(
+        mtime_ns=pl.when(pl.col("path") == "b.tsv")
+        .then(pl.col("mtime_ns") - 1)
+        .otherwise(pl.col("mtime_ns"))
+    )
+
+    digests = verify.checksums(tmp_path, files, old, max_workers=1)
+
+    assert digests.get_column("blake2b").to_list() == [
+        "cached",
+        verify.hash_file(str(tmp_path / "b.tsv")),
+    ]
@@ -0,0 +1,62 @@
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from snapshot.tasks import utils, wide
+
+
+@pytest.fixture
+def src(tmp_path: Path) -> Path:
+    src = tmp_path / "mri.tsv"
+    src.write_text(
+        "sub\tses\ta\tb\tc\n"
+        "10003\tV1\t1\t0.5\tx\n"
+        "10003\tV3\t2\t1.5\ty\n"
+        "10004\tV1\t3\tn/a\tz\n"
+        "99999\tV1\t4\t2.5\tw\n"
+    )
+    return src
+
+
+def _v1(records: list[int]):
+    def _rows(index: pl.DataFrame) -> pl.DataFrame:
+        return index.filter(pl.col("ses") == "V1", pl.col("sub").is_in(records))
+
+    return _rows
+
+
+def test_read(src: Path):
+    table = wide.read(
+        src,
+        ["sub", "ses", "b", "a", "d"],
+        rows=_v1([10003, 10004]),
+        null_values=["n/a"],
+    )
+
+    # in the order of the data dictionary, not of src
+    assert table.columns == ["sub", "ses", "b", "a"]
+    assert table.get_column("sub").to_list() == [10003, 10004]
+    assert table.schema["b"] == pl.Float64
+
+
+def test_read_skips_short_lines(src: Path):
+    src.write_text(src.read_text() + "10005\n\n")
+    table = wide.read(src, ["sub", "ses", "a"], rows=lambda index: index)
+
+    assert table.get_column("sub").to_list() == [10003, 10003, 10004, 99999]
+
+
+def test_read_matches_polars(src: Path, tmp_path: Path):
+    table = wide.read(src, ["sub", "ses", "a", "b", "c"], rows=lambda index: index)
+    utils.to_bids_tsv(table, tmp_path / "out.tsv")
+
+    assert (tmp_path / "out.tsv").read_text() == src.read_text()
+
+
+def test_to_long(src: Path):
+    table = wide.read(src, ["sub", "ses", "a", "b", "c"], rows=_v1([10003]))
+    long = wide.to_long(table)
+
+    assert long.columns == ["sub", "ses", "variable", "value"]
+    assert long.get_column("variable").cast(pl.String).to_list() == ["a", "b"]
@@ -0,0 +1,63 @@
+import argparse
+import random
+import shutil
+import time
+
+from snapshot.tasks import exclude
+
+
+def make_tree(n_subs: int, seed: int = 0) -> dict[str, list[str]]:
+    """Names in an fmriprep-like tree, keyed by their directory"""
+    rng = random.Random(seed)  # noqa: S311
+    subs = rng.sample(range(10000, 30000), n_subs)
+    tree: dict[str, list[str]] = {"": []}
+    for sub in subs:
+        tree[""].extend([f"sub-{sub}", f"sub-{sub}.html"])
+        tree[f"sub-{sub}"] = ["figures", "log", "ses-V1", "ses-V3"]
+        for ses in ["V1", "V3"]:
+            tree[f"sub-{sub}/ses-{ses}"] = ["anat", "func"]
+            tree[f"sub-{sub}/ses-{ses}/anat"] = [
+                f"sub-{sub}_ses-{ses}_desc-preproc_T1w.nii.gz",
+                f"sub-{sub}_ses-{ses}_desc-preproc_T1w.json",
+                f"sub-{sub}_ses-{ses}_desc-brain_mask.nii.gz",
+            ]
+            tree[f"sub-{sub}/ses-{ses}/func"] = [
+                f"sub-{sub}_ses-{ses}_task-{task}_run-0{run}_{suffix}"
+                for task in ["rest", "cuff"]
+                for run in [1, 2]
+                for suffix in ["bold.nii.gz", "bold.json", "desc-confounds.tsv"]
+            ]
+    return tree
+
+
+def run(tree: dict[str, list[str]], ignore) -> tuple[float, int]:
+    s = time.perf_counter()
+    n = 0
+    for d, names in tree.items():
+        n += len(ignore(d, names))
+    return time.perf_counter() - s, n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-subs", default=3500, type=int)
+    parser.add_argument("--n-excluded", default=3000, type=int)
+
+    args = parser.parse_args()
+
+    tree = make_tree(args.n_subs)
+    subs = [int(name[4:]) for name in tree[""] if not name.endswith("html")]
+    excluded = subs[: args.n_excluded]
+    n_names = sum(len(names) for names in tree.values())
+    print(f"{n_names} names in {len(tree)} directories, {len(excluded)} excluded")
+
+    elapsed, n = run(tree, exclude.ignore_entities(excluded))
+    print(f"ignore_entities ignored {n} names in {elapsed:0.2f} seconds.")
+
+    elapsed, n = run(
+        tree,
+        shutil.ignore_patterns(
+            "*ses-V3*", "*ses=V3*", *(f"*{sub}*" for sub in excluded)
+        ),
+    )
+    print(f"ignore_patterns ignored {n} names in {elapsed:0.2f} seconds.")
@@ -0,0 +1,89 @@
+"""Compare the materialization modes of copytree on a given filesystem
+
+Pass --workdir (and --dstdir, to materialize onto another filesystem) to benchmark
+the filesystems that hold the products and the release.
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import polars as pl
+
+from snapshot.flows import copy_to_dst_wf
+from snapshot.tasks import materialize, report, scan
+
+STRATEGIES = {
+    **{mode: materialize.Strategy(default=mode) for mode in materialize.MODES},
+    "mixed": materialize.parse("reflink,*.tsv=copy,*.json=copy"),
+}
+
+
+def make_tree(root: Path, n_subjects: int, image_size: int) -> None:
+    """Small tables and sidecars next to larger images, as in the products"""
+    image = os.urandom(image_size)
+    for sub in range(10000, 10000 + n_subjects):
+        for ses in ["V1", "V3"]:
+            d = root / f"sub-{sub}" / f"ses-{ses}" / "func"
+            d.mkdir(parents=True)
+            prefix = f"sub-{sub}_ses-{ses}_task-rest"
+            (d / f"{prefix}_bold.nii.gz").write_bytes(image)
+            (d / f"{prefix}_bold.json").write_text('{"RepetitionTime": 0.8}')
+            (d / f"{prefix}_events.tsv").write_text("onset\tduration\n0\t1\n")
+
+
+def read_all(root: Path) -> int:
+    """What a consumer of the release does: open and read every file"""
+    n = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            with open(os.path.join(dirpath, filename), "rb") as f:
+                n += len(f.read())
+    return n
+
+
+def run(src: Path, dstdir: Path, name: str, strategy: materialize.Strategy) -> dict:
+    dst = dstdir / name
+    index = scan.scan(src)
+    with report.measure(name, "job") as row:
+        asyncio.run(copy_to_dst_wf.copytree(src, dst, index=index, strategy=strategy))
+    start = time.perf_counter()
+    n_bytes = read_all(dst)
+    read_seconds = time.perf_counter() - start
+    shutil.rmtree(dst)
+    n_files = index.filter(pl.col("kind") == "file").height
+    return {
+        "strategy": name,
+        "seconds": row["seconds"],
+        "files_per_second": n_files / row["seconds"],
+        "mib_per_second": n_bytes / 1024**2 / row["seconds"],
+        **{mode: row[mode] for mode in materialize.MODES},
+        "read_seconds": read_seconds,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-subjects", default=100, type=int)
+    parser.add_argument("--image-size", default=8 * 1024**2, type=int)
+    parser.add_argument("--workdir", default=None, type=Path)
+    parser.add_argument("--dstdir", default=None, type=Path)
+    parser.add_argument("--strategies", nargs="+", default=list(STRATEGIES))
+
+    args = parser.parse_args()
+
+    with (
+        tempfile.TemporaryDirectory(dir=args.workdir) as srcdir,
+        tempfile.TemporaryDirectory(dir=args.dstdir or args.workdir) as dstdir,
+    ):
+        src = Path(srcdir) / "products"
+        make_tree(src, args.n_subjects, args.image_size)
+        results = pl.DataFrame(
+            [run(src, Path(dstdir), name, STRATEGIES[name]) for name in args.strategies]
+        )
+    with pl.Config(tbl_rows=-1, tbl_cols=-1):
+        print(results)
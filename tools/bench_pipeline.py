@@ -0,0 +1,354 @@
+"""Time each stage of copy_to_dst_wf on synthetic trees shaped like the products
+
+Results are appended to a parquet file (one row per job or step and stage), and
+compared against the previous version found there, so that regressions show up.
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import struct
+import tempfile
+import time
+import typing
+from datetime import UTC, datetime
+from pathlib import Path
+
+import polars as pl
+
+import snapshot
+from snapshot import datasets
+from snapshot.flows import copy_to_dst_wf
+from snapshot.models import jobs
+from snapshot.tasks import exclude, plan, scan, utils
+
+# every V3_ONLY-th subject is missing V1
+V3_ONLY = 5
+
+RESULTS_SCHEMA = pl.Schema(
+    {
+        "version": pl.String,
+        "timestamp": pl.Datetime("us", "UTC"),
+        "n_subjects": pl.Int64,
+        "job": pl.String,
+        "stage": pl.String,
+        "seconds": pl.Float64,
+        "n": pl.Int64,
+        "per_second": pl.Float64,
+        "read_syscalls": pl.Int64,
+        "write_syscalls": pl.Int64,
+        "error": pl.String,
+    }
+)
+
+
+def _nifti(dst: Path, n_volumes: int) -> None:
+    """Gzipped NIfTI-1 header, with no data"""
+    header = bytearray(352)
+    struct.pack_into("<i", header, 0, 348)
+    struct.pack_into("<8h", header, 40, 4, 2, 2, 2, n_volumes, 1, 1, 1)
+    struct.pack_into("<h", header, 70, 2)  # uint8
+    struct.pack_into("<f", header, 108, 352)  # vox_offset
+    header[344:348] = b"n+1\0"
+    with gzip.open(dst, "wb", compresslevel=1) as f:
+        f.write(header)
+
+
+def _session(root: Path, sub: int, ses: str) -> None:
+    prefix = f"sub-{sub}_ses-{ses}"
+    anat = root / "anat"
+    func = root / "func"
+    anat.mkdir(parents=True)
+    func.mkdir()
+    _nifti(anat / f"{prefix}_T1w.nii.gz", 1)
+    (anat / f"{prefix}_T1w.json").write_text(
+        json.dumps({"InstitutionAddress": "here", "InstitutionName": "there"})
+    )
+    for task in ["rest", "cuff"]:
+        for run in [1, 2]:
+            name = f"{prefix}_task-{task}_run-0{run}"
+            _nifti(func / f"{name}_bold.nii.gz", 10)
+            (func / f"{name}_bold.json").write_text(json.dumps({"RepetitionTime": 0.8}))
+    (root / f"{prefix}_scans.tsv").write_text(
+        "filename\tacq_time\n"
+        f"anat/{prefix}_T1w.nii.gz\tn/a\n"
+        f"func/{prefix}_task-rest_run-01_bold.nii.gz\tn/a\n"
+    )
+
+
+def make_job(root: Path, job: jobs.STORE_DIR, subs: typing.Sequence[int]) -> None:
+    """Products of one STORE_DIR, laid out as described by jobs.JOBS"""
+    layout = jobs.JOBS[job]
+    jobdir = root / job
+    jobdir.mkdir(parents=True)
+    (jobdir / "dataset_description.json").write_text("{}")
+    for i, sub in enumerate(subs):
+        # some subjects only have V3 data
+        sessions = ["V3"] if i % V3_ONLY == 0 else ["V1", "V3"]
+        for pattern_root in layout.roots:
+            parent = jobdir / pattern_root.replace("*", "task-rest_")
+            subdir = parent / f"sub{layout.separator}{sub}"
+            for ses in sessions:
+                if layout.sessions == "subdir":
+                    _session(subdir / f"ses{layout.separator}{ses}", sub, ses)
+                else:
+                    subdir.mkdir(parents=True, exist_ok=True)
+                    (subdir / f"sub-{sub}_ses-{ses}_stat.tsv").write_text("a\n1\n")
+            if layout.sessions == "subdir":
+                (parent / f"sub-{sub}.html").write_text("")
+        if job == "fmriprep":
+            log = jobdir / f"sub-{sub}" / "log" / f"uuid-{sessions[0]}"
+            log.mkdir(parents=True)
+            target = jobdir / f"sub-{sub}" / f"ses-{sessions[0]}" / "fmriprep.toml"
+            target.write_text("")
+            (log / "fmriprep.toml").symlink_to(target)
+
+    # tables rewritten by the post-processing steps
+    rows = "".join(f"{sub}\tV1\t1.5\n{sub}\tV3\t2.5\n" for sub in subs)
+    tables = {
+        "cat12": ["cluster_volumes.tsv"],
+        "freesurfer": ["aparc.tsv", "aseg.tsv", "headers.tsv", "gm_morph.tsv"],
+        "fslanat": ["fslanat.tsv"],
+        "mriqc": ["group_bold.tsv", "group_dwi.tsv", "group_T1w.tsv"],
+    }
+    for table in tables.get(job, []):
+        (jobdir / table).write_text("sub\tses\tvalue\n" + rows)
+    if job == "fcn":
+        (jobdir / "hub_disruption.tsv").write_text(
+            "bids_name\tvalue\n"
+            + "".join(f"sub-{sub}_ses-V1_task-rest\t1\n" for sub in subs)
+        )
+
+
+def make_products(
+    root: Path, n_subjects: int, job_names: typing.Iterable[jobs.STORE_DIR]
+) -> list[int]:
+    """Synthetic products for n_subjects, a tenth of which are not released"""
+    released = datasets.get_recordids()[: n_subjects - n_subjects // 10]
+    withheld = list(range(90000, 90000 + n_subjects // 10))
+    subs = sorted(released + withheld)
+    for job in job_names:
+        make_job(root, job, subs)
+    return released
+
+
+def _syscalls() -> tuple[int, int]:
+    """Read and write syscalls made so far by this process (Linux only)"""
+    try:
+        fields = dict(
+            line.split(": ") for line in Path("/proc/self/io").read_text().splitlines()
+        )
+    except OSError:
+        return (0, 0)
+    return int(fields["syscr"]), int(fields["syscw"])
+
+
+class Timer:
+    def __init__(self) -> None:
+        self.rows: list[dict[str, typing.Any]] = []
+
+    def time(
+        self,
+        job: str,
+        stage: str,
+        f: typing.Callable[[], typing.Any],
+        n: typing.Callable[[typing.Any], int] | None = None,
+    ) -> typing.Any:
+        r0, w0 = _syscalls()
+        start = time.perf_counter()
+        error = result = None
+        try:
+            result = f()
+        except Exception as e:
+            error = repr(e)
+        seconds = time.perf_counter() - start
+        r1, w1 = _syscalls()
+        count = n(result) if n is not None and error is None else None
+        self.rows.append(
+            {
+                "job": job,
+                "stage": stage,
+                "seconds": seconds,
+                "n": count,
+                "per_second": count / seconds if count is not None else None,
+                "read_syscalls": r1 - r0,
+                "write_syscalls": w1 - w0,
+                "error": error,
+            }
+        )
+        logging.info(
+            f"{job} {stage}: {seconds:0.3f} seconds, {count} entries {error or ''}"
+        )
+        return result
+
+
+def run_job(
+    job: jobs.STORE_DIR,
+    *,
+    inroot: Path,
+    outroot: Path,
+    records: list[int],
+    timer: Timer,
+    max_workers: int | None = None,
+) -> pl.DataFrame:
+    layout = jobs.JOBS[job]
+    injobdir = inroot / job
+    outjobdir = outroot / layout.outdir
+    index = timer.time(
+        job, "scan", lambda: scan.scan(injobdir, max_workers=max_workers), len
+    )
+    subs = timer.time(
+        job,
+        "exclude",
+        lambda: exclude.subjects_to_exclude(index, job=layout, records=records),
+        len,
+    )
+    timer.time(
+        job,
+        "prune",
+        lambda: scan.prune(index, injobdir, exclude.ignore_entities(subs)),
+        len,
+    )
+    ops = timer.time(
+        job,
+        "plan",
+        lambda: plan.make_job(job, inroot, outroot, records, max_workers),
+        len,
+    )
+    # directories first, so that linking can be timed on its own
+    for op in ["mkdir", "link"]:
+        todo = ops.filter(pl.col("op") == op)
+        timer.time(
+            job,
+            op,
+            lambda todo=todo: asyncio.run(
+                copy_to_dst_wf.copytree(
+                    injobdir,
+                    outjobdir,
+                    max_workers=max_workers,
+                    index=todo,
+                    dirs_exist_ok=True,
+                )
+            ),
+            lambda _, todo=todo: len(todo),
+        )
+    return plan.mirrored(ops)
+
+
+def run(
+    inroot: Path,
+    outroot: Path,
+    records: list[int],
+    job_names: typing.Sequence[jobs.STORE_DIR],
+    timer: Timer,
+    *,
+    max_workers: int | None = None,
+) -> None:
+    indexes = {
+        job: run_job(
+            job,
+            inroot=inroot,
+            outroot=outroot,
+            records=records,
+            timer=timer,
+            max_workers=max_workers,
+        )
+        for job in job_names
+    }
+    ctx = copy_to_dst_wf.Context(
+        inroot=inroot,
+        outroot=outroot,
+        records=datasets.RecordSet(records),
+        indexes=indexes,
+    )
+    # steps that need jobs which were not run would fail before doing any work
+    for step in copy_to_dst_wf.POST_STEPS:
+        if set(step.needs) <= set(job_names):
+            timer.time(step.name, "post", lambda step=step: step.run(ctx))
+
+    # the bids step stops at participants.tsv without the demographics, so its
+    # parts that only need the release tree are also timed on their own
+    if "bids" in indexes:
+        rawdata = outroot / "rawdata"
+        index = indexes["bids"]
+        for name, f in {
+            "write_sessions": lambda: utils.write_sessions(outdir=rawdata),
+            "update_scans": lambda: utils.update_scans(outdir=rawdata, index=index),
+            "write_events": lambda: utils.write_events(outdir=rawdata, index=index),
+            "clean_sidecars": lambda: utils.clean_sidecars(root=rawdata, index=index),
+        }.items():
+            timer.time("bids", name, f)
+
+
+def save(rows: list[dict[str, typing.Any]], n_subjects: int, dst: Path) -> pl.DataFrame:
+    results = pl.DataFrame(
+        rows, schema={c: RESULTS_SCHEMA[c] for c in rows[0]}
+    ).with_columns(
+        version=pl.lit(snapshot.__version__),
+        timestamp=pl.lit(datetime.now(UTC)),
+        n_subjects=pl.lit(n_subjects),
+    )
+    results = results.select(RESULTS_SCHEMA.names()).cast(RESULTS_SCHEMA)  # type: ignore[arg-type]
+    if dst.exists():
+        previous = pl.read_parquet(dst).cast(RESULTS_SCHEMA)  # type: ignore[arg-type]
+        results = pl.concat([previous, results])
+    results.write_parquet(dst)
+    return results
+
+
+def compare(results: pl.DataFrame) -> pl.DataFrame:
+    """Latest run against the most recent run of a different version"""
+    latest = results.filter(pl.col("timestamp") == pl.col("timestamp").max())
+    version = latest.get_column("version").first()
+    n_subjects = latest.get_column("n_subjects").first()
+    previous = results.filter(
+        pl.col("version") != version, pl.col("n_subjects") == n_subjects
+    )
+    if previous.is_empty():
+        return latest.select("job", "stage", "seconds", "per_second")
+    previous = previous.filter(pl.col("timestamp") == pl.col("timestamp").max())
+    return latest.join(
+        previous.select("job", "stage", "seconds"),
+        on=["job", "stage"],
+        how="left",
+        suffix="_previous",
+    ).select(
+        "job",
+        "stage",
+        "seconds",
+        "seconds_previous",
+        "per_second",
+        change=pl.col("seconds") / pl.col("seconds_previous"),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-subjects", default=100, type=int)
+    parser.add_argument("--jobs", nargs="+", default=list(jobs.STORE_DIRS))
+    parser.add_argument("--max-workers", default=None, type=int)
+    parser.add_argument("--results", default=Path("bench_results.parquet"), type=Path)
+    parser.add_argument("--workdir", default=None, type=Path)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmpdir:
+        inroot = Path(tmpdir) / "products"
+        outroot = Path(tmpdir) / "release"
+        start = time.perf_counter()
+        records = make_products(inroot, args.n_subjects, args.jobs)
+        n_files = sum(len(files) for _, _, files in os.walk(inroot))
+        logging.info(
+            f"Generated {n_files} files for {args.n_subjects} subjects in "
+            f"{time.perf_counter() - start:0.2f} seconds"
+        )
+        timer = Timer()
+        run(inroot, outroot, records, args.jobs, timer, max_workers=args.max_workers)
+
+    results = save(timer.rows, args.n_subjects, args.results)
+    with pl.Config(tbl_rows=-1):
+        print(compare(results))
@@ -0,0 +1,97 @@
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import polars as pl
+
+from snapshot import datasets
+from snapshot.tasks import utils, wide
+
+
+def make_table(dst: Path, n_rows: int, n_columns: int, seed: int = 0) -> list[str]:
+    """mri.tsv-like table, returning the columns described by its data dictionary"""
+    rng = random.Random(seed)  # noqa: S311
+    columns = [f"source_{i}_connectivity" for i in range(n_columns)]
+    with dst.open("w") as f:
+        f.write("\t".join(["sub", "ses", *columns]) + "\n")
+        for row in range(n_rows):
+            values = [f"{rng.uniform(-1, 1):.6f}" for _ in columns]
+            f.write(
+                "\t".join([str(10000 + row // 2), f"V{1 + 2 * (row % 2)}", *values])
+            )
+            f.write("\n")
+    # some columns are not part of the release
+    return ["sub", "ses", *columns[: int(n_columns * 0.9)]]
+
+
+def run(mode: str, src: Path, dictionary: Path, dst: Path) -> None:
+    columns = list(json.loads(dictionary.read_text()))
+    records = datasets.RecordSet(range(10000, 20000, 2))
+    if mode == "inferred":
+        # what write_idps used to do
+        pl.scan_csv(src, separator="\t").filter(pl.col("ses") == "V1").pipe(
+            records.semi_join
+        ).select(*columns).sink_csv(dst, separator="\t")
+    elif mode == "wide":
+        table = wide.read(
+            src,
+            columns,
+            rows=lambda index: index.filter(pl.col("ses") == "V1").pipe(
+                records.semi_join
+            ),
+            null_values=utils.NULLS,
+        )
+        utils.to_bids_tsv(table, dst, formats=["parquet"])
+    elif mode == "read-parquet":
+        pl.read_parquet(dst.with_suffix(".parquet"), columns=columns[:10])
+    else:
+        pl.read_csv(dst, separator="\t", columns=columns[:10])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-rows", default=1000, type=int)
+    parser.add_argument("--n-columns", default=40000, type=int)
+    parser.add_argument("--mode", default=None)
+    parser.add_argument("--workdir", default=None, type=Path)
+
+    args = parser.parse_args()
+
+    if args.mode:
+        start = time.perf_counter()
+        run(
+            args.mode,
+            args.workdir / "src.tsv",
+            args.workdir / "mri.json",
+            args.workdir / "mri.tsv",
+        )
+        elapsed = time.perf_counter() - start
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{args.mode}: {elapsed:0.2f} seconds, {rss:0.0f} MiB peak RSS")
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = Path(tmpdir)
+        columns = make_table(workdir / "src.tsv", args.n_rows, args.n_columns)
+        (workdir / "mri.json").write_text(json.dumps({c: {} for c in columns}))
+        size = (workdir / "src.tsv").stat().st_size / 1024**2
+        print(f"{args.n_rows} rows x {args.n_columns} columns ({size:0.0f} MiB)")
+        # separate processes, so that peak memory is measured per mode
+        for mode in ["inferred", "wide", "read-tsv", "read-parquet"]:
+            subprocess.run(  # noqa: S603
+                [
+                    sys.executable,
+                    __file__,
+                    "--mode",
+                    mode,
+                    "--workdir",
+                    str(workdir),
+                ],
+                check=True,
+            )